@@ -0,0 +1,377 @@
+import bisect
+import importlib.util
+import json
+import lzma
+import os
+import queue
+import socket
+import tarfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+# The tar stream is cut into frames that are compressed independently and concatenated;
+# both xz and zstd decoders read concatenated streams as one file
+FRAME_SIZE = 8 * 1024 * 1024
+XZ_PRESET = 3
+ZSTD_LEVEL = 3
+# Sidecar next to each archive listing its frames and members, so a restore can seek
+INDEX_SUFFIX = ".idx"
+
+
+def compress_xz(data):
+    return lzma.compress(data, format=lzma.FORMAT_XZ, preset=XZ_PRESET)
+
+
+def compress_zstd(data):
+    import zstandard
+
+    # A compressor object is not thread safe, so each frame gets its own
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+
+def decompressor_xz():
+    return lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+
+
+def decompressor_zstd():
+    import zstandard
+
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+# Archive suffix -> frame compressor; zstd needs the optional zstandard module, xz always works
+FORMATS = {"tar.xz": compress_xz}
+DECOMPRESSORS = {"tar.xz": decompressor_xz}
+if importlib.util.find_spec("zstandard") is not None:
+    FORMATS["tar.zst"] = compress_zstd
+    DECOMPRESSORS["tar.zst"] = decompressor_zstd
+
+
+def archive_suffix(path):
+    """Return the format suffix of an archive path, or None if it is not one."""
+    for suffix in ("tar.xz", "tar.zst"):
+        if path.endswith("." + suffix):
+            return suffix
+    return None
+
+
+def member_kind(info):
+    """One-letter type of a tar member as stored in the index."""
+    return "f" if info.isreg() else "d" if info.isdir() else "l" if info.issym() else "h" if info.islnk() else "o"
+
+
+def write_index(path, frames, members):
+    """Store the frame table and member list of an archive in its sidecar index."""
+    tmp_path = path + INDEX_SUFFIX + ".part"
+    with open(tmp_path, "wb") as f:
+        f.write(zlib.compress(json.dumps({"frames": frames, "members": members}, separators=(",", ":")).encode()))
+    os.replace(tmp_path, path + INDEX_SUFFIX)
+
+
+def load_index(path):
+    """Return (frames, members) from the sidecar index of an archive, or None if it has none."""
+    try:
+        with open(path + INDEX_SUFFIX, "rb") as f:
+            index = json.loads(zlib.decompress(f.read()))
+    except FileNotFoundError:
+        return None
+    return index["frames"], index["members"]
+
+
+def scan_frames(path, suffix):
+    """Find the (compressed offset, raw offset) of every frame by decompressing the archive once."""
+    frames = []
+    compressed = raw = 0
+    with open(path, "rb") as f:
+        data = b""
+        decompressor = None
+        while True:
+            if not data:
+                data = f.read(FRAME_SIZE)
+                if not data:
+                    break
+            if decompressor is None:
+                frames.append([compressed, raw])
+                decompressor = DECOMPRESSORS[suffix]()
+            raw += len(decompressor.decompress(data))
+            rest = decompressor.unused_data if decompressor.eof else b""
+            compressed += len(data) - len(rest)
+            data = rest
+            if decompressor.eof:
+                decompressor = None
+    return frames
+
+
+class FrameReader:
+    """Seekable, read-only view of the tar stream inside a framed archive.
+
+    Only the frames covering what is read get decompressed, so reading one member
+    of a large archive costs a frame or two instead of the whole file.
+    """
+
+    def __init__(self, path, frames, suffix):
+        self.file = open(path, "rb")
+        self.frames = frames
+        self.raw_offsets = [raw for _, raw in frames]
+        self.end = os.fstat(self.file.fileno()).st_size
+        self.new_decompressor = DECOMPRESSORS[suffix]
+        self.index = None
+        self.data = b""
+        self.base = 0
+        self.pos = 0
+
+    def load(self, index):
+        start = self.frames[index][0]
+        stop = self.frames[index + 1][0] if index + 1 < len(self.frames) else self.end
+        self.file.seek(start)
+        self.data = self.new_decompressor().decompress(self.file.read(stop - start))
+        self.index = index
+        self.base = self.frames[index][1]
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            raise OSError("Cannot seek from the end of a framed archive")
+        self.pos = offset
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if not self.base <= self.pos < self.base + len(self.data):
+                index = bisect.bisect_right(self.raw_offsets, self.pos) - 1
+                if index < 0 or index == self.index:
+                    break  # Past the end of the last frame
+                self.load(index)
+                if not self.base <= self.pos < self.base + len(self.data):
+                    break
+            start = self.pos - self.base
+            chunk = self.data[start:] if size < 0 else self.data[start:start + size]
+            parts.append(chunk)
+            self.pos += len(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b"".join(parts)
+
+    def close(self):
+        self.file.close()
+
+
+class ArchiveCancelled(Exception):
+    pass
+
+
+class FrameWriter:
+    """File-like sink that compresses fixed-size frames on a thread pool and writes them in order.
+
+    Reading (the caller), compression (the pool) and writing (a dedicated thread) overlap,
+    and at most `workers * 2` frames are in flight so memory stays bounded.
+    """
+
+    def __init__(self, fileobj, compress, workers=None, frame_size=FRAME_SIZE):
+        self.fileobj = fileobj
+        self.compress = compress
+        self.frame_size = frame_size
+        self.workers = workers or os.cpu_count() or 1
+        self.buffer = bytearray()
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.frames = []  # [compressed offset, raw offset] of each frame, for the index
+        self.error = None
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.futures = queue.Queue(maxsize=self.workers * 2)
+        self.writer = threading.Thread(target=self.write_frames, daemon=True)
+        self.writer.start()
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        self.buffer += data
+        while len(self.buffer) >= self.frame_size:
+            self.submit(bytes(self.buffer[:self.frame_size]))
+            del self.buffer[:self.frame_size]
+        return len(data)
+
+    def submit(self, frame):
+        raw_offset = self.raw_bytes
+        self.raw_bytes += len(frame)
+        # Blocks once enough frames are queued, which throttles the reader to the compressors
+        self.futures.put((raw_offset, self.executor.submit(self.compress, frame)))
+
+    def write_frames(self):
+        while True:
+            item = self.futures.get()
+            if item is None:
+                return
+            raw_offset, future = item
+            try:
+                data = future.result()
+                self.frames.append([self.compressed_bytes, raw_offset])
+                self.fileobj.write(data)
+                self.compressed_bytes += len(data)
+            except Exception as e:
+                self.error = e  # Surfaces on the next write() or close()
+
+    def close(self):
+        if self.buffer:
+            self.submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        self.futures.put(None)
+        self.writer.join()
+        self.executor.shutdown()
+        if self.error is not None:
+            raise self.error
+
+
+class MemberReader:
+    """Reads exactly the size a tar header announced from a file that may change underneath.
+
+    tarfile aborts the whole stream when a member comes up short. A file that shrank
+    or failed to read is padded with zeros instead, and the problem is kept in error.
+    """
+
+    def __init__(self, f, size):
+        self.f = f
+        self.remaining = size
+        self.error = None
+
+    def read(self, size):
+        size = min(size, self.remaining)
+        data = b""
+        if self.error is None:
+            try:
+                while len(data) < size:
+                    chunk = self.f.read(size - len(data))
+                    if not chunk:
+                        self.error = "file shrank while it was archived, padded with zeros"
+                        break
+                    data += chunk
+            except OSError as e:
+                self.error = f"{e}, padded with zeros"
+        data += bytes(size - len(data))
+        self.remaining -= size
+        return data
+
+
+class ArchiveResult:
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.compressed_bytes = 0
+        self.errors = []  # List of (path, message) tuples
+        self.members = []  # [name, header offset, type, size, mode, mtime_ns, link target] for the index
+        self.path = None
+
+
+class ArchiveWriter:
+    """Stream sources into one compressed tarball without staging anything on disk."""
+
+    def __init__(self, destination, suffix="tar.xz", workers=None):
+        self.destination = destination
+        self.suffix = suffix
+        self.workers = workers
+        self.running = True
+        self.rules = {}  # Source: compiled rules.Rules
+        self.progress = None  # Optional callable(files, bytes) invoked per archived entry
+
+    def stop(self):
+        self.running = False
+
+    def walk(self, source, result):
+        """Yield (path, archive name) for source and everything below it, parents first."""
+        name = os.path.basename(source)
+        yield source, name
+        rules = self.rules.get(source)
+        stack = [(source, name)]
+        while stack:
+            path, arc_dir = stack.pop()
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        arcname = f"{arc_dir}/{entry.name}"
+                        if rules is not None and rules.excludes(arcname[len(name) + 1:],
+                                                                entry.is_dir(follow_symlinks=False)):
+                            continue
+                        yield entry.path, arcname
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append((entry.path, arcname))
+            except OSError as e:
+                result.errors.append((path, str(e)))
+
+    def record(self, tar, info, result):
+        """Remember where the header of a member starts in the tar stream."""
+        result.members.append([info.name, tar.offset, member_kind(info), info.size, info.mode, int(info.mtime * 1e9),
+                               info.linkname or None])
+
+    def add(self, tar, path, arcname, result):
+        try:
+            info = tar.gettarinfo(path, arcname)
+        except OSError as e:
+            result.errors.append((path, str(e)))
+            return
+        if info is None:
+            return  # Sockets and other types tar cannot store
+        if info.isreg():
+            try:
+                f = open(path, "rb")
+            except OSError as e:
+                result.errors.append((path, str(e)))
+                return
+            with f:
+                self.record(tar, info, result)
+                reader = MemberReader(f, info.size)
+                tar.addfile(info, reader)
+            if reader.error is not None:
+                result.errors.append((path, reader.error))
+            result.files += 1
+            result.bytes += info.size
+        else:
+            self.record(tar, info, result)
+            tar.addfile(info)
+            if not info.isdir():
+                result.files += 1
+        if self.progress is not None and not info.isdir():
+            self.progress(1, info.size)
+
+    def write(self, sources, host=None):
+        """Write all sources to <destination>/<host>-<time>.<suffix> and return an ArchiveResult."""
+        host = host or socket.gethostname()
+        result = ArchiveResult()
+        result.path = os.path.join(self.destination, f"{host}-{time.strftime('%Y%m%dT%H%M%S')}.{self.suffix}")
+        tmp_path = result.path + ".part"
+        try:
+            with open(tmp_path, "wb") as f:
+                sink = FrameWriter(f, FORMATS[self.suffix], self.workers)
+                try:
+                    with tarfile.open(fileobj=sink, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+                        for source in sources:
+                            source = source.rstrip(os.sep) or os.sep
+                            for path, arcname in self.walk(source, result):
+                                if not self.running:
+                                    raise ArchiveCancelled()
+                                self.add(tar, path, arcname, result)
+                finally:
+                    sink.close()
+                result.compressed_bytes = sink.compressed_bytes
+        except ArchiveCancelled:
+            os.unlink(tmp_path)
+            result.path = None
+            return result
+        except BaseException:
+            # Never leave a truncated archive behind that looks like a finished one
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        os.replace(tmp_path, result.path)
+        try:
+            write_index(result.path, sink.frames, result.members)
+        except OSError:
+            pass  # Restores rebuild a missing index by scanning the archive once
+        return result
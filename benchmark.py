@@ -0,0 +1,284 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Engines as (source mode, destination format) for core.BackupRun
+ENGINES = {
+    "cp": ("cp", "mirror"),
+    "rsync": ("rsync", "mirror"),
+    "native": ("native", "mirror"),
+    "snapshots": ("native", "snapshots"),
+    "packs": ("native", "packs"),
+    "chunks": ("native", "chunks"),
+    "tar.xz": ("native", "tar.xz"),
+    "tar.zst": ("native", "tar.zst"),
+}
+TREES = ("dotfiles", "browser", "deep")
+BENCH_DIR = "confback-bench"
+# Fraction a metric may get worse by before compare calls it a regression
+THRESHOLD = 0.10
+
+
+def fill(rng, size):
+    """Half random, half repetitive data, so compressors and deduplication have realistic work."""
+    parts = []
+    while size > 0:
+        block = min(4096, size)
+        parts.append(rng.randbytes(block // 2) + b"\0" * (block - block // 2))
+        size -= block
+    return b"".join(parts)
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def make_dotfiles(root, rng, scale):
+    """Many tiny files in a few hundred folders, like ~/.config."""
+    for app in range(int(200 * scale)):
+        for index in range(rng.randint(5, 45)):
+            write_file(os.path.join(root, f"app{app}", f"conf{index}.ini"), fill(rng, rng.randint(100, 8192)))
+
+
+def make_browser(root, rng, scale):
+    """A few large SQLite-sized files next to a cache of small entries, like a browser profile."""
+    for name in ("places.sqlite", "favicons.sqlite", "cookies.sqlite"):
+        write_file(os.path.join(root, name), fill(rng, int(rng.randint(8, 32) * 1024 * 1024 * scale)))
+    for index in range(int(400 * scale)):
+        write_file(os.path.join(root, "cache2", "entries", f"{index:08X}"), fill(rng, rng.randint(1024, 65536)))
+
+
+def make_deep(root, rng, scale):
+    """Long chains of nested folders with a few files each, for walk and mkdir overhead."""
+    for chain in range(int(20 * scale)):
+        path = os.path.join(root, f"chain{chain}")
+        for depth in range(30):
+            path = os.path.join(path, f"d{depth}")
+            for index in range(3):
+                write_file(os.path.join(path, f"f{index}"), fill(rng, rng.randint(64, 2048)))
+
+
+GENERATORS = {"dotfiles": make_dotfiles, "browser": make_browser, "deep": make_deep}
+
+
+def ensure_tree(base, name, scale, seed):
+    """Generate a tree once per (name, scale, seed) and reuse it on later runs."""
+    root = os.path.join(base, BENCH_DIR, "trees", f"{name}-{scale:g}-{seed}")
+    tree = os.path.join(root, name)
+    marker = os.path.join(root, ".complete")
+    if not os.path.exists(marker):
+        shutil.rmtree(root, ignore_errors=True)
+        GENERATORS[name](tree, random.Random(f"{name}-{seed}"), scale)
+        open(marker, "w").close()
+    return tree
+
+
+def tree_totals(tree):
+    files = size = 0
+    for folder, _, names in os.walk(tree):
+        for name in names:
+            files += 1
+            size += os.lstat(os.path.join(folder, name)).st_size
+    return files, size
+
+
+def run_one(engine, source, destination):
+    """Run a single engine in this process; invoked in a child so its resources can be measured."""
+    from core import BackupRun, PrintLog
+
+    mode, destination_format = ENGINES[engine]
+    error = BackupRun([(source, mode)], destination, PrintLog(quiet=True), destination_format).run()
+    if error:
+        print(error, file=sys.stderr)
+        return 1
+    return 0
+
+
+def measure(engine, source, destination, syscalls=False):
+    """Run an engine in a child process and return (wall seconds, peak RSS in KiB, syscalls or None).
+
+    Wall time runs until what the engine wrote is on disk, so engines that make their
+    copies durable are not timed against ones that leave them in the page cache.
+    """
+    command = [sys.executable, os.path.abspath(__file__), "one", engine, source, destination]
+    if syscalls:
+        with tempfile.NamedTemporaryFile("r", suffix=".strace") as counts:
+            subprocess.run(["strace", "-f", "-c", "-o", counts.name] + command, check=True,
+                           stdout=subprocess.DEVNULL)
+            calls = parse_strace_total(counts.read())
+        # strace slows everything down, so timing comes from a separate clean run
+        shutil.rmtree(destination)
+        os.makedirs(destination)
+    else:
+        calls = None
+    os.sync()  # What earlier runs left in the page cache is not this run's cost
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stderr=subprocess.PIPE)
+    error = process.stderr.read().decode(errors="replace")
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"{engine} failed: {error.strip()}")
+    os.sync()
+    wall = time.perf_counter() - start
+    return wall, usage.ru_maxrss, calls
+
+
+def parse_strace_total(summary):
+    for line in summary.splitlines():
+        fields = line.split()
+        if fields and fields[-1] == "total":
+            return int(fields[3])
+    return None
+
+
+def run_suite(args):
+    engines = [engine for engine in args.engines if ENGINES[engine][0] != "rsync" or shutil.which("rsync")]
+    if "tar.zst" in engines:
+        import archive
+
+        if "tar.zst" not in archive.FORMATS:
+            engines.remove("tar.zst")
+    syscalls = args.syscalls and shutil.which("strace") is not None
+    if args.syscalls and not syscalls:
+        print("strace not found, syscall counts are skipped", file=sys.stderr)
+
+    results = []
+    for target in args.targets:
+        for name in args.trees:
+            tree = ensure_tree(target, name, args.scale, args.seed)
+            files, size = tree_totals(tree)
+            for engine in engines:
+                runs = []
+                for _ in range(args.repeat):
+                    destination = tempfile.mkdtemp(prefix="run-", dir=os.path.join(target, BENCH_DIR))
+                    try:
+                        runs.append(measure(engine, tree, destination, syscalls))
+                        if args.rerun:
+                            runs[-1] += measure(engine, tree, destination)[:1]
+                    finally:
+                        shutil.rmtree(destination, ignore_errors=True)
+                # The median run is the one reported, so one noisy run cannot fake a regression
+                runs.sort()
+                wall, rss, calls = runs[len(runs) // 2][:3]
+                result = {"target": target, "tree": name, "engine": engine, "files": files, "bytes": size,
+                          "wall_s": round(wall, 4), "files_per_s": round(files / wall, 1),
+                          "mb_per_s": round(size / wall / 1e6, 2), "peak_rss_kb": rss, "syscalls": calls}
+                if args.rerun:
+                    result["rerun_wall_s"] = round(runs[len(runs) // 2][3], 4)
+                results.append(result)
+                print(f"{target:16} {name:9} {engine:10} {wall:8.3f} s {result['files_per_s']:10.0f} files/s "
+                      f"{result['mb_per_s']:8.1f} MB/s {rss / 1024:7.1f} MiB", flush=True)
+
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "host": platform.node(), "python": platform.python_version(),
+              "cpus": os.cpu_count(), "scale": args.scale, "seed": args.seed, "results": results}
+    if "chunks" in engines:
+        report["chunking_mb_per_s"] = measure_chunking(16)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        return compare(args.compare, args.output, args.threshold)
+    return 0
+
+
+def compare(baseline_path, current_path, threshold=THRESHOLD):
+    """Print metrics that got worse than threshold against a baseline; return 1 if any did."""
+    with open(baseline_path) as f:
+        baseline = {(r["target"], r["tree"], r["engine"]): r for r in json.load(f)["results"]}
+    with open(current_path) as f:
+        current = json.load(f)["results"]
+
+    regressions = 0
+    for result in current:
+        old = baseline.get((result["target"], result["tree"], result["engine"]))
+        if old is None:
+            continue
+        # Metrics where lower is better
+        for metric in ("wall_s", "rerun_wall_s", "peak_rss_kb", "syscalls"):
+            if not old.get(metric) or result.get(metric) is None:
+                continue
+            change = result[metric] / old[metric] - 1
+            flag = "REGRESSION" if change > threshold else ("improved" if change < -threshold else "")
+            regressions += flag == "REGRESSION"
+            print(f"{result['tree']:9} {result['engine']:10} {metric:13} {old[metric]:>12} -> "
+                  f"{result[metric]:>12} {change:+7.1%} {flag}")
+    print(f"{regressions} regression(s) beyond {threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def measure_chunking(size_mb):
+    """MB/s of the chunk store's content-defined and fixed-size chunking, cutting plus hashing, in memory."""
+    import hashlib
+    import io
+    from chunk_store import CDC_MAX_FILE, iter_chunks
+
+    data = random.Random(1).randbytes(size_mb * 1024 * 1024)
+    figures = {}
+    for name, size in (("content_defined", None), ("fixed", CDC_MAX_FILE + 1)):
+        start = time.perf_counter()
+        for chunk in iter_chunks(io.BytesIO(data), size):
+            hashlib.sha256(chunk)
+        figures[name] = round(len(data) / (time.perf_counter() - start) / 1e6, 2)
+        print(f"{name:16} {figures[name]:10.1f} MB/s", flush=True)
+    return figures
+
+
+def default_targets():
+    """tmpfs for CPU-bound numbers and the temp dir's disk for I/O-bound ones."""
+    targets = ["/dev/shm"] if os.path.isdir("/dev/shm") else []
+    return targets + ["/var/tmp" if os.path.isdir("/var/tmp") else tempfile.gettempdir()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmark", description="Benchmark Confback's engines on synthetic trees.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmark suite")
+    run_parser.add_argument("--trees", nargs="+", choices=TREES, default=list(TREES))
+    run_parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=list(ENGINES))
+    run_parser.add_argument("--targets", nargs="+", default=default_targets(), help="folders to generate and back up in")
+    run_parser.add_argument("--scale", type=float, default=1.0, help="multiply tree sizes")
+    run_parser.add_argument("--seed", type=int, default=1, help="seed of the tree generators")
+    run_parser.add_argument("--repeat", type=int, default=3, help="runs per engine and tree, the median is kept")
+    run_parser.add_argument("--rerun", action="store_true", help="also time a second, unchanged run")
+    run_parser.add_argument("--syscalls", action="store_true", help="count syscalls with strace (extra run)")
+    run_parser.add_argument("-o", "--output", default="benchmark-results.json")
+    run_parser.add_argument("--compare", metavar="BASELINE", help="compare against an earlier results file")
+    run_parser.add_argument("--threshold", type=float, default=THRESHOLD)
+
+    compare_parser = commands.add_parser("compare", help="compare two results files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=THRESHOLD)
+
+    chunking_parser = commands.add_parser("chunking", help="measure the chunk store's cutting speed")
+    chunking_parser.add_argument("--size", type=int, default=16, help="MiB of data to cut")
+
+    one_parser = commands.add_parser("one", help=argparse.SUPPRESS)
+    one_parser.add_argument("engine", choices=list(ENGINES))
+    one_parser.add_argument("source")
+    one_parser.add_argument("destination")
+
+    args = parser.parse_args(argv)
+    if args.command == "one":
+        return run_one(args.engine, args.source, args.destination)
+    if args.command == "compare":
+        return compare(args.baseline, args.current, args.threshold)
+    if args.command == "chunking":
+        measure_chunking(args.size)
+        return 0
+    return run_suite(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
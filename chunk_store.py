@@ -0,0 +1,280 @@
+import hashlib
+import json
+import os
+import socket
+import stat
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Content-defined chunk sizes, chosen for config trees: most files fit in one chunk
+MIN_CHUNK = 16 * 1024
+AVG_CHUNK = 64 * 1024
+MAX_CHUNK = 256 * 1024
+READ_SIZE = 4 * 1024 * 1024
+# Finding cut points runs byte by byte in Python, a few MB/s, so larger files (SQLite
+# databases, mostly, whose pages change in place) are cut into fixed AVG_CHUNK blocks
+CDC_MAX_FILE = 4 * 1024 * 1024
+
+# FastCDC style normalized chunking: a stricter mask before the average size, a looser one after
+MASK_S = (1 << 18) - 1
+MASK_L = (1 << 14) - 1
+
+# Gear table derived from a fixed seed so every machine cuts identical content identically
+GEAR = [int.from_bytes(hashlib.sha256(b"confback-gear-%d" % i).digest()[:4], "little") for i in range(256)]
+
+INDEX_VERSION = 1
+
+
+def find_cut(data, start, end):
+    """Return the offset of the next chunk boundary in data[start:end]."""
+    length = end - start
+    if length <= MIN_CHUNK:
+        return end
+    gear = GEAR
+    h = 0
+    i = start + MIN_CHUNK
+    normal = min(start + AVG_CHUNK, end)
+    limit = min(start + MAX_CHUNK, end)
+    # Shifting left never moves high bits down, so keeping only the bits the masks test
+    # cuts exactly where the full 32-bit hash would
+    for byte in data[i:normal]:
+        h = ((h << 1) + gear[byte]) & MASK_S
+        i += 1
+        if not h:
+            return i
+    for byte in data[i:limit]:
+        h = ((h << 1) + gear[byte]) & MASK_S
+        i += 1
+        if not h & MASK_L:
+            return i
+    return limit
+
+
+def iter_chunks(f, size=None):
+    """Yield the chunks of an open binary file while holding at most a few MiB.
+
+    Chunks are content-defined, unless size says the file is above CDC_MAX_FILE.
+    """
+    if size is not None and size > CDC_MAX_FILE:
+        yield from iter(lambda: f.read(AVG_CHUNK), b"")
+        return
+    buf = b""
+    pos = 0
+    eof = False
+    while True:
+        if not eof and len(buf) - pos < MAX_CHUNK:
+            data = f.read(READ_SIZE)
+            if data:
+                buf = buf[pos:] + data
+                pos = 0
+                continue
+            eof = True
+        if pos >= len(buf):
+            return
+        cut = find_cut(buf, pos, len(buf))
+        yield buf[pos:cut]
+        pos = cut
+
+
+class SnapshotResult:
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.reused = 0  # Files whose chunk list came from the previous snapshot without reading
+        self.new_chunks = 0
+        self.new_bytes = 0
+        self.errors = []  # List of (path, message) tuples
+        self.path = None
+        self.lock = threading.Lock()
+
+    def add_error(self, path, error):
+        with self.lock:
+            self.errors.append((path, str(error)))
+
+
+class ChunkStore:
+    """Deduplicating destination: unique chunks stored once under their hash, snapshots as small indexes.
+
+    Layout below the destination:
+        chunks/ab/abcdef...   one file per unique chunk, named by its SHA-256
+        snapshots/<host>-<time>.idx   zlib compressed JSON index of one backup run
+    """
+
+    def __init__(self, root, workers=None):
+        self.root = root
+        self.chunk_dir = os.path.join(root, "chunks")
+        self.snapshot_dir = os.path.join(root, "snapshots")
+        self.workers = workers or min(16, (os.cpu_count() or 1) * 2)
+        self.running = True
+        self.rules = {}  # Source: compiled rules.Rules
+        self.progress = None  # Optional callable(files, bytes, skipped=False) invoked per finished file
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+
+    def stop(self):
+        self.running = False
+
+    def chunk_path(self, digest):
+        return os.path.join(self.chunk_dir, digest[:2], digest)
+
+    def put_chunk(self, data, result):
+        """Store a chunk unless it is already present and return its digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)  # Atomic, so a concurrent writer of the same chunk is harmless
+        with result.lock:
+            result.new_chunks += 1
+            result.new_bytes += len(data)
+        return digest
+
+    def get_chunk(self, digest):
+        with open(self.chunk_path(digest), "rb") as f:
+            return f.read()
+
+    def snapshots(self, host=None):
+        """Return snapshot index paths, oldest first, optionally only those of one host."""
+        names = sorted(name for name in os.listdir(self.snapshot_dir) if name.endswith(".idx"))
+        if host is not None:
+            names = [name for name in names if name.rsplit("-", 1)[0] == host]
+        return [os.path.join(self.snapshot_dir, name) for name in names]
+
+    @staticmethod
+    def load_snapshot(path):
+        """Return {path: entry dict} for a snapshot index."""
+        with open(path, "rb") as f:
+            index = json.loads(zlib.decompress(f.read()))
+        digests = index["chunks"]
+        entries = {}
+        for rel_path, mode, mtime_ns, size, inode, refs in index["files"]:
+            entries[rel_path] = {"mode": mode, "mtime_ns": mtime_ns, "size": size, "inode": inode,
+                                 "chunks": [digests[ref] for ref in refs]}
+        for rel_path, target in index["links"]:
+            entries[rel_path] = {"mode": stat.S_IFLNK | 0o777, "target": target}
+        return entries
+
+    def write_snapshot(self, path, files, links):
+        digests = {}
+        packed = []
+        for rel_path, entry in sorted(files.items()):
+            refs = [digests.setdefault(digest, len(digests)) for digest in entry["chunks"]]
+            packed.append([rel_path, entry["mode"], entry["mtime_ns"], entry["size"], entry["inode"], refs])
+        index = {"version": INDEX_VERSION, "created": time.time(), "chunks": list(digests),
+                 "files": packed, "links": sorted(links.items())}
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(zlib.compress(json.dumps(index, separators=(",", ":")).encode(), 9))
+        os.replace(tmp_path, path)
+
+    def store_file(self, path, st, result):
+        chunks = []
+        with open(path, "rb") as f:
+            for data in iter_chunks(f, st.st_size):
+                chunks.append(self.put_chunk(data, result))
+        return {"mode": st.st_mode, "mtime_ns": st.st_mtime_ns, "size": st.st_size, "inode": st.st_ino,
+                "chunks": chunks}
+
+    def backup(self, sources, host=None):
+        """Store every file below sources as a new snapshot and return a SnapshotResult."""
+        host = host or socket.gethostname()
+        result = SnapshotResult()
+        previous = self.snapshots(host)
+        previous = self.load_snapshot(previous[-1]) if previous else {}
+        files = {}
+        links = {}
+        pending = threading.BoundedSemaphore(self.workers * 4)
+
+        def task(path, rel_path, st):
+            try:
+                entry = self.store_file(path, st, result)
+            except OSError as e:
+                result.add_error(path, e)
+                return
+            finally:
+                pending.release()
+                if self.progress is not None:
+                    self.progress(1, st.st_size)
+            with result.lock:
+                files[rel_path] = entry
+                result.files += 1
+                result.bytes += st.st_size
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for source in sources:
+                source = source.rstrip(os.sep) or os.sep
+                for path, rel_path, st in self.walk(source, result):
+                    if stat.S_ISLNK(st.st_mode):
+                        try:
+                            links[rel_path] = os.readlink(path)
+                        except OSError as e:
+                            result.add_error(path, e)
+                        continue
+                    old = previous.get(rel_path)
+                    if old and "chunks" in old and (old["size"], old["mtime_ns"], old["inode"]) == \
+                            (st.st_size, st.st_mtime_ns, st.st_ino):
+                        # Unchanged since the last snapshot of this host, its chunks are already stored
+                        with result.lock:
+                            files[rel_path] = old
+                            result.files += 1
+                            result.bytes += st.st_size
+                            result.reused += 1
+                        if self.progress is not None:
+                            self.progress(1, st.st_size, skipped=True)
+                        continue
+                    pending.acquire()
+                    executor.submit(task, path, rel_path, st)
+
+        if self.running:
+            stamp = time.strftime("%Y%m%dT%H%M%S")
+            result.path = os.path.join(self.snapshot_dir, f"{host}-{stamp}.idx")
+            self.write_snapshot(result.path, files, links)
+        return result
+
+    def walk(self, source, result):
+        """Yield (path, snapshot path, stat) for files and symlinks below source."""
+        stack = [(source, os.path.basename(source))]
+        rules = self.rules.get(source)
+        skip = len(os.path.basename(source)) + 1  # Rules see paths relative to the source
+        while stack and self.running:
+            path, rel_dir = stack.pop()
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        rel_path = f"{rel_dir}/{entry.name}"
+                        try:
+                            if rules is not None and rules.excludes(rel_path[skip:], entry.is_dir(follow_symlinks=False)):
+                                continue
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append((entry.path, rel_path))
+                            elif entry.is_file(follow_symlinks=False) or entry.is_symlink():
+                                yield entry.path, rel_path, entry.stat(follow_symlinks=False)
+                        except OSError as e:
+                            result.add_error(entry.path, e)
+            except OSError as e:
+                result.add_error(path, e)
+
+    def restore(self, snapshot_path, target, paths=None):
+        """Rebuild the files of a snapshot below target, optionally only the given snapshot paths."""
+        entries = self.load_snapshot(snapshot_path)
+        for rel_path, entry in entries.items():
+            if paths is not None and rel_path not in paths:
+                continue
+            dst = os.path.join(target, rel_path)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if "target" in entry:
+                if os.path.lexists(dst):
+                    os.unlink(dst)
+                os.symlink(entry["target"], dst)
+                continue
+            with open(dst, "wb") as f:
+                for digest in entry["chunks"]:
+                    f.write(self.get_chunk(digest))
+            os.chmod(dst, stat.S_IMODE(entry["mode"]))
+            os.utime(dst, ns=(entry["mtime_ns"], entry["mtime_ns"]))
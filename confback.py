@@ -0,0 +1,274 @@
+import argparse
+import os
+import signal
+import subprocess
+import sys
+from core import BackupRun, JobError, PrintLog, load_job
+
+# Exit statuses, so cron and systemd can tell a failed backup from a broken job file
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_CANCELLED = 130
+
+# Milliseconds the CLI may spend importing itself and the core; checked by `confback.py startup`
+STARTUP_BUDGET_MS = 50
+STARTUP_SAMPLES = 5
+
+STARTUP_PROBE = (
+    "import sys, time\n"
+    "start = time.perf_counter()\n"
+    "import confback\n"
+    "print((time.perf_counter() - start) * 1000, 'PyQt5' in sys.modules)\n"
+)
+
+
+def run_jobs(paths, quiet=False, show_progress=False, verify=False, verify_only=False, full=False, throttle=None,
+             textfile_dir=None, profile_dir=None):
+    """Run every job file in order and return the exit status of the worst one.
+
+    throttle settings given on the command line override those of the job files.
+    """
+    try:
+        jobs = [load_job(path) for path in paths]
+    except JobError as e:
+        print(e, file=sys.stderr)
+        return EXIT_USAGE
+
+    log = PrintLog(quiet=quiet)
+    progress = None
+    if show_progress:
+        progress = lambda percent, text: print(f"\r{percent:3d}% {text}\033[K", end="", file=sys.stderr, flush=True)
+
+    status = EXIT_OK
+    for job in jobs:
+        backup = BackupRun(job.sources, job.destination, log, job.destination_format, progress=progress,
+                           verify=verify, rules=job.rules, throttle=dict(job.throttle, **(throttle or {})),
+                           name=job.name, textfile_dir=textfile_dir, profile_dir=profile_dir)
+
+        def cancel(signum, frame):
+            log.push(f"Received signal {signum}, stopping {job.name}")
+            backup.stop()
+
+        signal.signal(signal.SIGINT, cancel)
+        signal.signal(signal.SIGTERM, cancel)
+        if verify_only:
+            log.push(f"Verifying job {job.name}")
+            error = backup.run_verify(full)
+        else:
+            log.push(f"Running job {job.name}")
+            error = backup.run()
+        if show_progress:
+            print(file=sys.stderr)
+        if not backup.running:
+            return EXIT_CANCELLED
+        if error:
+            print(f"{job.name}: {error}", file=sys.stderr)
+            status = EXIT_FAILED
+        else:
+            log.push(f"Job {job.name} completed successfully")
+    return status
+
+
+def watch_job(path, quiet=False):
+    """Mirror the sources of a job continuously until interrupted."""
+    from watcher import Watcher
+
+    try:
+        job = load_job(path)
+    except JobError as e:
+        print(e, file=sys.stderr)
+        return EXIT_USAGE
+    if job.destination_format != "mirror":
+        print(f"{job.name}: only mirrors can be kept up to date by watching, "
+              f"not the {job.destination_format} format", file=sys.stderr)
+        return EXIT_USAGE
+    try:
+        watcher = Watcher(job.sources, job.destination, PrintLog(quiet=quiet), rules=job.rules)
+    except OSError as e:
+        print(f"Cannot watch for changes: {e.strerror}", file=sys.stderr)
+        return EXIT_FAILED
+    signal.signal(signal.SIGINT, lambda signum, frame: watcher.stop())
+    signal.signal(signal.SIGTERM, lambda signum, frame: watcher.stop())
+    watcher.run()
+    return EXIT_OK
+
+
+def manage_snapshots(args):
+    """List, diff or prune the hardlinked snapshots in a destination."""
+    import snapshots
+
+    names = snapshots.list_snapshots(args.destination)
+    if args.action == "list":
+        for name in names:
+            print(name)
+    elif args.action == "diff":
+        if len(names) < 2 and not (args.old and args.new):
+            print("Need two snapshots to compare", file=sys.stderr)
+            return EXIT_USAGE
+        old = args.old or names[-2]
+        new = args.new or names[-1]
+        for name in (old, new):
+            if name not in names:
+                print(f"No snapshot named {name}", file=sys.stderr)
+                return EXIT_USAGE
+        for change, path in snapshots.diff_snapshots(args.destination, old, new):
+            print(f"{change:8} {path}")
+    else:
+        for name in snapshots.prune_snapshots(args.destination, args.keep, args.days):
+            print(f"Removed {name}")
+    return EXIT_OK
+
+
+def parse_time(text):
+    """Seconds since the epoch for an ISO date like 2024-05-01 or 2024-05-01T13:30."""
+    from datetime import datetime
+
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a date or time: {text!r}")
+
+
+def parse_limit(text):
+    """Bytes per second for a rate like 500K or 20M."""
+    from throttle import parse_rate
+
+    try:
+        return parse_rate(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a rate: {text!r}, expected e.g. 500K or 20M")
+
+
+def list_backups(destination):
+    import time
+    from restore import find_backups
+
+    for backup in find_backups(destination):
+        created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(backup.created)) if backup.created else "?"
+        print(f"{created}  {backup.kind:9} {backup.name}")
+    return EXIT_OK
+
+
+def find_or_restore(args):
+    """Search a backup of a destination and, given a target, restore the matches."""
+    import restore
+
+    backup = restore.select_backup(restore.find_backups(args.destination), args.backup, args.at)
+    if backup is None:
+        print(f"No matching backup in {args.destination}", file=sys.stderr)
+        return EXIT_USAGE
+    try:
+        entries = backup.load()
+        matches = restore.search(entries, args.patterns, args.since, args.until)
+        if args.command == "find":
+            for entry in matches:
+                print(entry["path"] + ("/" if entry["type"] == "d" else ""))
+            return EXIT_OK
+        if args.patterns or args.since is not None or args.until is not None:
+            matches = restore.with_parents(matches, entries)
+        result = restore.restore(backup, matches, args.target, args.workers)
+    except OSError as e:
+        print(f"Cannot read {backup.name}: {e}", file=sys.stderr)
+        return EXIT_FAILED
+    finally:
+        backup.close()
+    print(f"Restored {result.files} files ({result.bytes} bytes) from {backup.name} to {args.target}")
+    for path, message in result.errors:
+        print(f"Failed to restore {path}: {message}", file=sys.stderr)
+    return EXIT_FAILED if result.errors else EXIT_OK
+
+
+def check_startup(budget_ms=STARTUP_BUDGET_MS):
+    """Measure the import cost of the CLI in fresh interpreters against the budget."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples = []
+    for _ in range(STARTUP_SAMPLES):
+        output = subprocess.run([sys.executable, "-c", STARTUP_PROBE], cwd=here, capture_output=True,
+                                text=True, check=True).stdout.split()
+        if output[1] == "True":
+            print("Importing the core pulled in PyQt5", file=sys.stderr)
+            return EXIT_FAILED
+        samples.append(float(output[0]))
+    median = sorted(samples)[len(samples) // 2]
+    print(f"Startup import cost: {median:.1f} ms (budget {budget_ms} ms)")
+    return EXIT_OK if median <= budget_ms else EXIT_FAILED
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="confback", description="Run Confback backup jobs without the GUI.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run one or more saved job files")
+    run_parser.add_argument("jobs", nargs="+", metavar="JOB", help="JSON job definition")
+    run_parser.add_argument("-q", "--quiet", action="store_true", help="only print errors")
+    run_parser.add_argument("-p", "--progress", action="store_true", help="show progress on stderr")
+    run_parser.add_argument("--verify", action="store_true", help="compare the backup with the sources afterwards")
+    run_parser.add_argument("--limit", type=parse_limit, metavar="RATE", help="limit reading to RATE per second, e.g. 20M")
+    run_parser.add_argument("--files-per-second", type=float, metavar="N", help="copy at most N files per second")
+    run_parser.add_argument("--priority", choices=("normal", "best-effort", "idle"),
+                            help="CPU and I/O priority of the backup")
+    run_parser.add_argument("--adaptive", action="store_true", help="slow down while the system is busy")
+    run_parser.add_argument("--metrics-dir", metavar="DIR",
+                            help="also write run metrics to DIR/confback_<job>.prom for node_exporter")
+    run_parser.add_argument("--profile", metavar="DIR", help="profile the run with cProfile and tracemalloc into DIR")
+
+    verify_parser = commands.add_parser("verify", help="compare the backups of job files with their sources")
+    verify_parser.add_argument("jobs", nargs="+", metavar="JOB", help="JSON job definition")
+    verify_parser.add_argument("-q", "--quiet", action="store_true", help="only print errors")
+    verify_parser.add_argument("-p", "--progress", action="store_true", help="show progress on stderr")
+    verify_parser.add_argument("--full", action="store_true", help="ignore cached hashes and read every file")
+
+    watch_parser = commands.add_parser("watch", help="mirror a job's sources continuously as they change")
+    watch_parser.add_argument("job", metavar="JOB", help="JSON job definition")
+    watch_parser.add_argument("-q", "--quiet", action="store_true", help="only print errors")
+
+    snapshot_parser = commands.add_parser("snapshots", help="list, diff or prune dated snapshots")
+    snapshot_parser.add_argument("action", choices=("list", "diff", "prune"))
+    snapshot_parser.add_argument("destination", help="backup destination holding the snapshots folder")
+    snapshot_parser.add_argument("old", nargs="?", help="diff: older snapshot (default: second newest)")
+    snapshot_parser.add_argument("new", nargs="?", help="diff: newer snapshot (default: newest)")
+    snapshot_parser.add_argument("--keep", type=int, default=30, help="prune: snapshots to keep")
+    snapshot_parser.add_argument("--days", type=float, help="prune: also remove snapshots older than this")
+
+    backups_parser = commands.add_parser("backups", help="list the backups in a destination")
+    backups_parser.add_argument("destination")
+
+    for name, help_text in (("find", "search the files of a backup"), ("restore", "restore files from a backup")):
+        search_parser = commands.add_parser(name, help=help_text)
+        search_parser.add_argument("destination")
+        if name == "restore":
+            search_parser.add_argument("target", help="folder to restore into")
+            search_parser.add_argument("-j", "--workers", type=int, help="parallel writers")
+        search_parser.add_argument("patterns", nargs="*", metavar="GLOB",
+                                   help="path globs; a glob without / matches file names anywhere")
+        search_parser.add_argument("-b", "--backup", help="backup name as shown by 'backups' (default: newest)")
+        search_parser.add_argument("--at", type=parse_time, help="newest backup made at or before this time")
+        search_parser.add_argument("--since", type=parse_time, help="only files modified since this time")
+        search_parser.add_argument("--until", type=parse_time, help="only files modified until this time")
+
+    startup_parser = commands.add_parser("startup", help="check the import cost against the startup budget")
+    startup_parser.add_argument("--budget", type=float, default=STARTUP_BUDGET_MS, help="budget in milliseconds")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        throttle = {"bytes_per_s": args.limit, "files_per_s": args.files_per_second, "priority": args.priority,
+                    "adaptive": args.adaptive or None}
+        return run_jobs(args.jobs, args.quiet, args.progress, verify=args.verify,
+                        throttle={key: value for key, value in throttle.items() if value is not None},
+                        textfile_dir=args.metrics_dir, profile_dir=args.profile)
+    if args.command == "verify":
+        return run_jobs(args.jobs, args.quiet, args.progress, verify_only=True, full=args.full)
+    if args.command == "watch":
+        return watch_job(args.job, args.quiet)
+    if args.command == "backups":
+        return list_backups(args.destination)
+    if args.command in ("find", "restore"):
+        return find_or_restore(args)
+    if args.command == "snapshots":
+        return manage_snapshots(args)
+    return check_startup(args.budget)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
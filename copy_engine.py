@@ -0,0 +1,397 @@
+import errno
+import fcntl
+import os
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from manifest import Manifest
+
+# Chunk handed to the kernel per copy_file_range/sendfile call
+COPY_CHUNK = 8 * 1024 * 1024
+# Files are handed to the pool in batches of up to this many files or bytes, so a
+# tree of tiny files doesn't pay for a future, a semaphore and a lock round per file
+BATCH_FILES = 32
+BATCH_BYTES = 4 * 1024 * 1024
+# Files are copied to this hidden name next to their destination and renamed when complete
+TEMP_SUFFIX = ".confback-part"
+# ioctl that makes dst share src's extents copy-on-write (btrfs, XFS with reflink, bcachefs)
+FICLONE = 0x40049409
+# Errors saying a pair of filesystems cannot clone at all, as opposed to this one file
+NO_CLONE_ERRORS = (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.ENOSYS, errno.EBADF)
+# (source device, destination device): whether FICLONE works between them, learned on first try
+clone_support = {}
+
+
+class CopyResult:
+    """Counters and per-file errors collected during a native copy."""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.skipped = 0  # Files left alone because the manifest says they are unchanged
+        self.errors = []  # List of (path, message) tuples
+        self.updated = []  # List of (relative path, stat, hash, change) tuples for the manifest
+        self.lock = threading.Lock()
+
+    def add_file(self, size, record=None):
+        with self.lock:
+            self.files += 1
+            self.bytes += size
+            if record is not None:
+                self.updated.append(record)
+
+    def add_error(self, path, error):
+        with self.lock:
+            self.errors.append((path, str(error)))
+
+
+def kernel_copy(src_fd, dst_fd, size, offset=0, charge=None):
+    """Copy size bytes from offset in src to dst's position without going through Python buffers.
+
+    charge(bytes), if given, is called after every chunk, e.g. to rate-limit inside large files.
+    """
+    copied = 0
+    use_copy_file_range = hasattr(os, "copy_file_range")
+    while copied < size:
+        count = min(COPY_CHUNK, size - copied)
+        if use_copy_file_range:
+            try:
+                sent = os.copy_file_range(src_fd, dst_fd, count, offset + copied)
+            except OSError:
+                # Cross-device on old kernels or unsupported filesystem, fall back to sendfile
+                use_copy_file_range = False
+                continue
+        else:
+            sent = os.sendfile(dst_fd, src_fd, offset + copied, count)
+        if sent == 0:
+            break  # File shrank while copying
+        copied += sent
+        if charge is not None:
+            charge(sent)
+    return copied
+
+
+def clone_file(src_fd, dst_fd, src_dev):
+    """Try to reflink the whole of src into dst; return whether it worked."""
+    key = (src_dev, os.fstat(dst_fd).st_dev)
+    if clone_support.get(key) is False:
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except OSError as e:
+        if e.errno in NO_CLONE_ERRORS:
+            clone_support[key] = False
+        return False  # EINVAL and the like only rule out this file, e.g. nodatacow on btrfs
+    clone_support[key] = True
+    return True
+
+
+def is_sparse(st):
+    """Whether a file has fewer blocks allocated than its size needs, i.e. has holes."""
+    return st.st_blocks * 512 < st.st_size
+
+
+def copy_range(src_fd, dst_fd, size, offset, sparse, charge=None):
+    """Copy size bytes from offset in src to the same offset in dst; sparse copies only the data.
+
+    Holes are found with SEEK_DATA/SEEK_HOLE and skipped, so they stay holes as long
+    as the caller sizes dst with ftruncate at the end.
+    """
+    if not sparse:
+        return kernel_copy(src_fd, dst_fd, size, offset, charge)
+    end = offset + size
+    position = offset
+    while position < end:
+        try:
+            data = os.lseek(src_fd, position, os.SEEK_DATA)
+            hole = min(os.lseek(src_fd, data, os.SEEK_HOLE), end)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                break  # Only a hole left up to the end of the file
+            # Filesystem without hole support, copy the rest as it is
+            os.lseek(dst_fd, position, os.SEEK_SET)
+            return position - offset + kernel_copy(src_fd, dst_fd, end - position, position, charge)
+        if data >= end:
+            break
+        os.lseek(dst_fd, data, os.SEEK_SET)
+        copied = kernel_copy(src_fd, dst_fd, hole - data, data, charge)
+        if copied < hole - data:
+            return data + copied - offset  # File shrank while copying
+        position = hole
+    os.lseek(dst_fd, end, os.SEEK_SET)
+    return size
+
+
+def copy_file(src, dst, st, offset=0, checkpoint=None, step=None, charge=None):
+    """Copy a single regular file and its permission bits and timestamps.
+
+    On filesystems that support it the copy is a reflink, which shares the data
+    instead of duplicating it; otherwise holes of sparse files are kept. With an
+    offset, a partial dst is continued from there. With a checkpoint, the copy goes
+    in steps and checkpoint(offset) is called once each step is on disk. charge is
+    passed on to kernel_copy.
+    """
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        flags = os.O_WRONLY | os.O_CREAT | (0 if offset else os.O_TRUNC)
+        dst_fd = os.open(dst, flags, stat.S_IMODE(st.st_mode) | stat.S_IWUSR)
+        try:
+            sparse = is_sparse(st)
+            if offset:
+                os.ftruncate(dst_fd, offset)
+                os.lseek(dst_fd, offset, os.SEEK_SET)
+            if not offset and clone_file(src_fd, dst_fd, st.st_dev):
+                copied = os.fstat(dst_fd).st_size
+            elif checkpoint is None:
+                copied = offset + copy_range(src_fd, dst_fd, st.st_size - offset, offset, sparse, charge)
+            else:
+                copied = offset
+                while copied < st.st_size:
+                    sent = copy_range(src_fd, dst_fd, min(step, st.st_size - copied), copied, sparse, charge)
+                    if not sent:
+                        break
+                    copied += sent
+                    if sparse:
+                        os.ftruncate(dst_fd, copied)  # A step ending in a hole still counts in full
+                    os.fdatasync(dst_fd)
+                    checkpoint(copied)
+            if sparse:
+                os.ftruncate(dst_fd, copied)  # Trailing holes were skipped, not written
+            os.fchmod(dst_fd, stat.S_IMODE(st.st_mode))
+            os.utime(dst_fd, ns=(st.st_atime_ns, st.st_mtime_ns))
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    return copied
+
+
+def copy_symlink(src, dst):
+    """Recreate a symlink at the destination, replacing whatever is there."""
+    target = os.readlink(src)
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    os.symlink(target, dst)
+
+
+def needs_copy(st, dst):
+    """Quick check like rsync's: copy unless the destination has the same size and mtime."""
+    try:
+        old = os.lstat(dst)
+    except FileNotFoundError:
+        return True
+    if stat.S_ISLNK(st.st_mode):
+        return True  # Cheap to recreate, and a target change does not touch the mtime
+    return (old.st_size, old.st_mtime_ns) != (st.st_size, st.st_mtime_ns)
+
+
+class NativeCopier:
+    """In-process tree copier: scandir walk plus a bounded pool of kernel-side copies.
+
+    When a Manifest is given, files whose size, mtime and inode match the previous run
+    are skipped and the manifest is updated with what was copied. Folders excluded by
+    rules are not descended into at all.
+    """
+
+    def __init__(self, workers=None, manifest=None, run_id=None, rules=None, journal=None):
+        self.manifest = manifest
+        self.run_id = run_id
+        self.rules = rules  # Compiled rules.Rules of the source, or None
+        # With a journal.Journal, files are committed by rename and an interrupted copy resumes
+        self.journal = journal
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        # Keep at most this many batches queued so huge trees don't pile up futures
+        self.max_pending = self.workers * 4
+        self.running = True
+        self.progress = None  # Optional callable(files, bytes, skipped=False) invoked per finished file
+        self.metrics = None  # Optional metrics.RunMetrics told how long each file took
+        self.charge = None  # Optional callable(bytes) invoked per copied chunk, e.g. throttle.Throttle.charge
+        self.queued = 0  # Files handed to the pool and not finished yet
+        self.queue_lock = threading.Lock()
+
+    def stop(self):
+        self.running = False
+
+    def walk(self, source, result, unlisted=None):
+        """Yield (path, relative path, entry) for everything below source, parents first.
+
+        Folders that cannot be listed are reported in result and, relative to
+        source, appended to unlisted if given.
+        """
+        stack = [""]
+        while stack and self.running:
+            rel_dir = stack.pop()
+            path = os.path.join(source, rel_dir) if rel_dir else source
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        if self.rules is not None and self.rules.excludes(rel_path, is_dir):
+                            continue
+                        if is_dir:
+                            stack.append(rel_path)
+                        yield entry.path, rel_path, entry
+            except OSError as e:
+                result.add_error(path, e)
+                if unlisted is not None:
+                    unlisted.append(rel_dir)
+
+    def queue_depth(self):
+        return self.queued
+
+    def timed_entry(self, src, dst, rel_path, st, change, result):
+        """copy_entry, timed for the metrics; queued counts down when it is done."""
+        started = time.perf_counter()
+        try:
+            self.copy_entry(src, dst, rel_path, st, change, result)
+        finally:
+            if self.metrics is not None:
+                self.metrics.file(src, time.perf_counter() - started, st.st_size)
+            with self.queue_lock:
+                self.queued -= 1
+
+    def copy_entry(self, src, dst, rel_path, st, change, result):
+        try:
+            if stat.S_ISLNK(st.st_mode):
+                copy_symlink(src, dst)
+                result.add_file(0, (rel_path, st, None, change))
+            elif stat.S_ISREG(st.st_mode):
+                if self.journal is None:
+                    size = copy_file(src, dst, st, charge=self.charge)
+                else:
+                    size = self.commit_file(src, dst, rel_path, st)
+                    self.journal.add_done(rel_path, st)
+                result.add_file(size, (rel_path, st, None, change))
+            # Sockets, fifos and device nodes are not copied
+        except InterruptedError:
+            pass  # Stopped inside a large file, the journal knows where to continue
+        except OSError as e:
+            result.add_error(src, e)
+        if self.progress is not None:
+            self.progress(1, st.st_size)
+
+    def commit_file(self, src, dst, rel_path, st):
+        """Copy to a temporary name and rename, so dst is never half written; large files resume.
+
+        Nothing is fsynced per file: the journal makes a whole batch of done files
+        durable at once before it records them.
+        """
+        from journal import PARTIAL_STEP
+
+        tmp = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}{TEMP_SUFFIX}")
+        if st.st_size <= PARTIAL_STEP:
+            size = copy_file(src, tmp, st, charge=self.charge)
+        else:
+            offset = self.journal.resume_offset(rel_path, st)
+            try:
+                if os.path.getsize(tmp) < offset:
+                    offset = 0
+            except OSError:
+                offset = 0
+
+            def checkpoint(copied):
+                self.journal.add_partial(rel_path, copied, st)
+                if not self.running:
+                    raise InterruptedError(src)
+
+            size = copy_file(src, tmp, st, offset, checkpoint, PARTIAL_STEP, charge=self.charge)
+        os.replace(tmp, dst)
+        return size
+
+    def copy_tree(self, source, destination):
+        """Copy source into destination/<basename>, matching `cp -r source destination/`."""
+        result = CopyResult()
+        source = source.rstrip(os.sep) or os.sep
+        target_root = os.path.join(destination, os.path.basename(source))
+        try:
+            os.makedirs(target_root, exist_ok=True)
+        except OSError as e:
+            result.add_error(target_root, e)
+            return result
+
+        known = {}
+        if self.manifest is not None and os.listdir(target_root):
+            # An empty or missing target means the manifest no longer describes it
+            known = self.manifest.load(source)
+
+        pending = threading.BoundedSemaphore(self.max_pending)
+        directories = []
+        unlisted = []
+        batch = []
+        batch_bytes = 0
+
+        def task(entries):
+            try:
+                for index, (src, dst, rel_path, st, change) in enumerate(entries):
+                    if not self.running:
+                        with self.queue_lock:
+                            self.queued -= len(entries) - index
+                        break
+                    self.timed_entry(src, dst, rel_path, st, change, result)
+            finally:
+                pending.release()
+
+        def submit(executor, entries):
+            pending.acquire()
+            with self.queue_lock:
+                self.queued += len(entries)
+            executor.submit(task, entries)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for src, rel_path, entry in self.walk(source, result, unlisted):
+                dst = os.path.join(target_root, rel_path)
+                if entry.is_dir(follow_symlinks=False):
+                    # Directories are created by the walking thread before any child is queued
+                    try:
+                        os.makedirs(dst, exist_ok=True)
+                        directories.append((src, dst))
+                    except OSError as e:
+                        result.add_error(src, e)
+                    continue
+                state = known.pop(rel_path, None)  # Seen, even if it cannot be copied this time
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError as e:
+                    result.add_error(src, e)
+                    continue
+                if Manifest.unchanged(state, st):
+                    result.skipped += 1
+                    if self.progress is not None:
+                        self.progress(1, st.st_size, skipped=True)
+                    continue
+                if self.journal and stat.S_ISREG(st.st_mode) and self.journal.finished(rel_path, st, dst):
+                    # Copied by an interrupted run that never got to update the manifest
+                    result.skipped += 1
+                    with result.lock:
+                        result.updated.append((rel_path, st, None, "added" if state is None else "modified"))
+                    if self.progress is not None:
+                        self.progress(1, st.st_size, skipped=True)
+                    continue
+                batch.append((src, dst, rel_path, st, "added" if state is None else "modified"))
+                batch_bytes += st.st_size
+                if len(batch) >= BATCH_FILES or batch_bytes >= BATCH_BYTES:
+                    submit(executor, batch)
+                    batch, batch_bytes = [], 0
+            if batch:
+                submit(executor, batch)
+
+        if self.manifest is not None:
+            # Anything left in known was not seen by a complete walk, so it disappeared from the source;
+            # below a folder that could not be listed it may well still exist
+            removed = []
+            if self.running and "" not in unlisted:
+                prefixes = tuple(rel_dir + os.sep for rel_dir in unlisted)
+                removed = [rel_path for rel_path in known if not (prefixes and rel_path.startswith(prefixes))]
+            self.manifest.commit(self.run_id, source, result.updated, removed)
+
+        # Directory metadata last, since copying children bumps their mtime
+        for src, dst in [(source, target_root)] + directories[::-1]:
+            try:
+                st = os.stat(src)
+                os.chmod(dst, stat.S_IMODE(st.st_mode))
+                os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+            except OSError as e:
+                result.add_error(src, e)
+        return result
@@ -0,0 +1,720 @@
+# Qt-free backup engine shared by the GUI and the confback command line. Importing it only
+# costs the standard library modules below; engines are imported when a run needs them.
+import json
+import os
+import signal
+import threading
+import time
+
+# Known source modes and destination formats, as stored in job files
+MODES = ("cp", "rsync", "native")
+FORMATS = ("mirror", "snapshots", "packs", "chunks", "tar.xz", "tar.zst")
+# Seconds a cancelled cp or rsync gets to exit after SIGTERM before it is killed
+KILL_DELAY = 5.0
+
+
+class JobError(Exception):
+    """A job definition that cannot be loaded or run."""
+
+
+class PrintLog:
+    """Minimal log sink for headless runs; the GUI passes a LogPipeline instead."""
+
+    def __init__(self, stream=None, quiet=False):
+        self.stream = stream
+        self.quiet = quiet
+
+    def push(self, message):
+        if not self.quiet:
+            print(message, file=self.stream, flush=True)
+
+
+class Job:
+    """A saved backup definition: where to, in which format, and which sources with which mode."""
+
+    def __init__(self, destination, sources, destination_format="mirror", name=None, rules=None, throttle=None):
+        self.destination = destination  # A path, or a list of them for a mirror to several places
+        self.sources = sources  # List of (path, mode) pairs
+        self.destination_format = destination_format
+        self.name = name
+        self.rules = rules or {}  # Source path: list of gitignore-style exclude patterns
+        # bytes_per_s (a number or "20M"), files_per_s, priority and adaptive, see throttle.Throttle
+        self.throttle = throttle or {}
+
+    def to_dict(self):
+        sources = []
+        for path, mode in self.sources:
+            sources.append({"path": path, "mode": mode})
+            if self.rules.get(path):
+                sources[-1]["exclude"] = list(self.rules[path])
+        data = {"name": self.name, "destination": self.destination, "format": self.destination_format,
+                "sources": sources}
+        if self.throttle:
+            data["throttle"] = dict(self.throttle)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        try:
+            sources = [(os.path.expanduser(entry["path"]), entry.get("mode", "native")) for entry in data["sources"]]
+            rules = {os.path.expanduser(entry["path"]): list(entry["exclude"])
+                     for entry in data["sources"] if entry.get("exclude")}
+            destination = data["destination"]
+            if isinstance(destination, list):
+                destination = [os.path.expanduser(path) for path in destination]
+            else:
+                destination = os.path.expanduser(destination)
+            job = cls(destination, sources, data.get("format", "mirror"), data.get("name"),
+                      rules, data.get("throttle"))
+        except (KeyError, TypeError) as e:
+            raise JobError(f"Invalid job definition: missing {e}")
+        for path, mode in job.sources:
+            if mode not in MODES:
+                raise JobError(f"Unknown mode {mode!r} for {path}")
+        if job.destination_format not in FORMATS:
+            raise JobError(f"Unknown destination format {job.destination_format!r}")
+        if isinstance(job.destination, list) and job.destination_format != "mirror":
+            raise JobError("Only mirrors can have several destinations")
+        if job.throttle:
+            from throttle import Throttle
+
+            try:
+                Throttle.from_dict(job.throttle)
+            except (ValueError, TypeError) as e:
+                raise JobError(f"Invalid throttle: {e}")
+        return job
+
+
+def load_job(path):
+    """Read a job definition from a JSON file."""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise JobError(f"Cannot read job file {path}: {e}")
+    job = Job.from_dict(data)
+    job.name = job.name or os.path.splitext(os.path.basename(path))[0]
+    return job
+
+
+def save_job(job, path):
+    with open(path, "w") as f:
+        json.dump(job.to_dict(), f, indent=2)
+
+
+def load_source_list(path):
+    """Read sources from a JSON job file, or from a text file with one "[mode] path" per line.
+
+    Text lines without a mode are native sources; blank lines and # comments are skipped.
+    A text list gives a job without a destination.
+    """
+    if path.endswith(".json"):
+        return load_job(path)
+    sources = []
+    try:
+        with open(path) as f:
+            for number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                mode, _, rest = line.partition(" ")
+                if mode in MODES and rest.strip():
+                    sources.append((os.path.expanduser(rest.strip()), mode))
+                else:
+                    sources.append((os.path.expanduser(line), "native"))
+    except (OSError, UnicodeDecodeError) as e:
+        raise JobError(f"Cannot read source list {path}: {e}")
+    return Job(None, sources, name=os.path.splitext(os.path.basename(path))[0])
+
+
+def save_source_list(job, path):
+    """Write a job as JSON, or for any other extension its sources as a text list."""
+    if path.endswith(".json"):
+        save_job(job, path)
+        return
+    with open(path, "w") as f:
+        for source, mode in job.sources:
+            f.write(f"{mode} {source}\n")
+
+
+class BackupRun:
+    """One backup of a list of (source, mode) jobs to a destination, or to a list of them.
+
+    run() returns None on success or an error summary; details go to log.push()
+    and progress(percent, text) is called at a throttled rate. rules maps sources
+    to gitignore-style exclude patterns, which every engine applies while walking.
+
+    Browser profiles found in a source get their caches excluded; in a mirror or
+    snapshot their SQLite databases are copied by a separate, consistent stage.
+    throttle holds a job's throttle settings, applied to every engine.
+
+    Several destinations are written in one pass: mirrors read each source file once
+    and tee it to all of them. Other formats take a single destination.
+
+    Each run leaves a JSON report of its metrics.RunMetrics in the destination; with
+    textfile_dir also a Prometheus file for node_exporter, and with profile_dir a
+    cProfile and tracemalloc profile of the run.
+    """
+
+    def __init__(self, jobs, destination, log, destination_format="mirror", progress=None, verify=False,
+                 rules=None, throttle=None, name=None, textfile_dir=None, profile_dir=None):
+        from metrics import RunMetrics
+        from profiles import find_profiles, profile_rules
+        from rules import compile_rules
+        from throttle import Throttle
+
+        self.jobs = jobs  # List of (source, mode) pairs
+        self.profiles = {}  # Normalized source: relative paths of the browser profiles in it
+        self.copy_databases = destination_format in ("mirror", "snapshots")
+        lines = {(source.rstrip(os.sep) or os.sep): list(patterns) for source, patterns in (rules or {}).items()}
+        for source, _ in jobs:
+            source = source.rstrip(os.sep) or os.sep
+            profiles = find_profiles(source)
+            if profiles:
+                self.profiles[source] = profiles
+                # User rules come last, so they can re-include what the profile rules exclude
+                lines[source] = profile_rules(profiles, self.copy_databases) + lines.get(source, [])
+        self.rules = compile_rules(lines)  # Normalized source: rules.Rules
+        self.throttle = Throttle.from_dict(throttle)
+        self.log = log  # Anything with push(message), e.g. a LogPipeline
+        self.destinations = list(destination) if isinstance(destination, (list, tuple)) else [destination]
+        self.destination = self.destinations[0]
+        self.destination_format = destination_format
+        self.progress = progress or (lambda percent, text: None)
+        self.verify = verify  # Compare the backup with the sources by content afterwards
+        self.name = name  # Job name, labels the metrics
+        self.textfile_dir = textfile_dir
+        self.profile_dir = profile_dir
+        self.metrics = RunMetrics()
+        self.running = True
+        self.store = None
+        self.databases = []  # A profiles.DatabaseCopier per destination
+        self.snapshot = None
+        self.verifier = None
+        self.scheduler = None
+        self.manifest = None
+        self.run_id = None
+        self.copiers = []
+        self.copy_results = []
+        self.totals = None
+        self.tracker = None
+        self.processes = set()  # Running cp and rsync commands, each in its own process group
+        self.process_lock = threading.Lock()
+        self.resumed = threading.Event()  # Cleared while paused
+        self.resumed.set()
+
+    def run(self):
+        """Back up every source and return None on success or an error summary."""
+        from metrics import Profiler
+
+        profiler = None
+        if self.profile_dir:
+            profiler = Profiler(self.profile_dir, self.name)
+            profiler.start()
+        try:
+            error = self.run_backup()
+        finally:
+            if profiler is not None:
+                for path in profiler.stop(self.metrics):
+                    self.log.push(f"Profile written to {path}")
+        self.save_metrics(error)
+        return error
+
+    def run_backup(self):
+        from progress import ProgressTracker, prescan
+
+        for destination in self.destinations:
+            if not os.path.isdir(destination):
+                return f"Destination {destination} is not a directory"
+        if len(self.destinations) > 1 and self.destination_format != "mirror":
+            return "Several destinations at once are only supported for mirrors"
+        with self.metrics.phase("scan"):
+            self.totals = prescan([source for source, _ in self.jobs], rules=self.rules)
+        self.tracker = ProgressTracker(self.totals, self.progress, gate=self.resumed, throttle=self.throttle)
+        self.log.push(f"Found {self.totals.files} files ({self.totals.bytes} bytes) to back up")
+        with self.metrics.phase("copy"):
+            if self.destination_format == "chunks":
+                error = self.run_chunk_store()
+            elif self.destination_format.startswith("tar."):
+                error = self.run_archive()
+            elif self.destination_format == "snapshots":
+                error = self.run_snapshot()
+            elif self.destination_format == "packs":
+                error = self.run_pack_store()
+            else:
+                error = self.run_mirror()
+        self.tracker.finish()
+        self.metrics.finish(self.tracker.files, self.tracker.done_bytes())
+        if error is None and self.verify and self.running:
+            with self.metrics.phase("verify"):
+                for destination in self.destinations:
+                    self.destination = destination
+                    error = self.run_verify() or error
+            self.destination = self.destinations[0]
+        return error
+
+    def save_metrics(self, error):
+        """Write the run's metrics report to each destination and, if asked, the Prometheus textfile."""
+        from manifest import state_dir
+
+        self.metrics.finished = time.time()
+        status = "cancelled" if not self.running else "failed" if error else "ok"
+        stamp = time.strftime("%Y%m%dT%H%M%S")
+        self.log.push(self.metrics.summary())
+        for destination in self.destinations:
+            if not os.path.isdir(destination):
+                continue
+            try:
+                path = os.path.join(state_dir(destination), f"run-{stamp}.json")
+                self.metrics.save(path, self.name, status, error)
+            except OSError as e:
+                self.log.push(f"Cannot save the run report in {destination}: {e}")
+        if self.textfile_dir:
+            try:
+                self.metrics.write_textfile(self.textfile_dir, self.name, status)
+            except OSError as e:
+                self.log.push(f"Cannot write the metrics textfile: {e}")
+
+    def run_mirror(self):
+        """Back up each source with its own mode through the scheduler."""
+        from functools import partial
+        from manifest import Manifest
+        from scheduler import JobScheduler
+
+        self.scheduler = JobScheduler(self.destination)
+        # A manifest describes one destination; a tee compares each destination itself
+        if (self.snapshot is None and len(self.destinations) == 1
+                and any(self.copies_natively(source, mode) for source, mode in self.jobs)):
+            self.manifest = Manifest(self.destination)
+            self.run_id = self.manifest.begin_run()
+        if self.copy_databases and self.profiles:
+            from profiles import DatabaseCopier
+
+            self.databases = [DatabaseCopier(destination) for destination in self.destinations]
+        for source, mode in self.jobs:
+            self.scheduler.add(source, partial(self.backup_source, source, mode))
+
+        try:
+            report = self.scheduler.run()
+            if self.running:
+                for databases in self.databases:
+                    databases.save()
+            if self.manifest is not None and report.ok:
+                files = sum(result.files for result in self.copy_results)
+                size = sum(result.bytes for result in self.copy_results)
+                self.manifest.finish_run(self.run_id, files, size)
+        finally:
+            if self.manifest is not None:
+                self.manifest.close()
+
+        if report.errors:
+            for result in report.errors:
+                self.log.push(f"Error backing up {result.source}: {result.error}")
+            return f"{len(report.errors)} of {len(report.results)} source(s) failed"
+        return None
+
+    def run_snapshot(self):
+        """Back up into a new dated snapshot that hardlinks files unchanged since the previous one."""
+        from snapshots import SnapshotWriter
+
+        self.snapshot = SnapshotWriter(self.destination)
+        try:
+            if self.snapshot.begin():
+                self.log.push("Continuing the snapshot of an interrupted run")
+        except OSError as e:
+            return f"Cannot create snapshot: {e}"
+        error = self.run_mirror()
+        if not self.running:
+            return error  # The partial snapshot is continued by the next run
+        # Files that failed are missing from it, but the rest is still worth keeping as history
+        try:
+            name = self.snapshot.commit()
+        except OSError as e:
+            return f"Cannot complete snapshot: {e}"
+        base = os.path.basename(self.snapshot.previous) if self.snapshot.previous else None
+        self.log.push(f"Snapshot {name} " + (f"linked against {base}" if base else "is a full copy"))
+        return error
+
+    def run_verify(self, full=False):
+        """Compare the backup in every destination with its sources by content.
+
+        Each destination gets its own JSON report; the error returned is that of
+        the destination with the most mismatches.
+        """
+        from progress import prescan
+
+        if self.destination_format not in ("mirror", "snapshots", "packs"):
+            self.log.push(f"Verification is not available for the {self.destination_format} format")
+            return None
+        self.totals = self.totals or prescan([source for source, _ in self.jobs], rules=self.rules)
+        worst = (0, None)
+        for destination in self.destinations:
+            if not self.running:
+                return None
+            problems, error = self.verify_destination(destination, full)
+            if error and len(self.destinations) > 1:
+                error = f"{destination}: {error}"
+            if error and (worst[1] is None or problems > worst[0]):
+                worst = (problems, error)
+        return worst[1]
+
+    def verify_destination(self, destination, full=False):
+        """Verify one destination and save a JSON report in it, returning (mismatches, error or None).
+
+        Hashes are cached per inode on both sides, so unchanged files are not read
+        again unless full is set.
+        """
+        from manifest import state_dir
+        from progress import ProgressTracker
+        from verify import VerifyReport, Verifier, open_caches
+
+        if self.destination_format == "snapshots":
+            from snapshots import list_snapshots, snapshot_root
+
+            names = list_snapshots(destination)
+            if not names:
+                return 0, "There is no snapshot to verify"
+            snapshot = os.path.join(snapshot_root(destination), names[-1])
+        self.tracker = ProgressTracker(self.totals, self.progress, gate=self.resumed, throttle=self.throttle)
+        source_cache, destination_cache = open_caches(destination)
+        self.verifier = Verifier(source_cache, destination_cache, full=full)
+        self.verifier.progress = self.tracker.add
+        report = VerifyReport()
+        self.log.push("Verifying the backup against the sources")
+        try:
+            if self.destination_format == "packs":
+                from pack_store import PackStore
+
+                store = PackStore(destination)
+                store.rules = self.rules
+                try:
+                    self.verifier.verify_packs(store, [source for source, _ in self.jobs], report)
+                finally:
+                    store.close()
+            else:
+                for source, mode in self.jobs:
+                    source = source.rstrip(os.sep) or os.sep
+                    name = os.path.basename(source)
+                    if self.destination_format == "snapshots":
+                        target = os.path.join(snapshot, name)
+                    else:
+                        target = destination if mode == "rsync" else os.path.join(destination, name)
+                    self.verifier.verify_tree(source, target, report, prefix=name + "/",
+                                              rules=self.rules.get(source))
+        finally:
+            source_cache.close()
+            destination_cache.close()
+        self.tracker.finish()
+        if not self.running:
+            return 0, None
+
+        report_path = os.path.join(state_dir(destination), f"verify-{time.strftime('%Y%m%dT%H%M%S')}.json")
+        report.save(report_path)
+        self.log.push(f"Verified {report.files} files, read {report.bytes_read} bytes, "
+                      f"{report.cached} hashes from cache; report in {report_path}")
+        for mismatch in report.mismatches:
+            self.log.push(f"Mismatch ({mismatch['problem']}): {mismatch['path']}")
+        if report.mismatches:
+            return len(report.mismatches), f"{len(report.mismatches)} file(s) differ from the source"
+        return 0, None
+
+    def run_chunk_store(self):
+        """Store all sources as one deduplicated snapshot, whatever mode they were added with."""
+        from chunk_store import ChunkStore
+
+        self.store = ChunkStore(self.destination)
+        self.store.rules = self.rules
+        self.store.progress = self.tracker.add
+        result = self.store.backup([source for source, _ in self.jobs])
+        self.log.push(f"Snapshot {result.path}: {result.files} files ({result.bytes} bytes), "
+                      f"{result.reused} unchanged, {result.new_chunks} new chunks ({result.new_bytes} bytes)")
+        if result.errors:
+            self.metrics.add_errors(result.errors)
+            for path, message in result.errors:
+                self.log.push(f"Failed to store {path}: {message}")
+            return f"{len(result.errors)} file(s) could not be stored"
+        return None
+
+    def run_pack_store(self):
+        """Append small files of all sources to pack files, copying only the large ones as files."""
+        from pack_store import PackStore
+
+        self.store = PackStore(self.destination)
+        self.store.rules = self.rules
+        self.store.progress = self.tracker.add
+        try:
+            result = self.store.backup([source for source, _ in self.jobs])
+        finally:
+            self.store.close()
+        self.log.push(f"Packed {result.packed} of {result.files} files ({result.bytes} bytes), "
+                      f"{result.unchanged} unchanged")
+        if result.errors:
+            self.metrics.add_errors(result.errors)
+            for path, message in result.errors:
+                self.log.push(f"Failed to store {path}: {message}")
+            return f"{len(result.errors)} file(s) could not be stored"
+        return None
+
+    def run_archive(self):
+        """Stream all sources into a single compressed tarball in the destination."""
+        import archive
+
+        if self.destination_format not in archive.FORMATS:
+            return f"Archive format {self.destination_format} is not available on this system"
+        self.store = archive.ArchiveWriter(self.destination, self.destination_format)
+        self.store.rules = self.rules
+        self.store.progress = self.tracker.add
+        try:
+            result = self.store.write([source for source, _ in self.jobs])
+        except OSError as e:
+            return f"Error writing archive: {e}"
+        if result.path:
+            self.log.push(f"Archive {result.path}: {result.files} files, {result.bytes} bytes "
+                          f"compressed to {result.compressed_bytes}")
+        if result.errors:
+            self.metrics.add_errors(result.errors)
+            for path, message in result.errors:
+                self.log.push(f"Skipped {path}: {message}")
+            return f"{len(result.errors)} file(s) could not be archived"
+        return None
+
+    def backup_source(self, source, mode):
+        """Back up one source, then the databases of its browser profiles, returning an error message or None."""
+        error = self.copy_source(source, mode)
+        key = source.rstrip(os.sep) or os.sep
+        if self.databases and key in self.profiles and self.running:
+            for databases in self.databases:
+                error = self.backup_databases(databases, key, mode) or error
+        return error
+
+    def backup_databases(self, databases, source, mode):
+        """Copy the SQLite databases of the profiles in a source with the sqlite3 backup API."""
+        from profiles import DatabaseResult
+
+        name = os.path.basename(source)
+        if self.snapshot is not None:
+            target = os.path.join(self.snapshot.path, name)
+            previous = os.path.join(self.snapshot.previous, name) if self.snapshot.previous else None
+        else:
+            destination = databases.destination
+            target = destination if mode == "rsync" else os.path.join(destination, name)
+            previous = None
+        result = databases.copy(source, self.profiles[source], target, DatabaseResult(),
+                                self.rules.get(source), previous)
+        self.log.push(f"{source}: backed up {result.files} browser databases ({result.bytes} bytes), "
+                      f"{result.unchanged} unchanged")
+        for path, message in result.plain:
+            self.log.push(f"Copied {path} as a plain file, it may be inconsistent: {message}")
+        if result.errors:
+            self.metrics.add_errors(result.errors)
+            for path, message in result.errors:
+                self.log.push(f"Failed to back up {path}: {message}")
+            return f"{len(result.errors)} database(s) failed"
+        return None
+
+    def copy_source(self, source, mode):
+        """Copy one source with its mode, returning an error message or None."""
+        import subprocess
+
+        if not self.running:
+            return None
+        if len(self.destinations) > 1:
+            return self.run_fanout(source, mode)
+        if self.copies_natively(source, mode):
+            return self.run_incremental(source)
+
+        rules = self.rules.get(source.rstrip(os.sep) or os.sep)
+        excludes = f" {rules.rsync_args()}" if rules else ""
+        prefix = limit = ""
+        if self.throttle is not None:
+            # Rate-limited runs copy cp sources natively, so cp here only needs the priority
+            prefix = self.throttle.command_prefix()
+            limit = self.throttle.rsync_args(sum(mode == "rsync" for _, mode in self.jobs))
+        if mode == "cp":
+            command = f"{prefix}cp -r --reflink=auto --sparse=auto {source} {self.destination}/"
+        elif self.snapshot is not None:
+            # Each source gets its own folder in a snapshot, as with the other modes
+            link_dest = self.snapshot.link_dest(source)
+            link = f" --link-dest={link_dest}" if link_dest else ""
+            target = os.path.join(self.snapshot.path, os.path.basename(source.rstrip(os.sep)))
+            command = f"{prefix}rsync -a --sparse --info=progress2 --partial-dir=.rsync-partial{link}{limit}{excludes} {source}/ {target}/"
+        else:  # rsync
+            # Plain byte counts, no -h, so progress2 lines can be parsed exactly; an interrupted
+            # transfer leaves its partial file in the partial dir for the next run to continue
+            command = (f"{prefix}rsync -a --sparse --info=progress2 --partial-dir=.rsync-partial{limit}{excludes} "
+                       f"{source}/ {self.destination}/")
+
+        # A session of its own lets stop() and pause() signal the shell and everything it started
+        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                   start_new_session=True)
+        with self.process_lock:
+            self.processes.add(process)
+        # stop() or pause() may have come in between starting the process and registering it
+        if not self.running:
+            self.terminate(process)
+        elif not self.resumed.is_set():
+            self.signal_group(process, signal.SIGSTOP)
+
+        try:
+            while True:
+                output = process.stdout.readline()
+                if output == '' and process.poll() is not None:
+                    break
+                if output and not self.parse_progress(output, source):
+                    self.log_output(output)
+            result = process.communicate()
+        finally:
+            with self.process_lock:
+                self.processes.discard(process)
+        if not self.running:
+            return None  # Cancelled, not failed
+        if process.returncode != 0:
+            self.metrics.add_error(f"{mode} exit {process.returncode}")
+            return result[1].strip()
+        # cp reports nothing while it runs, so its share arrives when it is done
+        self.tracker.complete_job(source, *self.totals.per_source.get(source, (0, 0)))
+        return None
+
+    def copies_natively(self, source, mode):
+        """Whether a source goes through the in-process copier instead of an external command.
+
+        cp can neither link against a previous snapshot, nor skip excluded paths, nor
+        keep to a rate limit.
+        """
+        if mode == "cp":
+            return (self.snapshot is not None or (source.rstrip(os.sep) or os.sep) in self.rules
+                    or (self.throttle is not None and self.throttle.limits_rate))
+        return mode == "native"
+
+    def run_incremental(self, source):
+        """Copy a source with the in-process engine, skipping files the manifest knows are unchanged."""
+        from copy_engine import NativeCopier
+        from journal import Journal, journal_path
+
+        key = source.rstrip(os.sep) or os.sep
+        rules = self.rules.get(key)
+        journal = Journal(journal_path(self.destination, ("snapshot:" if self.snapshot else "mirror:") + key))
+        if journal:
+            self.log.push(f"{source}: resuming an interrupted copy")
+        if self.snapshot is not None:
+            copier = self.snapshot.copier(rules=rules, journal=journal)
+            destination = self.snapshot.path
+        else:
+            copier = NativeCopier(manifest=self.manifest, run_id=self.run_id, rules=rules, journal=journal)
+            destination = self.destination
+        copier.progress = self.tracker.add
+        copier.metrics = self.metrics
+        if self.throttle is not None:
+            copier.charge = self.throttle.charge
+        self.metrics.watch(f"copy:{key}", copier.queue_depth)
+        self.copiers.append(copier)
+        try:
+            result = copier.copy_tree(source, destination)
+        finally:
+            if self.running:
+                journal.remove()
+            else:
+                journal.close()
+        self.copy_results.append(result)
+        self.log.push(f"{source}: copied {result.files} files ({result.bytes} bytes), "
+                      f"{result.skipped} unchanged")
+        if result.errors:
+            self.metrics.add_errors(result.errors)
+            for path, message in result.errors:
+                self.log.push(f"Failed to copy {path}: {message}")
+            return f"{len(result.errors)} file(s) failed"
+        return None
+
+    def run_fanout(self, source, mode):
+        """Copy a source to every destination at once, reading it a single time.
+
+        Whatever its mode, a source lands where that mode would put it.
+        """
+        from fanout import TeeCopier
+
+        key = source.rstrip(os.sep) or os.sep
+        roots = [destination if mode == "rsync" else os.path.join(destination, os.path.basename(key))
+                 for destination in self.destinations]
+        copier = TeeCopier(rules=self.rules.get(key))
+        copier.progress = self.tracker.add
+        copier.metrics = self.metrics
+        if self.throttle is not None:
+            copier.charge = self.throttle.charge
+        self.metrics.watch(f"read:{key}", copier.queue_depth)
+        self.metrics.watch(f"write:{key}", copier.write_depth)
+        self.copiers.append(copier)
+        failed = 0
+        for destination, result in zip(self.destinations, copier.tee_tree(source, roots)):
+            self.log.push(f"{source} -> {destination}: copied {result.files} files ({result.bytes} bytes), "
+                          f"{result.skipped} unchanged")
+            self.metrics.add_errors(result.errors)
+            for path, message in result.errors:
+                self.log.push(f"Failed to copy {path} to {destination}: {message}")
+            failed += bool(result.errors)
+        if failed:
+            return f"copying failed for {failed} of {len(self.destinations)} destination(s)"
+        return None
+
+    def parse_progress(self, output, source):
+        """Feed an rsync progress2 line to the tracker, returning whether it was one."""
+        from progress import parse_rsync_progress
+
+        transferred = parse_rsync_progress(output)
+        if transferred is None:
+            return False
+        self.tracker.set_job(source, transferred)
+        return True
+
+    def log_output(self, output):
+        self.log.push(output.rstrip())
+
+    def signal_group(self, process, signum):
+        # The whole group, not just the shell: its children may outlive it or ignore SIGTERM
+        try:
+            os.killpg(process.pid, signum)
+        except ProcessLookupError:
+            pass  # Every process of the group has exited
+
+    def terminate(self, process):
+        """Ask a command's process group to exit and kill it if it has not after KILL_DELAY."""
+        self.signal_group(process, signal.SIGTERM)
+        self.signal_group(process, signal.SIGCONT)  # A paused process only acts on SIGTERM once continued
+        timer = threading.Timer(KILL_DELAY, self.signal_group, (process, signal.SIGKILL))
+        timer.daemon = True
+        timer.start()
+
+    def pause(self):
+        """Suspend the run: commands are stopped, in-process engines halt after their current file."""
+        self.resumed.clear()
+        with self.process_lock:
+            processes = list(self.processes)
+        for process in processes:
+            self.signal_group(process, signal.SIGSTOP)
+
+    def resume(self):
+        with self.process_lock:
+            processes = list(self.processes)
+        for process in processes:
+            self.signal_group(process, signal.SIGCONT)
+        self.resumed.set()
+
+    def stop(self):
+        """Cancel the run without waiting for it; run() returns soon after."""
+        self.running = False
+        with self.process_lock:
+            processes = list(self.processes)
+        for process in processes:
+            self.terminate(process)
+        self.resumed.set()  # Paused engines have to wake up to notice
+        if self.throttle is not None:
+            self.throttle.stop()
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        if self.store is not None:
+            self.store.stop()
+        for copier in self.copiers:
+            copier.stop()
+        for databases in self.databases:
+            databases.stop()
+        if self.verifier is not None:
+            self.verifier.stop()
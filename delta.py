@@ -0,0 +1,170 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import zlib
+
+# Block granularity of signatures; small enough to isolate rewritten SQLite pages,
+# large enough that a signature stays around 0.1% of the file
+BLOCK_SIZE = 16 * 1024
+STRONG_SIZE = 16
+ADLER_MOD = 65521
+
+SIGNATURE_MAGIC = b"CBS1"
+PATCH_MAGIC = b"CBD1"
+
+# Recipe operations
+COPY = 0  # [COPY, first block of the base, block count]
+DATA = 1  # [DATA, offset into the literal data, length]
+
+
+def strong_hash(data):
+    return hashlib.blake2b(data, digest_size=STRONG_SIZE).digest()
+
+
+def scan_file(path, block_size=BLOCK_SIZE):
+    """Read a file once and return (sha256 hex digest, signature bytes)."""
+    digest = hashlib.sha256()
+    parts = [SIGNATURE_MAGIC, struct.pack("<I", block_size)]
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+            parts.append(struct.pack("<I", zlib.adler32(block)))
+            parts.append(strong_hash(block))
+    return digest.hexdigest(), b"".join(parts)
+
+
+def parse_signature(signature):
+    """Return (block size, {weak: [(strong, block index), ...]}) for a signature."""
+    if signature[:4] != SIGNATURE_MAGIC:
+        raise ValueError("Not a block signature")
+    block_size, = struct.unpack_from("<I", signature, 4)
+    blocks = {}
+    record = 4 + STRONG_SIZE
+    for index, offset in enumerate(range(8, len(signature), record)):
+        weak, = struct.unpack_from("<I", signature, offset)
+        blocks.setdefault(weak, []).append((signature[offset + 4:offset + record], index))
+    return block_size, blocks
+
+
+def match_block(blocks, weak, window):
+    candidates = blocks.get(weak)
+    if not candidates:
+        return None
+    strong = strong_hash(window)
+    for candidate, index in candidates:
+        if candidate == strong:
+            return index
+    return None
+
+
+def aligned_unmatched(data, size, block_size, blocks):
+    """Bytes of data in block-aligned windows that match no block of the signature.
+
+    One C-level checksum per block, so a file rewritten throughout is recognised
+    long before the byte-by-byte scan would give up on it.
+    """
+    unmatched = 0
+    for pos in range(0, size, block_size):
+        window = data[pos:pos + block_size]
+        if match_block(blocks, zlib.adler32(window), window) is None:
+            unmatched += len(window)
+    return unmatched
+
+
+def make_delta(path, signature, max_literal=None):
+    """Return (recipe, literal data) that rebuild path from the file the signature describes.
+
+    Matching blocks are found with a rolling Adler-32, so unchanged data costs one
+    C-level checksum per block and only changed regions are scanned byte by byte.
+    Returns None as soon as more than max_literal bytes would have to be sent, and
+    without rolling at all when too few blocks match at their aligned offsets:
+    SQLite and most other rewritten-in-place files keep their unchanged blocks
+    aligned, and rolling through a wholly rewritten file is slow.
+    """
+    block_size, blocks = parse_signature(signature)
+    recipe = []
+    literal = bytearray()
+    size = os.path.getsize(path)
+    if size == 0:
+        return recipe, bytes(literal)
+
+    def emit_copy(index):
+        if recipe and recipe[-1][0] == COPY and recipe[-1][1] + recipe[-1][2] == index:
+            recipe[-1][2] += 1
+        else:
+            recipe.append([COPY, index, 1])
+
+    def emit_data(start, end):
+        if start == end:
+            return
+        if recipe and recipe[-1][0] == DATA and recipe[-1][1] + recipe[-1][2] == len(literal):
+            recipe[-1][2] += end - start
+        else:
+            recipe.append([DATA, len(literal), end - start])
+        literal.extend(data[start:end])
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if max_literal is not None and aligned_unmatched(data, size, block_size, blocks) > max_literal:
+            return None
+        pos = 0
+        pending = 0  # Start of bytes not matched yet
+        weak = None
+        while pos + block_size <= size:
+            if weak is None:
+                weak = zlib.adler32(data[pos:pos + block_size])
+            index = match_block(blocks, weak, data[pos:pos + block_size])
+            if index is not None:
+                emit_data(pending, pos)
+                emit_copy(index)
+                pos += block_size
+                pending = pos
+                weak = None
+                continue
+            if max_literal is not None and len(literal) + pos - pending > max_literal:
+                return None
+            # Roll the window one byte forward
+            out_byte = data[pos]
+            in_byte = data[pos + block_size] if pos + block_size < size else None
+            pos += 1
+            if in_byte is None:
+                break
+            a = ((weak & 0xFFFF) - out_byte + in_byte) % ADLER_MOD
+            b = ((weak >> 16) - block_size * out_byte + a - 1) % ADLER_MOD
+            weak = (b << 16) | a
+        # A short tail can still equal the last, short block of the old file
+        tail = data[pending:size]
+        index = match_block(blocks, zlib.adler32(tail), tail) if 0 < len(tail) < block_size else None
+        if index is not None:
+            emit_copy(index)
+        else:
+            emit_data(pending, size)
+    if max_literal is not None and len(literal) > max_literal:
+        return None
+    return recipe, bytes(literal)
+
+
+def encode_patch(base_key, size, sha256, recipe, literal, block_size):
+    header = json.dumps({"base": base_key, "size": size, "sha256": sha256, "block_size": block_size,
+                         "recipe": recipe}, separators=(",", ":")).encode()
+    return PATCH_MAGIC + struct.pack("<I", len(header)) + header + zlib.compress(literal, 1)
+
+
+def decode_patch(patch):
+    """Return (header dict, literal data) of an encoded patch."""
+    if patch[:4] != PATCH_MAGIC:
+        raise ValueError("Not a delta patch")
+    length, = struct.unpack_from("<I", patch, 4)
+    header = json.loads(patch[8:8 + length])
+    return header, zlib.decompress(patch[8 + length:])
+
+
+def apply_patch(header, literal, read_base, out):
+    """Write the new file to out, reading unchanged blocks through read_base(offset, length)."""
+    block_size = header["block_size"]
+    for op, start, count in header["recipe"]:
+        if op == COPY:
+            out.write(read_base(start * block_size, count * block_size))
+        else:
+            out.write(literal[start:start + count])
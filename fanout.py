@@ -0,0 +1,231 @@
+import os
+import queue
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from copy_engine import TEMP_SUFFIX, CopyResult, NativeCopier, copy_symlink, needs_copy
+
+# Files are read and handed to the destinations in pieces of this size
+CHUNK = 1024 * 1024
+# Writer threads per destination; a file always goes to the same one, in order
+WRITERS = 4
+# How far, in bytes, a destination may fall behind the reads before it holds them up
+MAX_LAG = 64 * 1024 * 1024
+
+
+def temp_path(dst):
+    return os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}{TEMP_SUFFIX}")
+
+
+class Target:
+    """One destination of a tee: its own writer threads, each with a bounded queue."""
+
+    def __init__(self, root, max_lag):
+        self.root = root
+        self.result = CopyResult()
+        self.queues = [queue.Queue(max(1, max_lag // CHUNK // WRITERS)) for _ in range(WRITERS)]
+        self.threads = [threading.Thread(target=self.write_loop, args=(q,), daemon=True) for q in self.queues]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, dst, st, offset, data, last):
+        """Queue a piece of a file; data None abandons a file the source could not be read for."""
+        self.queues[hash(dst) % WRITERS].put((dst, st, offset, data, last))
+
+    def write_loop(self, pieces):
+        open_files = {}  # dst: descriptor of its temporary file
+        while True:
+            item = pieces.get()
+            if item is None:
+                break
+            dst, st, offset, data, last = item
+            tmp = temp_path(dst)
+            try:
+                if data is None:
+                    fd = open_files.pop(dst, None)
+                    if fd is not None:
+                        os.close(fd)
+                        os.unlink(tmp)
+                    continue
+                if offset == 0:
+                    open_files[dst] = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                                              stat.S_IMODE(st.st_mode) | stat.S_IWUSR)
+                fd = open_files.get(dst)
+                if fd is None:
+                    continue  # Failed earlier, the error is recorded
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+                if last:
+                    del open_files[dst]
+                    try:
+                        os.fchmod(fd, stat.S_IMODE(st.st_mode))
+                    finally:
+                        os.close(fd)
+                    os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+                    os.replace(tmp, dst)
+                    self.result.add_file(st.st_size)
+            except Exception as e:
+                # A failing destination keeps draining its queue, so it never blocks the others
+                fd = open_files.pop(dst, None)
+                if fd is not None:
+                    try:
+                        os.close(fd)
+                    except OSError:
+                        pass
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+                self.result.add_error(dst, e)
+
+    def queue_depth(self):
+        """Pieces written to no file yet."""
+        return sum(pieces.qsize() for pieces in self.queues)
+
+    def close(self):
+        for pieces in self.queues:
+            pieces.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+class TeeCopier(NativeCopier):
+    """Copies a source to several destinations at once, reading every file a single time.
+
+    A pool of readers reads each file that at least one destination lacks (same
+    quick size and mtime check as rsync) and hands the pieces to the writers of
+    those destinations. Each destination buffers at most max_lag bytes, so a slow
+    one only holds up the reads once it is that far behind. Files are written to
+    a temporary name and renamed, like the journaled native copy.
+    """
+
+    def __init__(self, workers=None, rules=None, max_lag=MAX_LAG):
+        super().__init__(workers=workers, rules=rules)
+        self.max_lag = max_lag
+        self.targets = []
+
+    def write_depth(self):
+        """Pieces waiting for the slowest destination."""
+        return max([target.queue_depth() for target in self.targets if isinstance(target, Target)], default=0)
+
+    def read_file(self, src, rel_path, st, targets):
+        """Read one file and pass it on to the targets that need it."""
+        started = time.perf_counter()
+        dsts = [(target, os.path.join(target.root, rel_path)) for target in targets]
+        offset = 0
+        try:
+            with open(src, "rb", buffering=0) as f:
+                while True:
+                    data = f.read(CHUNK)
+                    if self.charge is not None:
+                        self.charge(len(data))
+                    last = len(data) < CHUNK
+                    for target, dst in dsts:
+                        target.put(dst, st, offset, data, last)
+                    offset += len(data)
+                    if last:
+                        break
+        except OSError as e:
+            for target, dst in dsts:
+                if offset:
+                    target.put(dst, st, offset, None, True)
+                target.result.add_error(src, e)
+        if self.metrics is not None:
+            # Until the last piece is queued, so holding up for a slow destination counts too
+            self.metrics.file(src, time.perf_counter() - started, st.st_size)
+        if self.progress is not None:
+            self.progress(1, st.st_size)
+
+    def tee_tree(self, source, roots):
+        """Copy source into every root, which is where the source's contents go; return a CopyResult per root."""
+        source = source.rstrip(os.sep) or os.sep
+        self.targets = targets = []
+        for root in roots:
+            try:
+                os.makedirs(root, exist_ok=True)
+                targets.append(Target(root, self.max_lag))
+            except OSError as e:
+                result = CopyResult()
+                result.add_error(root, e)
+                targets.append(result)
+        live = [target for target in targets if isinstance(target, Target)]
+        pending = threading.BoundedSemaphore(self.max_pending)
+        directories = []
+        walk_result = CopyResult()
+
+        def task(*args):
+            try:
+                self.read_file(*args)
+            finally:
+                with self.queue_lock:
+                    self.queued -= 1
+                pending.release()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for src, rel_path, entry in self.walk(source, walk_result):
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError as e:
+                        walk_result.add_error(src, e)
+                        continue
+                    if stat.S_ISDIR(st.st_mode):
+                        for target in live:
+                            try:
+                                os.makedirs(os.path.join(target.root, rel_path), exist_ok=True)
+                            except OSError as e:
+                                target.result.add_error(src, e)
+                        directories.append((src, rel_path))
+                        continue
+                    if not (stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode)):
+                        continue
+                    behind = [target for target in live if needs_copy(st, os.path.join(target.root, rel_path))]
+                    if stat.S_ISLNK(st.st_mode):
+                        for target in behind:
+                            try:
+                                copy_symlink(src, os.path.join(target.root, rel_path))
+                                target.result.add_file(0)
+                            except OSError as e:
+                                target.result.add_error(src, e)
+                        if self.progress is not None:
+                            self.progress(1, 0)
+                        continue
+                    if not behind:
+                        for target in live:
+                            with target.result.lock:
+                                target.result.skipped += 1
+                        if self.progress is not None:
+                            self.progress(1, st.st_size, skipped=True)
+                        continue
+                    for target in live:
+                        if target not in behind:
+                            with target.result.lock:
+                                target.result.skipped += 1
+                    pending.acquire()
+                    with self.queue_lock:
+                        self.queued += 1
+                    executor.submit(task, src, rel_path, st, behind)
+        finally:
+            for target in live:
+                target.close()
+
+        # Directory metadata last, since writing children bumps their mtime
+        for src, rel_path in [(source, "")] + directories[::-1]:
+            try:
+                st = os.stat(src)
+            except OSError as e:
+                walk_result.add_error(src, e)
+                continue
+            for target in live:
+                dst = os.path.join(target.root, rel_path) if rel_path else target.root
+                try:
+                    os.chmod(dst, stat.S_IMODE(st.st_mode))
+                    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+                except OSError as e:
+                    target.result.add_error(src, e)
+        results = [target.result if isinstance(target, Target) else target for target in targets]
+        for result in results:
+            result.errors += walk_result.errors  # Unreadable folders are missing everywhere
+        return results
@@ -0,0 +1,126 @@
+import ctypes
+import hashlib
+import json
+import os
+import threading
+import time
+from manifest import state_dir
+
+JOURNAL_DIR = "journal"
+# Done files made durable together, and the longest a batch may stay open
+SYNC_RECORDS = 256
+SYNC_SECONDS = 1.0
+# Large files are committed to disk and their offset journaled after every step this big
+PARTIAL_STEP = 64 * 1024 * 1024
+# libc's syncfs once looked up, False where there is none
+syncfs = None
+
+
+def sync_filesystem(fd):
+    """Write out everything cached for the filesystem fd is on, falling back to every filesystem."""
+    global syncfs
+    if syncfs is None:
+        libc = ctypes.CDLL(None, use_errno=True)
+        syncfs = getattr(libc, "syncfs", False)
+    if not syncfs or syncfs(fd) != 0:
+        os.sync()
+
+
+def journal_path(destination, key):
+    """Journal file of one source in a destination; key tells apart what is copied where."""
+    folder = os.path.join(state_dir(destination), JOURNAL_DIR)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, hashlib.blake2b(key.encode(), digest_size=8).hexdigest() + ".log")
+
+
+class Journal:
+    """Append-only log of what a copy has finished, so an interrupted copy can pick up where it stopped.
+
+    Each line is a JSON record: ["done", path, size, mtime_ns] for a file that was
+    copied and renamed into place, ["partial", path, offset, size, mtime_ns] for the
+    part of a large file that is on disk. Done files are held back and made durable
+    a batch at a time, with one syncfs of the destination, before their lines are
+    written and fsynced, so no file is fsynced on its own. A torn last line after a
+    crash is ignored. The journal is removed once a copy completes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = {}  # Path: (size, mtime_ns)
+        self.partial = {}  # Path: (offset, size, mtime_ns)
+        self.load()
+        self.lock = threading.Lock()
+        self.file = open(path, "a")
+        self.pending = []  # Done records whose files may not be on disk yet
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Cut short by a crash
+                    if record[0] == "done":
+                        self.done[record[1]] = tuple(record[2:])
+                        self.partial.pop(record[1], None)
+                    elif record[0] == "partial":
+                        self.partial[record[1]] = tuple(record[2:])
+        except FileNotFoundError:
+            pass
+
+    def __bool__(self):
+        return bool(self.done or self.partial)
+
+    def finished(self, rel_path, st, dst):
+        """Whether a file was completed by an earlier run and its copy is still in place."""
+        if self.done.get(rel_path) != (st.st_size, st.st_mtime_ns):
+            return False
+        try:
+            copy = os.lstat(dst)
+        except OSError:
+            return False
+        return copy.st_size == st.st_size and copy.st_mtime_ns == st.st_mtime_ns
+
+    def resume_offset(self, rel_path, st):
+        """Where a partially copied file can continue, or 0 if the source changed since."""
+        offset, size, mtime_ns = self.partial.get(rel_path, (0, None, None))
+        return offset if (size, mtime_ns) == (st.st_size, st.st_mtime_ns) else 0
+
+    def add_done(self, rel_path, st):
+        with self.lock:
+            self.pending.append(["done", rel_path, st.st_size, st.st_mtime_ns])
+            self.unsynced += 1
+            if self.unsynced >= SYNC_RECORDS or time.monotonic() - self.synced_at >= SYNC_SECONDS:
+                self.sync()
+
+    def add_partial(self, rel_path, offset, st):
+        """Record how much of a large file is on disk; the caller has synced that much already."""
+        with self.lock:
+            self.file.write(json.dumps(["partial", rel_path, offset, st.st_size, st.st_mtime_ns]) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def sync(self):
+        if self.pending:
+            # The journal lives on the destination, so this flushes the files of the batch too
+            sync_filesystem(self.file.fileno())
+            self.file.write("".join(json.dumps(record) + "\n" for record in self.pending))
+            self.pending = []
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            self.sync()
+            self.file.close()
+
+    def remove(self):
+        """Drop the journal of a copy that completed."""
+        with self.lock:
+            self.file.close()
+        os.unlink(self.path)
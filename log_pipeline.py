@@ -0,0 +1,115 @@
+import atexit
+import os
+import threading
+import time
+from collections import deque
+
+# Lines kept for the on-screen view; older ones are dropped, the file still gets everything
+VIEW_CAPACITY = 10000
+# The file writer wakes up at this interval or once this many lines are waiting
+FILE_FLUSH_INTERVAL = 0.5
+FILE_BATCH = 5000
+MAX_LOG_BYTES = 10 * 1024 * 1024
+LOG_BACKUPS = 5
+
+
+def default_log_path(name="confback"):
+    state_home = os.environ.get("XDG_STATE_HOME") or os.path.expanduser("~/.local/state")
+    return os.path.join(state_home, "confback", f"{name}.log")
+
+
+class RotatingLog:
+    """Append-only log file that rolls over to .1, .2, ... once it grows past max_bytes."""
+
+    def __init__(self, path, max_bytes=MAX_LOG_BYTES, backups=LOG_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8", errors="replace")
+
+    def rollover(self):
+        self.file.close()
+        for index in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{index}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        self.file = open(self.path, "a", encoding="utf-8", errors="replace")
+
+    def write_lines(self, lines):
+        data = "\n".join(lines) + "\n"
+        if self.file.tell() + len(data) > self.max_bytes and self.file.tell() > 0:
+            self.rollover()
+        self.file.write(data)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class LogPipeline:
+    """Thread-safe sink for log lines from any worker.
+
+    Lines land in a bounded ring buffer that the UI drains in batches, and in a
+    batch queue that a background thread streams to a rotating file.
+    """
+
+    def __init__(self, path=None, capacity=VIEW_CAPACITY):
+        self.ring = deque(maxlen=capacity)
+        self.dropped = 0
+        self.pending = []
+        self.lock = threading.Lock()
+        self.wake = threading.Condition(self.lock)
+        self.closed = False
+        try:
+            self.file = RotatingLog(path or default_log_path())
+        except OSError:
+            self.file = None  # No writable state directory, keep the on-screen log only
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def push(self, message):
+        line = f"{time.strftime('%H:%M:%S')} {message}"
+        with self.lock:
+            if len(self.ring) == self.ring.maxlen:
+                self.dropped += 1
+            self.ring.append(line)
+            if self.file is not None:
+                self.pending.append(line)
+                if len(self.pending) >= FILE_BATCH:
+                    self.wake.notify()
+
+    def drain(self):
+        """Return (lines waiting for the view, lines dropped since the last drain)."""
+        with self.lock:
+            lines = list(self.ring)
+            self.ring.clear()
+            dropped, self.dropped = self.dropped, 0
+        return lines, dropped
+
+    def write_loop(self):
+        while True:
+            with self.lock:
+                if len(self.pending) < FILE_BATCH and not self.closed:
+                    self.wake.wait(FILE_FLUSH_INTERVAL)
+                lines, self.pending = self.pending, []
+                closed = self.closed
+            if lines and self.file is not None:
+                try:
+                    self.file.write_lines(lines)
+                except OSError:
+                    pass  # A full disk must not take the backup down with it
+            if closed:
+                return
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.wake.notify()
+        self.writer.join()
+        if self.file is not None:
+            self.file.close()
@@ -0,0 +1,120 @@
+import os
+import sqlite3
+import threading
+import time
+
+# Bookkeeping lives in a hidden folder inside the destination so it travels with the backup
+STATE_DIR = ".confback"
+MANIFEST_NAME = "manifest.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    root TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    hash TEXT,
+    run_id INTEGER NOT NULL,
+    PRIMARY KEY (root, path)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started REAL NOT NULL,
+    finished REAL,
+    files INTEGER DEFAULT 0,
+    bytes INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS changes (
+    run_id INTEGER NOT NULL,
+    root TEXT NOT NULL,
+    path TEXT NOT NULL,
+    change TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_run ON changes (run_id);
+"""
+
+
+def state_dir(destination):
+    """Return the bookkeeping folder of a destination, creating it if needed."""
+    path = os.path.join(destination, STATE_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class Manifest:
+    """Persistent per-destination record of what was copied, keyed by source root and relative path.
+
+    One instance is shared by concurrently running jobs, so every access goes through a lock.
+    """
+
+    def __init__(self, destination):
+        self.path = os.path.join(state_dir(destination), MANIFEST_NAME)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def load(self, root):
+        """Return {relative path: (size, mtime_ns, inode, hash)} for one source root."""
+        with self.lock:
+            rows = self.conn.execute("SELECT path, size, mtime_ns, inode, hash FROM files WHERE root = ?", (root,))
+            return {path: (size, mtime_ns, inode, digest) for path, size, mtime_ns, inode, digest in rows}
+
+    @staticmethod
+    def unchanged(state, st):
+        """Tell whether a stat result still matches a recorded state."""
+        return state is not None and state[:3] == (st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def begin_run(self):
+        with self.lock, self.conn:
+            cursor = self.conn.execute("INSERT INTO runs (started) VALUES (?)", (time.time(),))
+        return cursor.lastrowid
+
+    def finish_run(self, run_id, files, size):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE runs SET finished = ?, files = ?, bytes = ? WHERE id = ?",
+                              (time.time(), files, size, run_id))
+
+    def commit(self, run_id, root, updated, deleted):
+        """Store copied files and forget deleted ones in a single transaction.
+
+        updated is a list of (relative path, stat result, hash or None, change) tuples where
+        change is "added" or "modified"; deleted is a list of relative paths.
+        """
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO files (root, path, size, mtime_ns, inode, hash, run_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(root, path, st.st_size, st.st_mtime_ns, st.st_ino, digest, run_id) for path, st, digest, _ in updated])
+            self.conn.executemany("DELETE FROM files WHERE root = ? AND path = ?", [(root, path) for path in deleted])
+            self.conn.executemany(
+                "INSERT INTO changes (run_id, root, path, change) VALUES (?, ?, ?, ?)",
+                [(run_id, root, path, change) for path, _, _, change in updated] +
+                [(run_id, root, path, "deleted") for path in deleted])
+
+    def last_run(self):
+        """Return the id of the most recent finished run, or None."""
+        with self.lock:
+            row = self.conn.execute("SELECT MAX(id) FROM runs WHERE finished IS NOT NULL").fetchone()
+        return row[0]
+
+    def changes(self, run_id=None):
+        """Return (root, path, change) rows recorded by a run, the last finished one by default."""
+        if run_id is None:
+            run_id = self.last_run()
+        with self.lock:
+            rows = self.conn.execute("SELECT root, path, change FROM changes WHERE run_id = ? ORDER BY root, path", (run_id,))
+            return rows.fetchall()
+
+    def changes_since(self, timestamp):
+        """Return (run id, root, path, change) rows for every run started after timestamp."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT c.run_id, c.root, c.path, c.change FROM changes c JOIN runs r ON r.id = c.run_id "
+                "WHERE r.started > ? ORDER BY c.run_id, c.root, c.path", (timestamp,))
+            return rows.fetchall()
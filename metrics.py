@@ -0,0 +1,289 @@
+import errno
+import heapq
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the per-file latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Entries kept in the slowest files and folders lists of a report
+SLOWEST = 20
+# Seconds between samples of the engines' queue depths
+QUEUE_INTERVAL = 0.25
+# Lines of the allocation summary written by the profiler, and stack depth it records
+MEMORY_TOP = 30
+TRACE_FRAMES = 8
+# From 3.12 cProfile is built on sys.monitoring: one profiler sees every thread, and only one may run
+PROCESS_WIDE_PROFILER = sys.version_info >= (3, 12)
+ERRNO_PATTERN = re.compile(r"\[Errno (\d+)\]")
+
+
+def error_code(message):
+    """Symbolic errno (EACCES, ENOSPC, ...) of an error message, or "other" if it carries none."""
+    match = ERRNO_PATTERN.search(message)
+    if match is None:
+        return "other"
+    return errno.errorcode.get(int(match.group(1)), match.group(1))
+
+
+def prometheus_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RunMetrics:
+    """Timings and counters of one backup run, for a JSON report and a Prometheus textfile.
+
+    Engines call file() per copied file from their worker threads; queues are
+    sampled by a background thread from watch()ed callables while the run lasts.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = {}  # Name: seconds
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # The last one counts files above every bound
+        self.latency_sum = 0.0
+        self.slowest = []  # Heap of (seconds, path, size)
+        self.folders = {}  # Folder: [seconds, files]
+        self.errors = {}  # Errno name: count
+        self.queues = {}  # Name: [callable, samples, total, max]
+        self.files = 0
+        self.bytes = 0
+        self.memory_peak = None
+        self.started = time.time()
+        self.finished = None  # Set by whoever saves the report
+        self.sampling = threading.Event()
+        self.sampler = None
+
+    @contextmanager
+    def phase(self, name):
+        """Time a stage of the run; a stage entered twice adds up."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def file(self, path, seconds, size):
+        """Record how long a file took to copy."""
+        index = 0
+        while index < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[index]:
+            index += 1
+        with self.lock:
+            self.buckets[index] += 1
+            self.latency_sum += seconds
+            if len(self.slowest) < SLOWEST:
+                heapq.heappush(self.slowest, (seconds, path, size))
+            elif seconds > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (seconds, path, size))
+            folder = self.folders.setdefault(os.path.dirname(path), [0.0, 0])
+            folder[0] += seconds
+            folder[1] += 1
+
+    def add_errors(self, errors):
+        """Count a list of (path, message) errors by errno."""
+        with self.lock:
+            for _, message in errors:
+                code = error_code(message)
+                self.errors[code] = self.errors.get(code, 0) + 1
+
+    def add_error(self, code):
+        with self.lock:
+            self.errors[code] = self.errors.get(code, 0) + 1
+
+    def watch(self, name, depth):
+        """Sample depth(), the number of items waiting in an engine's queue, until the run ends."""
+        with self.lock:
+            self.queues[name] = [depth, 0, 0, 0]
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self.sample_loop, daemon=True)
+                self.sampler.start()
+
+    def sample_loop(self):
+        while not self.sampling.wait(QUEUE_INTERVAL):
+            with self.lock:
+                queues = list(self.queues.values())
+            for queue in queues:
+                depth = queue[0]()
+                queue[1] += 1
+                queue[2] += depth
+                queue[3] = max(queue[3], depth)
+
+    def finish(self, files, size):
+        """Stop sampling at the end of the copy and record what it went through."""
+        self.sampling.set()
+        if self.sampler is not None:
+            self.sampler.join()
+        self.files = files
+        self.bytes = size
+
+    def summary(self):
+        """One line on where the time went, for the log."""
+        phases = ", ".join(f"{name} {seconds:.1f} s" for name, seconds in self.phases.items())
+        text = f"Took {self.finished - self.started:.1f} s ({phases or 'nothing to do'})"
+        copy_time = self.phases.get("copy")
+        if copy_time:
+            text += f", {self.files / copy_time:.0f} files/s, {self.bytes / copy_time / 1024 / 1024:.1f} MiB/s"
+        if self.errors:
+            text += ", errors: " + ", ".join(f"{count} {code}" for code, count in sorted(self.errors.items()))
+        return text
+
+    def to_dict(self, job=None, status="ok", error=None):
+        copy_time = self.phases.get("copy", 0.0)
+        with self.lock:
+            slowest = sorted(self.slowest, reverse=True)
+            folders = sorted(self.folders.items(), key=lambda item: item[1][0], reverse=True)[:SLOWEST]
+            data = {
+                "job": job,
+                "status": status,
+                "error": error,
+                "started": self.started,
+                "finished": self.finished,
+                "phases": dict(self.phases),
+                "files": self.files,
+                "bytes": self.bytes,
+                "files_per_second": self.files / copy_time if copy_time else None,
+                "bytes_per_second": self.bytes / copy_time if copy_time else None,
+                "latency": {"buckets": dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], self.buckets)),
+                            "count": sum(self.buckets), "sum": self.latency_sum},
+                "slowest_files": [{"path": path, "seconds": seconds, "bytes": size}
+                                  for seconds, path, size in slowest],
+                "slowest_folders": [{"path": path, "seconds": seconds, "files": files}
+                                    for path, (seconds, files) in folders],
+                "errors": dict(self.errors),
+                "queues": {name: {"max": queue[3], "mean": queue[2] / queue[1] if queue[1] else 0}
+                           for name, queue in self.queues.items()},
+            }
+        if self.memory_peak is not None:
+            data["memory_peak_bytes"] = self.memory_peak
+        return data
+
+    def save(self, path, job=None, status="ok", error=None):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(job, status, error), f, indent=2)
+
+    def prometheus(self, job=None, status="ok"):
+        """The run in the Prometheus text format, for node_exporter's textfile collector."""
+        data = self.to_dict(job, status)
+        job = prometheus_label(job or "")
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP confback_{name} {help_text}")
+            lines.append(f"# TYPE confback_{name} {kind}")
+            for labels, value in samples:
+                labels = ",".join([f'job="{job}"'] + [f'{key}="{prometheus_label(label)}"'
+                                                      for key, label in labels])
+                lines.append(f"confback_{name}{{{labels}}} {value}")
+
+        metric("last_run_timestamp_seconds", "gauge", "When the last run finished.", [((), data["finished"])])
+        metric("last_run_success", "gauge", "1 if the last run completed without errors.",
+               [((), int(status == "ok"))])
+        metric("phase_duration_seconds", "gauge", "Time spent in each phase of the last run.",
+               [((("phase", name),), seconds) for name, seconds in data["phases"].items()])
+        metric("files", "gauge", "Files backed up by the last run.", [((), data["files"])])
+        metric("bytes", "gauge", "Bytes backed up by the last run.", [((), data["bytes"])])
+        cumulative = 0
+        samples = []
+        for bound, count in data["latency"]["buckets"].items():
+            cumulative += count
+            samples.append(((("le", bound),), cumulative))
+        lines.append("# HELP confback_file_duration_seconds Time taken to copy each file in the last run.")
+        lines.append("# TYPE confback_file_duration_seconds histogram")
+        for labels, value in samples:
+            lines.append(f'confback_file_duration_seconds_bucket{{job="{job}",le="{labels[0][1]}"}} {value}')
+        lines.append(f'confback_file_duration_seconds_sum{{job="{job}"}} {data["latency"]["sum"]}')
+        lines.append(f'confback_file_duration_seconds_count{{job="{job}"}} {data["latency"]["count"]}')
+        metric("errors", "gauge", "Files that failed in the last run, by errno.",
+               [((("errno", code),), count) for code, count in data["errors"].items()])
+        metric("queue_depth_max", "gauge", "Deepest an engine queue got during the last run.",
+               [((("queue", name),), queue["max"]) for name, queue in data["queues"].items()])
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, folder, job=None, status="ok"):
+        """Write <folder>/confback_<job>.prom atomically, so the collector never reads half a file."""
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", job or "default")
+        path = os.path.join(folder, f"confback_{name}.prom")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.prometheus(job, status))
+        os.replace(tmp, path)
+        return path
+
+
+class Profiler:
+    """Opt-in cProfile and tracemalloc around a run, covering the threads the run starts.
+
+    From Python 3.12 a single profiler covers every thread. Before that profilers
+    are per thread, so each thread started while profiling gets its own. Their
+    statistics are merged into <folder>/<name>.pstats (read it with `python -m pstats`).
+    The largest allocation sites go to <name>-memory.txt and the peak into the run's metrics.
+    """
+
+    def __init__(self, folder, name="confback"):
+        self.folder = folder
+        self.name = re.sub(r"[^A-Za-z0-9_.-]", "_", name or "confback")
+        self.profiles = []
+        self.lock = threading.Lock()
+
+    def start_thread(self, frame, event, arg):
+        import cProfile
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()  # Replaces this hook for the rest of the thread
+        except ValueError:
+            return  # Another profiler is active; never let that kill the thread
+        with self.lock:
+            self.profiles.append(profile)
+
+    def start(self):
+        import cProfile
+        import tracemalloc
+
+        tracemalloc.start(TRACE_FRAMES)
+        self.profiles.append(cProfile.Profile())
+        if not PROCESS_WIDE_PROFILER:
+            threading.setprofile(self.start_thread)
+        self.profiles[0].enable()
+
+    def stop(self, metrics=None):
+        """Stop profiling and write the results; returns the paths written."""
+        import pstats
+        import tracemalloc
+
+        self.profiles[0].disable()
+        if not PROCESS_WIDE_PROFILER:
+            threading.setprofile(None)
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        if metrics is not None:
+            metrics.memory_peak = peak
+
+        os.makedirs(self.folder, exist_ok=True)
+        stats_path = os.path.join(self.folder, f"{self.name}.pstats")
+        with self.lock:
+            profiles = list(self.profiles)
+        stats = None
+        for profile in profiles:
+            profile.create_stats()
+            if not profile.stats:
+                continue  # A thread that ended before calling anything; pstats rejects empty profiles
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        if stats is not None:
+            stats.dump_stats(stats_path)
+        memory_path = os.path.join(self.folder, f"{self.name}-memory.txt")
+        with open(memory_path, "w") as f:
+            f.write(f"Peak traced memory: {peak} bytes\n")
+            for stat in snapshot.statistics("lineno")[:MEMORY_TOP]:
+                f.write(f"{stat}\n")
+        return stats_path, memory_path
@@ -1,127 +1,166 @@
-import os
-import subprocess
+import threading
+import traceback
 from PyQt5.QtWidgets import (
     QWidget, QLabel, QPushButton,
-    QVBoxLayout, QGridLayout, QFileDialog, QProgressBar, QTextEdit, QLineEdit, QScrollArea, QMenu
+    QVBoxLayout, QHBoxLayout, QFileDialog, QProgressBar, QPlainTextEdit, QLineEdit, QListView, QAbstractItemView,
+    QMenu, QComboBox, QCheckBox, QInputDialog
 )
-from PyQt5.QtCore import QThread, QObject, pyqtSignal, pyqtSlot
+from PyQt5.QtCore import QThread, QObject, QTimer, pyqtSignal, pyqtSlot
+import archive
+from core import MODES, BackupRun, Job, JobError, load_source_list, save_source_list
+from log_pipeline import LogPipeline
+from rules import DEFAULT_EXCLUDES
+from source_model import PATH_ROLE, SizeScanner, SourceListModel
+
+# Scrollback of the log view and how often it picks up new lines
+LOG_VIEW_LINES = 5000
+LOG_FLUSH_MS = 100
 
 class Worker(QObject):
+    """Qt adapter that runs a core.BackupRun on a QThread and reports through signals.
+
+    stop(), pause() and resume() are called from the GUI thread and return at once.
+    The BackupRun is built in run(), since finding browser profiles and compiling
+    rules touch the filesystem; what is asked for before then is applied once it exists.
+    """
     finished = pyqtSignal()
+    cancelled = pyqtSignal()
     error_occurred = pyqtSignal(str)
-    progress_update = pyqtSignal(int)
+    progress_update = pyqtSignal(int, str)  # Percent and a throughput/ETA summary, at most 10 per second
 
-    def __init__(self, source_dirs, destination, mode):
+    def __init__(self, jobs, destination, log, destination_format="mirror", verify=False, rules=None, throttle=None):
         super().__init__()
-        self.source_dirs = source_dirs
-        self.destination = destination
-        self.mode = mode
-        self.running = True
+        self.args = (jobs, destination, log, destination_format)
+        self.options = {"verify": verify, "rules": rules, "throttle": throttle}
+        self.backup = None
+        self.stopped = False
+        self.paused = False
+        self.lock = threading.Lock()
 
     def run(self):
-        for source in self.source_dirs:
-            if not self.running:
-                break
-
-            if self.mode == "cp":
-                command = f"cp -r {source} {self.destination}/"
-            else:  # rsync
-                command = f"rsync -ah --progress {source}/ {self.destination}/"
-
-            process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-
-            while True:
-                output = process.stdout.readline()
-                if output == '' and process.poll() is not None:
-                    break
-                if output:
-                    self.log_output(output)
-                    self.parse_progress(output)
-
-            result = process.communicate()
-            if process.returncode != 0:
-                self.error_occurred.emit(f"Error backing up {source}: {result[1].strip()}")
-                return
-        self.finished.emit()
-
-    def parse_progress(self, output):
-        if "to-check" in output or "bytes" in output:
-            parts = output.split()
-            for part in parts:
-                if part.endswith('%'):
-                    try:
-                        percent = int(part[:-1])
-                        self.progress_update.emit(percent)
-                    except ValueError:
-                        continue
+        try:
+            backup = BackupRun(*self.args, progress=self.progress_update.emit, **self.options)
+            with self.lock:
+                self.backup = backup
+                if self.stopped:
+                    backup.stop()
+                elif self.paused:
+                    backup.pause()
+            error = backup.run()
+        except Exception as e:
+            # An engine bug must not leave the thread running and the buttons disabled
+            self.args[2].push(f"Backup failed: {traceback.format_exc()}")
+            self.error_occurred.emit(f"Backup failed: {e}")
+            return
+        if not backup.running:
+            self.cancelled.emit()
+        elif error:
+            self.error_occurred.emit(error)
         else:
-            self.progress_update.emit(0)
+            self.finished.emit()
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            if self.backup is not None:
+                self.backup.stop()
+
+    def pause(self):
+        with self.lock:
+            self.paused = True
+            if self.backup is not None:
+                self.backup.pause()
+
+    def resume(self):
+        with self.lock:
+            self.paused = False
+            if self.backup is not None:
+                self.backup.resume()
+
+class WatchWorker(QObject):
+    """Qt adapter that runs a watcher.Watcher on a QThread until it is stopped."""
+    finished = pyqtSignal()
+    error_occurred = pyqtSignal(str)
+
+    def __init__(self, jobs, destination, log, rules=None):
+        super().__init__()
+        self.jobs = jobs
+        self.destination = destination
+        self.log = log
+        self.rules = rules
+        self.watcher = None
+        self.stopped = False
+
+    def run(self):
+        from watcher import Watcher
 
-    def log_output(self, output):
-        print(output.strip())
+        try:
+            self.watcher = Watcher(self.jobs, self.destination, self.log, rules=self.rules)
+        except OSError as e:
+            self.error_occurred.emit(f"Cannot watch for changes: {e.strerror}")
+            return
+        if not self.stopped:
+            self.watcher.run()
+        self.watcher = None  # Closed now, stop() must not touch it
+        self.finished.emit()
 
     def stop(self):
-        self.running = False
+        self.stopped = True
+        if self.watcher is not None:
+            self.watcher.stop()
 
 class OfflineBackup(QWidget):
     def __init__(self):
         super().__init__()
+        self.log_pipeline = LogPipeline()
+        self.source_rules = {}  # Source path: exclude patterns, caches are excluded by default
+        self.size_scanner = SizeScanner()
+        self.source_models = {mode: SourceListModel(mode, self.size_scanner, self.source_rules, self)
+                              for mode in MODES}
+        self.source_views = {}
         self.init_ui()
-        self.worker_cp = None
-        self.worker_rsync = None
+        self.worker = None
         self.thread = None
-        self.cp_source_buttons = []
-        self.rsync_source_buttons = []
+        self.watch_worker = None
+        self.watch_thread = None
         self.destination = ""
-        self.cp_source_paths = []
-        self.rsync_source_paths = []
+        self.destinations = []  # Mirrors may go to several destinations in one pass
 
     def init_ui(self):
         self.layout = QVBoxLayout()
 
-        # Copy Mode Section
-        self.cp_section_label = QLabel("Select folders to back up using Copy (cp):")
-        self.layout.addWidget(self.cp_section_label)
-
-        self.cp_scroll_area = QScrollArea()
-        self.cp_scroll_area.setWidgetResizable(True)
-        self.cp_scroll_area.setFixedHeight(150)
-
-        self.cp_button_container = QWidget()
-        self.cp_source_layout = QGridLayout(self.cp_button_container)
-        self.cp_source_layout.setSpacing(5)
-        self.cp_source_layout.setContentsMargins(0, 0, 0, 0)
-
-        self.cp_scroll_area.setWidget(self.cp_button_container)
-        self.layout.addWidget(self.cp_scroll_area)
-
-        self.add_cp_source_button = QPushButton("+")
-        self.add_cp_source_button.setFixedSize(80, 80)
-        self.add_cp_source_button.setStyleSheet("font-size: 24px;")
+        # One list per mode; sizes fill in lazily as rows are shown
+        for mode, text in (("cp", "Select folders to back up using Copy (cp):"),
+                           ("rsync", "Select folders to back up using Rsync:"),
+                           ("native", "Select folders to back up using the native parallel copier:")):
+            self.layout.addWidget(QLabel(text))
+            view = QListView(self)
+            view.setModel(self.source_models[mode])
+            view.setUniformItemSizes(True)  # Lets the view skip measuring every row
+            view.setSelectionMode(QAbstractItemView.ExtendedSelection)
+            view.setFixedHeight(150)
+            view.setContextMenuPolicy(3)  # Enable context menu
+            view.customContextMenuRequested.connect(lambda pos, view=view: self.show_context_menu(pos, view))
+            self.layout.addWidget(view)
+            self.source_views[mode] = view
+
+        self.add_cp_source_button = QPushButton("Add cp folder")
         self.add_cp_source_button.clicked.connect(self.add_cp_source_button_action)
-        self.cp_source_layout.addWidget(self.add_cp_source_button, 0, 0)
-
-        # Rsync Mode Section
-        self.rsync_section_label = QLabel("Select folders to back up using Rsync:")
-        self.layout.addWidget(self.rsync_section_label)
-
-        self.rsync_scroll_area = QScrollArea()
-        self.rsync_scroll_area.setWidgetResizable(True)
-        self.rsync_scroll_area.setFixedHeight(150)
-
-        self.rsync_button_container = QWidget()
-        self.rsync_source_layout = QGridLayout(self.rsync_button_container)
-        self.rsync_source_layout.setSpacing(5)
-        self.rsync_source_layout.setContentsMargins(0, 0, 0, 0)
-
-        self.rsync_scroll_area.setWidget(self.rsync_button_container)
-        self.layout.addWidget(self.rsync_scroll_area)
-
-        self.add_rsync_source_button = QPushButton("+")
-        self.add_rsync_source_button.setFixedSize(80, 80)
-        self.add_rsync_source_button.setStyleSheet("font-size: 24px;")
+        self.add_rsync_source_button = QPushButton("Add rsync folder")
         self.add_rsync_source_button.clicked.connect(self.add_rsync_source_button_action)
-        self.rsync_source_layout.addWidget(self.add_rsync_source_button, 0, 0)
+        self.add_native_source_button = QPushButton("Add native folder")
+        self.add_native_source_button.clicked.connect(self.add_native_source_button_action)
+        self.import_button = QPushButton("Import...")
+        self.import_button.setToolTip("Add the sources of a JSON job file or a text list, one [mode] path per line")
+        self.import_button.clicked.connect(self.import_sources)
+        self.export_button = QPushButton("Export...")
+        self.export_button.setToolTip("Save the sources as a JSON job file or a text list")
+        self.export_button.clicked.connect(self.export_sources)
+        source_buttons = QHBoxLayout()
+        for button in (self.add_cp_source_button, self.add_rsync_source_button, self.add_native_source_button,
+                       self.import_button, self.export_button):
+            source_buttons.addWidget(button)
+        self.layout.addLayout(source_buttons)
 
         # Destination Directory
         self.destination_label = QLabel("Select destination directory:")
@@ -134,15 +173,56 @@ class OfflineBackup(QWidget):
         self.destination_button.clicked.connect(self.select_destination)
         self.layout.addWidget(self.destination_button)
 
+        self.add_destination_button = QPushButton("Add destination")
+        self.add_destination_button.setToolTip("Mirror to this directory as well, reading every source once")
+        self.add_destination_button.clicked.connect(self.add_destination)
+        self.layout.addWidget(self.add_destination_button)
+
+        # Destination Format
+        self.format_label = QLabel("Destination format:")
+        self.layout.addWidget(self.format_label)
+
+        self.format_combo = QComboBox(self)
+        self.format_combo.addItem("Mirror (per-source mode)", "mirror")
+        self.format_combo.addItem("Dated snapshots (unchanged files hardlinked)", "snapshots")
+        self.format_combo.addItem("Small files packed (for USB and network drives)", "packs")
+        self.format_combo.addItem("Deduplicated chunk store", "chunks")
+        for suffix in archive.FORMATS:
+            self.format_combo.addItem(f"Compressed archive (.{suffix})", suffix)
+        self.layout.addWidget(self.format_combo)
+
+        # How hard a sync may load the machine; the data is a job's throttle settings
+        self.throttle_combo = QComboBox(self)
+        self.throttle_combo.addItem("Full speed", None)
+        self.throttle_combo.addItem("Low priority (idle I/O)", {"priority": "idle"})
+        self.throttle_combo.addItem("Back off while the system is busy", {"priority": "best-effort", "adaptive": True})
+        self.throttle_combo.addItem("Limit to 10 MB/s", {"bytes_per_s": "10M", "priority": "best-effort"})
+        self.throttle_combo.addItem("Limit to 50 MB/s", {"bytes_per_s": "50M", "priority": "best-effort"})
+        self.layout.addWidget(self.throttle_combo)
+
+        self.verify_checkbox = QCheckBox("Verify the backup against the sources after syncing")
+        self.layout.addWidget(self.verify_checkbox)
+
         # Sync and Cancel Buttons
         self.sync_button = QPushButton("Sync")
         self.sync_button.clicked.connect(self.sync)
         self.layout.addWidget(self.sync_button)
 
+        self.pause_button = QPushButton("Pause")
+        self.pause_button.setCheckable(True)
+        self.pause_button.toggled.connect(self.pause_sync)
+        self.layout.addWidget(self.pause_button)
+
         self.cancel_button = QPushButton("Cancel")
         self.cancel_button.clicked.connect(self.cancel_sync)
         self.layout.addWidget(self.cancel_button)
 
+        # Continuous mirroring of the cp and rsync sources as they change
+        self.watch_button = QPushButton("Watch for changes")
+        self.watch_button.setCheckable(True)
+        self.watch_button.toggled.connect(self.toggle_watch)
+        self.layout.addWidget(self.watch_button)
+
         # Status and Progress
         self.status_label = QLabel("")
         self.layout.addWidget(self.status_label)
@@ -151,112 +231,161 @@ class OfflineBackup(QWidget):
         self.progress_bar.setRange(0, 100)
         self.layout.addWidget(self.progress_bar)
 
-        # Log Output
-        self.log_output = QTextEdit(self)
+        # Log Output, fed in batches from the log pipeline with a capped scrollback
+        self.log_output = QPlainTextEdit(self)
         self.log_output.setReadOnly(True)
+        self.log_output.setMaximumBlockCount(LOG_VIEW_LINES)
         self.layout.addWidget(self.log_output)
 
+        self.log_timer = QTimer(self)
+        self.log_timer.timeout.connect(self.flush_log)
+        self.log_timer.start(LOG_FLUSH_MS)
+
         self.setLayout(self.layout)
 
     def add_cp_source_button_action(self):
-        """Prompt to select a source folder for cp and create a new button for it."""
+        """Prompt to select a source folder for cp."""
         self.add_source_button_action("cp")
 
     def add_rsync_source_button_action(self):
-        """Prompt to select a source folder for rsync and create a new button for it."""
+        """Prompt to select a source folder for rsync."""
         self.add_source_button_action("rsync")
 
+    def add_native_source_button_action(self):
+        """Prompt to select a source folder for the native copier."""
+        self.add_source_button_action("native")
+
     def add_source_button_action(self, mode):
-        """Prompt to select a source folder and create a new button for it."""
+        """Prompt to select a source folder and add it to the list of its mode."""
         directory = QFileDialog.getExistingDirectory(self, "Select Directory")
         if directory:
-            folder_name = os.path.basename(directory)  # Get only the folder name
-            source_button = QPushButton(folder_name)  # Create a button with the folder name
-            source_button.setFixedSize(80, 80)  # Set a larger button size
-            source_button.setStyleSheet("font-size: 12px;")
-            source_button.setContextMenuPolicy(3)  # Enable context menu
-            source_button.customContextMenuRequested.connect(lambda pos: self.show_context_menu(pos, source_button, mode))
-
-            # Add the new source button to the appropriate grid layout
-            if mode == "cp":
-                row = (len(self.cp_source_buttons) + 1) // 3
-                col = (len(self.cp_source_buttons) + 1) % 3
-                self.cp_source_layout.addWidget(source_button, row, col)
-                self.cp_source_buttons.append(source_button)  # Keep track of the button
-                self.cp_source_paths.append(directory)  # Store the full path
-            else:
-                row = (len(self.rsync_source_buttons) + 1) // 3
-                col = (len(self.rsync_source_buttons) + 1) % 3
-                self.rsync_source_layout.addWidget(source_button, row, col)
-                self.rsync_source_buttons.append(source_button)  # Keep track of the button
-                self.rsync_source_paths.append(directory)  # Store the full path
-
-    def show_context_menu(self, pos, button, mode):
-        """Show the context menu for the given button."""
+            self.add_sources([(directory, mode)])
+
+    def add_sources(self, sources, rules=None):
+        """Add (path, mode) pairs, each list in one go.
+
+        rules maps paths to their exclude patterns, as in a job file; without it new
+        sources get the default cache excludes.
+        """
+        by_mode = {mode: [] for mode in MODES}
+        for path, mode in sources:
+            by_mode[mode].append(path)
+        for mode, paths in by_mode.items():
+            for path in self.source_models[mode].add_paths(paths):
+                patterns = DEFAULT_EXCLUDES if rules is None else rules.get(path, [])
+                self.source_rules.setdefault(path, list(patterns))
+
+    def source_jobs(self, modes=MODES):
+        """The listed sources as (path, mode) pairs, cp first, then rsync and native."""
+        return [(path, mode) for mode in modes for path in self.source_models[mode].paths]
+
+    def show_context_menu(self, pos, view):
+        """Show the context menu for the sources selected in a list."""
+        index = view.indexAt(pos)
+        if not index.isValid():
+            return
         menu = QMenu(self)
+        rules_action = menu.addAction("Edit exclude rules...")
         delete_action = menu.addAction("Delete")
-        action = menu.exec_(button.mapToGlobal(pos))
-        if action == delete_action:
-            self.remove_source_button(button, mode)
-
-    def remove_source_button(self, button, mode):
-        """Remove the selected source button."""
-        if mode == "cp":
-            index = self.cp_source_buttons.index(button)
-            self.cp_source_layout.removeWidget(button)
-            button.deleteLater()  # Delete the button
-            self.cp_source_buttons.remove(button)  # Remove from the list
-            self.cp_source_paths.pop(index)  # Remove the corresponding path
-            self.relayout_source_buttons(self.cp_source_buttons, self.cp_source_layout)
-        else:
-            index = self.rsync_source_buttons.index(button)
-            self.rsync_source_layout.removeWidget(button)
-            button.deleteLater()  # Delete the button
-            self.rsync_source_buttons.remove(button)  # Remove from the list
-            self.rsync_source_paths.pop(index)  # Remove the corresponding path
-            self.relayout_source_buttons(self.rsync_source_buttons, self.rsync_source_layout)
-
-    def relayout_source_buttons(self, button_list, layout):
-        """Reposition buttons in the grid after one has been removed."""
-        for index, button in enumerate(button_list):
-            row = index // 3
-            col = index % 3
-            layout.addWidget(button, row, col)
+        action = menu.exec_(view.viewport().mapToGlobal(pos))
+        if action == rules_action:
+            self.edit_rules(view.model(), index.data(PATH_ROLE))
+        elif action == delete_action:
+            rows = [selected.row() for selected in view.selectionModel().selectedRows()] or [index.row()]
+            self.remove_sources(view.model(), rows)
+
+    def edit_rules(self, model, path):
+        """Let the user edit the gitignore-style exclude patterns of a source, one per line."""
+        text, ok = QInputDialog.getMultiLineText(
+            self, "Exclude rules", f"Paths below {path} to skip (gitignore syntax, !pattern re-includes):",
+            "\n".join(self.source_rules.get(path, [])))
+        if ok:
+            self.source_rules[path] = [line for line in text.splitlines() if line.strip()]
+            model.remeasure(path)
+
+    def remove_sources(self, model, rows):
+        """Remove the sources in the given rows of a list."""
+        listed = {path for other in self.source_models.values() if other is not model for path in other.paths}
+        for path in model.remove_rows(rows):
+            if path not in listed:
+                self.source_rules.pop(path, None)
+
+    def import_sources(self):
+        """Add the sources of a job file or text list, with its destination and format if none is set."""
+        path, _ = QFileDialog.getOpenFileName(self, "Import Sources", "",
+                                              "Job files (*.json);;Source lists (*.txt);;All files (*)")
+        if not path:
+            return
+        try:
+            job = load_source_list(path)
+        except JobError as e:
+            self.handle_error(str(e))
+            return
+        self.add_sources(job.sources, job.rules if path.endswith(".json") else None)
+        if job.destination and not self.destinations:
+            self.destinations = job.destination if isinstance(job.destination, list) else [job.destination]
+            self.destination = self.destinations[0]
+            self.destination_input.setText("; ".join(self.destinations))
+            self.format_combo.setCurrentIndex(max(0, self.format_combo.findData(job.destination_format)))
+        self.log_pipeline.push(f"Imported {len(job.sources)} sources from {path}")
+
+    def export_sources(self):
+        """Save the sources, their exclude rules and the destination as a job file, or the sources as text."""
+        path, _ = QFileDialog.getSaveFileName(self, "Export Sources", "",
+                                              "Job files (*.json);;Source lists (*.txt)")
+        if not path:
+            return
+        sources = self.source_jobs()
+        destination = self.destinations if len(self.destinations) > 1 else self.destination or None
+        job = Job(destination, sources, self.format_combo.currentData(),
+                  rules={source: self.source_rules[source] for source, _ in sources if source in self.source_rules})
+        try:
+            save_source_list(job, path)
+        except OSError as e:
+            self.handle_error(f"Cannot export sources: {e}")
+            return
+        self.log_pipeline.push(f"Exported {len(sources)} sources to {path}")
 
     def select_destination(self):
         """Open a dialog to select the destination directory."""
         self.destination = QFileDialog.getExistingDirectory(self, "Select Destination Directory")
         if self.destination:
+            self.destinations = [self.destination]
             self.destination_input.setText(self.destination)  # Update input field to show selected destination
 
+    def add_destination(self):
+        """Open a dialog to pick one more destination directory for mirrors."""
+        destination = QFileDialog.getExistingDirectory(self, "Add Destination Directory")
+        if destination and destination not in self.destinations:
+            self.destinations.append(destination)
+            self.destination = self.destinations[0]
+            self.destination_input.setText("; ".join(self.destinations))
+
     def sync(self):
         if self.thread and self.thread.isRunning():
             self.status_label.setText("Status: Sync is already in progress.")
             return
 
-        if self.destination and (self.cp_source_paths or self.rsync_source_paths):
+        jobs = self.source_jobs()
+        if self.destination and jobs:
             self.status_label.setText("Status: Running...")
             self.progress_bar.setValue(0)  # Reset the progress bar
-
-            self.thread = QThread()
-
-            # Create worker for cp
-            if self.cp_source_paths:
-                self.worker_cp = Worker(self.cp_source_paths, self.destination, "cp")
-                self.worker_cp.moveToThread(self.thread)
-                self.thread.started.connect(self.worker_cp.run)
-                self.worker_cp.finished.connect(self.cleanup)
-                self.worker_cp.error_occurred.connect(self.handle_error)
-                self.worker_cp.progress_update.connect(self.update_progress)
-
-            # Create worker for rsync
-            if self.rsync_source_paths:
-                self.worker_rsync = Worker(self.rsync_source_paths, self.destination, "rsync")
-                self.worker_rsync.moveToThread(self.thread)
-                self.thread.started.connect(self.worker_rsync.run)
-                self.worker_rsync.finished.connect(self.cleanup)
-                self.worker_rsync.error_occurred.connect(self.handle_error)
-                self.worker_rsync.progress_update.connect(self.update_progress)
+            self.progress_bar.setFormat("%p%")
+
+            # Parented to the widget, so it outlives our reference until it has finished
+            self.thread = QThread(self)
+            self.thread.finished.connect(self.thread_finished)
+
+            # One worker schedules every source, whatever its mode
+            self.worker = Worker(jobs, self.destinations, self.log_pipeline, self.format_combo.currentData(),
+                                 self.verify_checkbox.isChecked(), self.source_rules, self.throttle_combo.currentData())
+            self.worker.moveToThread(self.thread)
+            self.thread.started.connect(self.worker.run)
+            self.worker.finished.connect(self.cleanup)
+            self.worker.cancelled.connect(self.sync_cancelled)
+            self.worker.error_occurred.connect(self.handle_error)
+            self.worker.error_occurred.connect(self.run_ended)
+            self.worker.progress_update.connect(self.update_progress)
 
             # Start the thread
             self.thread.start()
@@ -264,30 +393,105 @@ class OfflineBackup(QWidget):
             self.status_label.setText("Please select a destination directory and valid source folders.")
             self.status_label.setStyleSheet("color: red")
 
-    @pyqtSlot(int)
-    def update_progress(self, percent):
+    def toggle_watch(self, checked):
+        """Start or stop copying changes of the sources to every destination as they happen."""
+        if not checked:
+            if self.watch_worker is not None:
+                self.watch_worker.stop()
+            return
+        jobs = self.source_jobs()
+        if not self.destination or not jobs:
+            self.status_label.setText("Please select a destination directory and valid source folders.")
+            self.status_label.setStyleSheet("color: red")
+            self.watch_button.setChecked(False)
+            return
+        if self.format_combo.currentData() != "mirror":
+            self.status_label.setText("Only a mirror can be kept up to date by watching for changes.")
+            self.status_label.setStyleSheet("color: red")
+            self.watch_button.setChecked(False)
+            return
+
+        self.status_label.setText("Status: Watching for changes...")
+        self.status_label.setStyleSheet("")
+        self.watch_thread = QThread(self)
+        self.watch_thread.finished.connect(self.thread_finished)
+        self.watch_worker = WatchWorker(jobs, self.destinations, self.log_pipeline, self.source_rules)
+        self.watch_worker.moveToThread(self.watch_thread)
+        self.watch_thread.started.connect(self.watch_worker.run)
+        self.watch_worker.finished.connect(self.watch_stopped)
+        self.watch_worker.error_occurred.connect(self.handle_error)
+        self.watch_worker.error_occurred.connect(self.watch_stopped)
+        self.watch_thread.start()
+
+    def watch_stopped(self, error_message=None):
+        if self.watch_thread is not None:
+            self.watch_thread.quit()
+        self.watch_button.setChecked(False)
+        self.log_pipeline.push("Stopped watching for changes.")
+
+    def flush_log(self):
+        """Move whatever the workers logged since the last tick into the view in one call."""
+        lines, dropped = self.log_pipeline.drain()
+        if dropped:
+            lines.insert(0, f"... {dropped} lines omitted from the view, the log file has them all")
+        if lines:
+            self.log_output.appendPlainText("\n".join(lines))
+
+    @pyqtSlot(int, str)
+    def update_progress(self, percent, text):
         """Update the progress bar based on the emitted signal."""
         self.progress_bar.setValue(percent)
+        self.progress_bar.setFormat(f"%p% - {text}")
 
     def handle_error(self, error_message):
         """Handle errors emitted from the worker."""
         self.status_label.setText(f"Status: Error - {error_message}")
         self.status_label.setStyleSheet("color: red")
-        self.log_output.append(error_message)  # Append error message to the log
+        self.log_pipeline.push(error_message)  # Append error message to the log
 
     def cancel_sync(self):
-        """Cancel the ongoing synchronization process."""
-        if self.thread and self.thread.isRunning():
-            if hasattr(self, 'worker_cp'):
-                self.worker_cp.stop()
-            if hasattr(self, 'worker_rsync'):
-                self.worker_rsync.stop()
-            self.thread.quit()
-            self.thread.wait()  # Wait for the thread to finish
-            self.status_label.setText("Status: Canceled.")
-            self.log_output.append("Sync canceled.")  # Log the cancellation
+        """Cancel the ongoing synchronization without waiting; sync_cancelled follows once it has stopped."""
+        if self.thread and self.thread.isRunning() and self.worker is not None:
+            self.worker.stop()
+            self.status_label.setText("Status: Canceling...")
+        else:
+            self.log_pipeline.push("No active sync process to cancel.")  # Log if no active thread
+
+    def pause_sync(self, paused):
+        """Suspend or continue the running sync; cp and rsync are stopped, native copies halt between files."""
+        if self.worker is None:
+            if paused:
+                self.pause_button.setChecked(False)
+            return
+        if paused:
+            self.worker.pause()
+            self.status_label.setText("Status: Paused.")
         else:
-            self.log_output.append("No active sync process to cancel.")  # Log if no active thread
+            self.worker.resume()
+            self.status_label.setText("Status: Running...")
+
+    @pyqtSlot()
+    def sync_cancelled(self):
+        self.status_label.setText("Status: Canceled.")
+        self.log_pipeline.push("Sync canceled.")
+        self.run_ended()
+
+    def run_ended(self, error_message=None):
+        """Let the worker thread wind down on its own; thread_finished drops it once it has."""
+        self.pause_button.setChecked(False)
+        if self.thread is not None:
+            self.thread.quit()
+
+    @pyqtSlot()
+    def thread_finished(self):
+        thread = self.sender()
+        thread.deleteLater()
+        if thread is self.thread:
+            self.thread = None
+            self.worker = None
+        elif thread is self.watch_thread:
+            self.watch_thread = None
+            self.watch_worker = None
 
     @pyqtSlot()
     def cleanup(self):
@@ -296,9 +500,5 @@ class OfflineBackup(QWidget):
         success_message = "Sync completed successfully."
         self.status_label.setText("Status: Done.")
         self.status_label.setStyleSheet("color: green")
-        self.log_output.append(success_message)  # Append completion message to the log
-
-        if self.thread is not None:
-            self.thread.quit()  # Quit the thread if it exists
-            self.thread.wait()  # Wait until the thread has properly finished
-            self.thread = None  # Reset the thread reference
\ No newline at end of file
+        self.log_pipeline.push(success_message)  # Append completion message to the log
+        self.run_ended()
\ No newline at end of file
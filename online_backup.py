@@ -1,12 +1,261 @@
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel
+from PyQt5.QtWidgets import (
+    QWidget, QVBoxLayout, QHBoxLayout, QFormLayout, QLabel, QLineEdit, QPushButton, QComboBox,
+    QStackedWidget, QListWidget, QFileDialog, QProgressBar, QPlainTextEdit
+)
+from PyQt5.QtCore import QThread, QObject, QTimer, pyqtSignal, pyqtSlot
+from log_pipeline import LogPipeline, default_log_path
+from online_engine import LocalTarget, S3Target, SFTPTarget, Uploader
+from progress import ProgressTracker, prescan
+from rules import DEFAULT_EXCLUDES, compile_rules
+
+LOG_VIEW_LINES = 5000
+LOG_FLUSH_MS = 100
+
+# Optional module each target needs, for a readable error when it is missing
+TARGET_MODULES = {"s3": "boto3", "sftp": "paramiko"}
+
+
+def make_target(kind, settings):
+    """Build a target from the settings entered in the form."""
+    if kind == "s3":
+        return S3Target(settings["bucket"], endpoint_url=settings["endpoint"], access_key=settings["access_key"],
+                        secret_key=settings["secret_key"], prefix=settings["prefix"])
+    if kind == "sftp":
+        return SFTPTarget(settings["host"], port=settings["port"], username=settings["username"],
+                          password=settings["password"], key_filename=settings["key_file"], root=settings["root"])
+    return LocalTarget(settings["folder"])
+
+
+class UploadWorker(QObject):
+    finished = pyqtSignal()
+    error_occurred = pyqtSignal(str)
+    progress_update = pyqtSignal(int, str)
+
+    def __init__(self, sources, kind, settings, log):
+        super().__init__()
+        self.sources = sources
+        self.kind = kind
+        self.settings = settings
+        self.log = log
+        self.uploader = None
+
+    def run(self):
+        # Caches and build output are left out, as they are by default in the offline tab
+        rules = compile_rules({source: DEFAULT_EXCLUDES for source in self.sources})
+        totals = prescan(self.sources, rules=rules)
+        tracker = ProgressTracker(totals, self.progress_update.emit)
+        self.log.push(f"Found {totals.files} files ({totals.bytes} bytes) to upload")
+        try:
+            target = make_target(self.kind, self.settings)
+        except ImportError:
+            self.error_occurred.emit(f"The {TARGET_MODULES.get(self.kind)} module is required for this target")
+            return
+        except Exception as e:
+            self.error_occurred.emit(f"Cannot connect: {e}")
+            return
+
+        try:
+            self.uploader = Uploader(target)
+            self.uploader.progress = tracker.add
+            self.uploader.rules = rules
+            result = self.uploader.backup(self.sources)
+        except Exception as e:  # Network and credential errors from the target libraries
+            self.error_occurred.emit(f"Upload failed: {e}")
+            return
+        finally:
+            target.close()
+        tracker.finish()
+        if not self.uploader.running:
+            self.error_occurred.emit("Upload canceled, no snapshot was recorded")
+            return
+
+        self.log.push(f"Snapshot {result.snapshot_key}: {result.files} files ({result.bytes} bytes), "
+                      f"{result.skipped} unchanged, {result.uploaded_bytes} bytes sent in "
+                      f"{result.packs} packs, {result.objects} objects and {result.deltas} deltas")
+        if result.errors:
+            for path, message in result.errors:
+                self.log.push(f"Failed to upload {path}: {message}")
+            self.error_occurred.emit(f"{len(result.errors)} file(s) could not be uploaded")
+            return
+        self.finished.emit()
+
+    def stop(self):
+        if self.uploader is not None:
+            self.uploader.stop()
+
 
 class OnlineBackup(QWidget):
     def __init__(self):
         super().__init__()
+        self.log_pipeline = LogPipeline(default_log_path("online"))
+        self.thread = None
+        self.worker = None
         self.init_ui()
 
     def init_ui(self):
         layout = QVBoxLayout()
-        online_label = QLabel("Online Backup functionality will be implemented here.")
-        layout.addWidget(online_label)
-        self.setLayout(layout)
\ No newline at end of file
+
+        # Target Selection
+        layout.addWidget(QLabel("Upload target:"))
+        self.target_combo = QComboBox(self)
+        self.target_combo.addItem("S3 / S3-compatible (MinIO)", "s3")
+        self.target_combo.addItem("SFTP server", "sftp")
+        self.target_combo.addItem("Local or mounted folder", "local")
+        layout.addWidget(self.target_combo)
+
+        self.target_pages = QStackedWidget(self)
+        self.target_combo.currentIndexChanged.connect(self.target_pages.setCurrentIndex)
+        layout.addWidget(self.target_pages)
+
+        self.fields = {}
+        self.add_target_page("s3", [("endpoint", "Endpoint URL (blank for AWS):"), ("bucket", "Bucket:"),
+                                    ("access_key", "Access key:"), ("secret_key", "Secret key:"),
+                                    ("prefix", "Prefix:")])
+        self.add_target_page("sftp", [("host", "Host:"), ("port", "Port:"), ("username", "Username:"),
+                                      ("password", "Password:"), ("key_file", "Private key file:"),
+                                      ("root", "Remote directory:")])
+        self.add_target_page("local", [("folder", "Folder:")])
+        self.fields["s3"]["secret_key"].setEchoMode(QLineEdit.Password)
+        self.fields["sftp"]["password"].setEchoMode(QLineEdit.Password)
+        self.fields["sftp"]["port"].setText("22")
+
+        # Sources
+        layout.addWidget(QLabel("Folders to upload:"))
+        self.source_list = QListWidget(self)
+        layout.addWidget(self.source_list)
+
+        source_buttons = QHBoxLayout()
+        self.add_source_button = QPushButton("Add folder")
+        self.add_source_button.clicked.connect(self.add_source)
+        source_buttons.addWidget(self.add_source_button)
+        self.remove_source_button = QPushButton("Remove selected")
+        self.remove_source_button.clicked.connect(self.remove_source)
+        source_buttons.addWidget(self.remove_source_button)
+        layout.addLayout(source_buttons)
+
+        # Upload and Cancel Buttons
+        self.upload_button = QPushButton("Upload")
+        self.upload_button.clicked.connect(self.upload)
+        layout.addWidget(self.upload_button)
+
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_upload)
+        layout.addWidget(self.cancel_button)
+
+        # Status, Progress and Log
+        self.status_label = QLabel("")
+        layout.addWidget(self.status_label)
+
+        self.progress_bar = QProgressBar(self)
+        self.progress_bar.setRange(0, 100)
+        layout.addWidget(self.progress_bar)
+
+        self.log_output = QPlainTextEdit(self)
+        self.log_output.setReadOnly(True)
+        self.log_output.setMaximumBlockCount(LOG_VIEW_LINES)
+        layout.addWidget(self.log_output)
+
+        self.log_timer = QTimer(self)
+        self.log_timer.timeout.connect(self.flush_log)
+        self.log_timer.start(LOG_FLUSH_MS)
+
+        self.setLayout(layout)
+
+    def add_target_page(self, kind, fields):
+        """Add a form page with one line edit per setting of a target type."""
+        page = QWidget()
+        form = QFormLayout(page)
+        self.fields[kind] = {}
+        for name, label in fields:
+            edit = QLineEdit(page)
+            form.addRow(label, edit)
+            self.fields[kind][name] = edit
+        self.target_pages.addWidget(page)
+
+    def add_source(self):
+        """Prompt to select a folder to upload."""
+        directory = QFileDialog.getExistingDirectory(self, "Select Directory")
+        if directory:
+            self.source_list.addItem(directory)
+
+    def remove_source(self):
+        for item in self.source_list.selectedItems():
+            self.source_list.takeItem(self.source_list.row(item))
+
+    def upload(self):
+        if self.thread and self.thread.isRunning():
+            self.status_label.setText("Status: Upload is already in progress.")
+            return
+
+        kind = self.target_combo.currentData()
+        settings = {name: edit.text().strip() for name, edit in self.fields[kind].items()}
+        sources = [self.source_list.item(row).text() for row in range(self.source_list.count())]
+        required = {"s3": "bucket", "sftp": "host", "local": "folder"}[kind]
+        if not sources or not settings[required]:
+            self.status_label.setText("Please add folders and fill in the target settings.")
+            self.status_label.setStyleSheet("color: red")
+            return
+
+        self.status_label.setText("Status: Uploading...")
+        self.status_label.setStyleSheet("")
+        self.progress_bar.setValue(0)
+        self.progress_bar.setFormat("%p%")
+
+        # Parented to the widget, so it outlives our reference until it has finished
+        self.thread = QThread(self)
+        self.thread.finished.connect(self.thread_finished)
+        self.worker = UploadWorker(sources, kind, settings, self.log_pipeline)
+        self.worker.moveToThread(self.thread)
+        self.thread.started.connect(self.worker.run)
+        self.worker.finished.connect(self.cleanup)
+        self.worker.error_occurred.connect(self.handle_error)
+        self.worker.progress_update.connect(self.update_progress)
+        self.thread.start()
+
+    def flush_log(self):
+        """Move whatever the worker logged since the last tick into the view in one call."""
+        lines, dropped = self.log_pipeline.drain()
+        if dropped:
+            lines.insert(0, f"... {dropped} lines omitted from the view, the log file has them all")
+        if lines:
+            self.log_output.appendPlainText("\n".join(lines))
+
+    @pyqtSlot(int, str)
+    def update_progress(self, percent, text):
+        self.progress_bar.setValue(percent)
+        self.progress_bar.setFormat(f"%p% - {text}")
+
+    def handle_error(self, error_message):
+        self.status_label.setText(f"Status: Error - {error_message}")
+        self.status_label.setStyleSheet("color: red")
+        self.log_pipeline.push(error_message)
+        self.run_ended()
+
+    def cancel_upload(self):
+        if self.thread and self.thread.isRunning():
+            self.worker.stop()
+            self.status_label.setText("Status: Canceling...")
+            self.log_pipeline.push("Upload canceled.")
+        else:
+            self.log_pipeline.push("No active upload to cancel.")
+
+    @pyqtSlot()
+    def cleanup(self):
+        self.progress_bar.setValue(100)
+        self.status_label.setText("Status: Done.")
+        self.status_label.setStyleSheet("color: green")
+        self.log_pipeline.push("Upload completed successfully.")
+        self.run_ended()
+
+    def run_ended(self):
+        """Let the worker thread wind down on its own; thread_finished drops it once it has."""
+        if self.thread is not None:
+            self.thread.quit()
+
+    @pyqtSlot()
+    def thread_finished(self):
+        thread = self.sender()
+        thread.deleteLater()
+        if thread is self.thread:
+            self.thread = None
+            self.worker = None
@@ -0,0 +1,596 @@
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import queue
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from delta import apply_patch, decode_patch, encode_patch, make_delta, scan_file
+
+# Files below this size are batched into pack objects; per-object round trips dominate config trees
+SMALL_FILE = 1024 * 1024
+PACK_SIZE = 16 * 1024 * 1024
+# Files above this size are uploaded as parallel multipart uploads
+PART_SIZE = 16 * 1024 * 1024
+HASH_BLOCK = 1024 * 1024
+
+SNAPSHOT_PREFIX = "snapshots/"
+# Large files that changed are sent as block deltas against their previous version, as long as
+# the delta stays below this share of the file and the chain to a full object stays short
+DELTA_MAX_RATIO = 0.5
+DELTA_MAX_CHAIN = 10
+
+
+def signature_cache_dir():
+    """Local copy of uploaded block signatures, so a delta needs no download first."""
+    cache = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache, "confback", "signatures")
+
+
+def hash_file(path):
+    """Return the SHA-256 of a file, read in large sequential blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def part_ranges(size, part_size):
+    return [(offset, min(part_size, size - offset)) for offset in range(0, size, part_size)]
+
+
+def read_range(path, offset, length):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.pread(fd, length, offset)
+    finally:
+        os.close(fd)
+
+
+class LocalTarget:
+    """Directory laid out like a bucket; a stand-in for tests and for mounted network shares."""
+
+    def __init__(self, root, connections=8, part_size=PART_SIZE):
+        self.root = root
+        self.part_size = part_size
+        self.pool = ThreadPoolExecutor(max_workers=connections)
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.part"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def put_file(self, key, path, size):
+        path_out = self.path(key)
+        os.makedirs(os.path.dirname(path_out), exist_ok=True)
+        tmp_path = f"{path_out}.{threading.get_ident()}.part"
+        with open(tmp_path, "wb") as f:
+            f.truncate(size)
+
+        def write_part(offset, length):
+            data = read_range(path, offset, length)
+            fd = os.open(tmp_path, os.O_WRONLY)
+            try:
+                os.pwrite(fd, data, offset)
+            finally:
+                os.close(fd)
+
+        for future in [self.pool.submit(write_part, *part) for part in part_ranges(size, self.part_size)]:
+            future.result()
+        os.replace(tmp_path, path_out)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def get(self, key):
+        with open(self.path(key), "rb") as f:
+            return f.read()
+
+    def get_range(self, key, offset, length):
+        return read_range(self.path(key), offset, length)
+
+    def list(self, prefix):
+        directory = self.path(prefix.rstrip("/"))
+        if not os.path.isdir(directory):
+            return []
+        return sorted(prefix + name for name in os.listdir(directory) if not name.endswith(".part"))
+
+    def close(self):
+        self.pool.shutdown()
+
+
+class S3Target:
+    """S3 or S3-compatible bucket (MinIO, Ceph, ...) through boto3's pooled HTTP connections."""
+
+    def __init__(self, bucket, endpoint_url=None, access_key=None, secret_key=None, region=None,
+                 prefix="", connections=16, part_size=PART_SIZE):
+        import boto3
+        from botocore.config import Config
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.part_size = part_size
+        self.client = boto3.client(
+            "s3", endpoint_url=endpoint_url or None, region_name=region or None,
+            aws_access_key_id=access_key or None, aws_secret_access_key=secret_key or None,
+            config=Config(max_pool_connections=connections, retries={"max_attempts": 5, "mode": "adaptive"}))
+        self.pool = ThreadPoolExecutor(max_workers=connections)
+
+    def put(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data)
+
+    def put_file(self, key, path, size):
+        if size <= self.part_size:
+            with open(path, "rb") as f:
+                self.put(key, f.read())
+            return
+        key = self.prefix + key
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=key)["UploadId"]
+
+        def upload_part(number, offset, length):
+            response = self.client.upload_part(Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number,
+                                               Body=read_range(path, offset, length))
+            return {"PartNumber": number, "ETag": response["ETag"]}
+
+        try:
+            futures = [self.pool.submit(upload_part, number, offset, length)
+                       for number, (offset, length) in enumerate(part_ranges(size, self.part_size), 1)]
+            parts = [future.result() for future in futures]
+            self.client.complete_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id,
+                                                  MultipartUpload={"Parts": parts})
+        except Exception:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def get(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)["Body"].read()
+
+    def get_range(self, key, offset, length):
+        response = self.client.get_object(Bucket=self.bucket, Key=self.prefix + key,
+                                          Range=f"bytes={offset}-{offset + length - 1}")
+        return response["Body"].read()
+
+    def list(self, prefix):
+        keys = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            keys.extend(item["Key"][len(self.prefix):] for item in page.get("Contents", []))
+        return sorted(keys)
+
+    def close(self):
+        self.pool.shutdown()
+
+
+class SFTPTarget:
+    """Directory on an SFTP server, with a pool of SSH connections shared by all uploads."""
+
+    def __init__(self, host, port=22, username=None, password=None, key_filename=None, root=".",
+                 connections=8, part_size=PART_SIZE):
+        import paramiko
+
+        self.paramiko = paramiko
+        self.connect_args = {"hostname": host, "port": int(port or 22), "username": username or None,
+                             "password": password or None, "key_filename": key_filename or None}
+        self.root = root.rstrip("/") or "/"
+        self.part_size = part_size
+        self.connections = queue.LifoQueue()
+        self.clients = []
+        self.slots = threading.BoundedSemaphore(connections)
+        self.known_dirs = set()
+        self.dir_lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=connections)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection from the pool, opening a new one while under the limit."""
+        self.slots.acquire()
+        try:
+            try:
+                sftp = self.connections.get_nowait()
+            except queue.Empty:
+                client = self.paramiko.SSHClient()
+                client.set_missing_host_key_policy(self.paramiko.RejectPolicy())
+                client.load_system_host_keys()
+                client.connect(**self.connect_args)
+                self.clients.append(client)
+                sftp = client.open_sftp()
+            yield sftp
+            self.connections.put(sftp)
+        finally:
+            self.slots.release()
+
+    def path(self, key):
+        return posixpath.join(self.root, key)
+
+    def makedirs(self, sftp, directory):
+        with self.dir_lock:
+            if directory in self.known_dirs:
+                return
+        parts = []
+        current = directory
+        while current not in ("", "/") and current not in self.known_dirs:
+            parts.append(current)
+            current = posixpath.dirname(current)
+        for path in reversed(parts):
+            try:
+                sftp.stat(path)
+            except IOError:
+                try:
+                    sftp.mkdir(path)
+                except IOError:
+                    sftp.stat(path)  # Created by a concurrent upload, anything else is a real error
+        with self.dir_lock:
+            self.known_dirs.update(parts)
+
+    def put(self, key, data):
+        path = self.path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.part"
+        with self.connection() as sftp:
+            self.makedirs(sftp, posixpath.dirname(path))
+            with sftp.open(tmp_path, "wb") as f:
+                f.set_pipelined(True)
+                f.write(data)
+            sftp.posix_rename(tmp_path, path)
+
+    def put_file(self, key, path, size):
+        remote = self.path(key)
+        tmp_path = f"{remote}.{threading.get_ident()}.part"
+        with self.connection() as sftp:
+            self.makedirs(sftp, posixpath.dirname(remote))
+            with sftp.open(tmp_path, "wb") as f:
+                f.truncate(size)
+
+        def write_part(offset, length):
+            data = read_range(path, offset, length)
+            with self.connection() as sftp:
+                with sftp.open(tmp_path, "r+b") as f:
+                    f.set_pipelined(True)
+                    f.seek(offset)
+                    f.write(data)
+
+        for future in [self.pool.submit(write_part, *part) for part in part_ranges(size, self.part_size)]:
+            future.result()
+        with self.connection() as sftp:
+            sftp.posix_rename(tmp_path, remote)
+
+    def exists(self, key):
+        with self.connection() as sftp:
+            try:
+                sftp.stat(self.path(key))
+                return True
+            except IOError:
+                return False
+
+    def get(self, key):
+        with self.connection() as sftp:
+            with sftp.open(self.path(key), "rb") as f:
+                f.prefetch()
+                return f.read()
+
+    def get_range(self, key, offset, length):
+        with self.connection() as sftp:
+            with sftp.open(self.path(key), "rb") as f:
+                f.seek(offset)
+                return f.read(length)
+
+    def list(self, prefix):
+        directory = self.path(prefix.rstrip("/"))
+        with self.connection() as sftp:
+            try:
+                names = sftp.listdir(directory)
+            except IOError:
+                return []
+        return sorted(prefix + name for name in names if not name.endswith(".part"))
+
+    def close(self):
+        self.pool.shutdown()
+        for client in self.clients:
+            client.close()
+
+
+class UploadResult:
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.uploaded_bytes = 0
+        self.skipped = 0  # Unchanged since the previous snapshot, nothing read or sent
+        self.packs = 0
+        self.objects = 0
+        self.deltas = 0
+        self.errors = []  # List of (path, message) tuples
+        self.snapshot_key = None
+        self.lock = threading.Lock()
+
+    def add_error(self, path, error):
+        with self.lock:
+            self.errors.append((path, str(error)))
+
+    def add_upload(self, size, pack=False, delta=False):
+        with self.lock:
+            self.uploaded_bytes += size
+            if pack:
+                self.packs += 1
+            elif delta:
+                self.deltas += 1
+            else:
+                self.objects += 1
+
+
+class Packer:
+    """Collect small files into pack objects and upload each pack once it is full."""
+
+    def __init__(self, uploader, result):
+        self.uploader = uploader
+        self.result = result
+        self.lock = threading.Lock()
+        self.buffer = bytearray()
+        self.entries = []
+
+    def add(self, entry, data):
+        with self.lock:
+            entry["offset"] = len(self.buffer)
+            entry["length"] = len(data)
+            self.buffer += data
+            self.entries.append(entry)
+            if len(self.buffer) < PACK_SIZE:
+                return
+            data, entries = bytes(self.buffer), self.entries
+            self.buffer, self.entries = bytearray(), []
+        self.upload(data, entries)
+
+    def upload(self, data, entries):
+        key = f"packs/{hashlib.sha256(data).hexdigest()}"
+        try:
+            self.uploader.target.put(key, data)
+        except Exception as e:
+            for entry in entries:
+                self.result.add_error(entry["source"], e)
+                entry.clear()
+            return
+        self.result.add_upload(len(data), pack=True)
+        for entry in entries:
+            entry["key"] = key
+
+    def flush(self):
+        with self.lock:
+            data, entries = bytes(self.buffer), self.entries
+            self.buffer, self.entries = bytearray(), []
+        if entries:
+            self.upload(data, entries)
+
+
+class Uploader:
+    """Back up sources to a target: small files packed, large files content-addressed.
+
+    Reading, hashing and uploading run on one pool, so while some files are hashed
+    others are already on the wire; large files additionally upload their parts in
+    parallel over the target's connection pool.
+    """
+
+    def __init__(self, target, workers=16, host=None, signature_cache=None):
+        self.target = target
+        self.workers = workers
+        self.host = host or socket.gethostname()
+        self.signature_cache = signature_cache or signature_cache_dir()
+        self.running = True
+        self.progress = None  # Optional callable(files, bytes) invoked per finished file
+        self.rules = {}  # Source: compiled rules.Rules
+
+    def stop(self):
+        self.running = False
+
+    def snapshots(self):
+        """Return snapshot keys of this host, oldest first."""
+        return [key for key in self.target.list(SNAPSHOT_PREFIX)
+                if posixpath.basename(key).rsplit("-", 1)[0] == self.host]
+
+    def load_snapshot(self, key):
+        return json.loads(gzip.decompress(self.target.get(key)))
+
+    def walk(self, source, result):
+        """Yield (path, snapshot path, stat) for regular files below source not excluded by its rules."""
+        stack = [(source, os.path.basename(source))]
+        rules = self.rules.get(source)
+        skip = len(os.path.basename(source)) + 1  # Rules see paths relative to the source
+        while stack and self.running:
+            path, rel_dir = stack.pop()
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        rel_path = f"{rel_dir}/{entry.name}"
+                        try:
+                            if rules is not None and rules.excludes(rel_path[skip:], entry.is_dir(follow_symlinks=False)):
+                                continue
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append((entry.path, rel_path))
+                            elif entry.is_file(follow_symlinks=False):
+                                yield entry.path, rel_path, entry.stat(follow_symlinks=False)
+                        except OSError as e:
+                            result.add_error(entry.path, e)
+            except OSError as e:
+                result.add_error(path, e)
+
+    def upload_small(self, packer, path, entry, result):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError as e:
+            result.add_error(path, e)
+            entry.clear()
+            return
+        entry["sha256"] = hashlib.sha256(data).hexdigest()
+        packer.add(entry, data)
+
+    def load_signature(self, sha256):
+        """Return the block signature of an uploaded file from the local cache or the target."""
+        path = os.path.join(self.signature_cache, sha256)
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            pass
+        key = f"signatures/{sha256}"
+        if not self.target.exists(key):
+            return None
+        signature = self.target.get(key)
+        self.cache_signature(sha256, signature)
+        return signature
+
+    def cache_signature(self, sha256, signature):
+        try:
+            os.makedirs(self.signature_cache, exist_ok=True)
+            tmp_path = f"{os.path.join(self.signature_cache, sha256)}.{threading.get_ident()}.part"
+            with open(tmp_path, "wb") as f:
+                f.write(signature)
+            os.replace(tmp_path, os.path.join(self.signature_cache, sha256))
+        except OSError:
+            pass  # The cache only saves a download
+
+    def upload_delta(self, path, entry, old, result):
+        """Send a changed file as a patch against its previous version, returning whether it worked."""
+        if not old or "sha256" not in old or "offset" in old:
+            return False
+        depth = old.get("depth", 0)
+        if depth >= DELTA_MAX_CHAIN:
+            return False
+        signature = self.load_signature(old["sha256"])
+        if signature is None:
+            return False
+        key = f"deltas/{entry['sha256']}"
+        if old["key"] == key:
+            return False  # A patch must never be its own base
+        delta = make_delta(path, signature, max_literal=int(entry["size"] * DELTA_MAX_RATIO))
+        if delta is None:
+            return False
+        recipe, literal = delta
+        block_size = int.from_bytes(signature[4:8], "little")
+        patch = encode_patch(old["key"], entry["size"], entry["sha256"], recipe, literal, block_size)
+        self.target.put(key, patch)
+        result.add_upload(len(patch), delta=True)
+        entry["key"] = key
+        entry["depth"] = depth + 1
+        return True
+
+    def upload_large(self, path, entry, result, old=None):
+        try:
+            # One read gives both the content hash and the signature the next delta needs
+            entry["sha256"], signature = scan_file(path)
+            key = f"objects/{entry['sha256']}"
+            if self.target.exists(key):
+                entry["key"] = key
+                return
+            # Content stored before, e.g. only touched or changed back: reuse it, since a new
+            # patch under the same key could end up in its own base chain
+            delta_key = f"deltas/{entry['sha256']}"
+            if self.target.exists(delta_key):
+                entry["key"] = delta_key
+                # The chain length is only known for the version it replaces; otherwise
+                # assume the longest, so the next change is uploaded in full
+                entry["depth"] = old.get("depth", 0) if old and old.get("key") == delta_key else DELTA_MAX_CHAIN
+                return
+            if not self.upload_delta(path, entry, old, result):
+                self.target.put_file(key, path, entry["size"])
+                result.add_upload(entry["size"])
+                entry["key"] = key
+            self.target.put(f"signatures/{entry['sha256']}", signature)
+            self.cache_signature(entry["sha256"], signature)
+        except Exception as e:
+            result.add_error(path, e)
+            entry.clear()
+
+    def fetch(self, entry, out, chain=()):
+        """Write the content of a snapshot entry to the binary file out."""
+        key = entry["key"]
+        if "offset" in entry:
+            out.write(self.target.get_range(key, entry["offset"], entry["length"]))
+        elif key.startswith("deltas/"):
+            header, literal = decode_patch(self.target.get(key))
+            chain += (key,)
+            if header["base"] in chain:
+                raise ValueError(f"Delta chain of {key} loops back to {header['base']}")
+            if header["base"].startswith("deltas/"):
+                # Rebuild the base version locally first, a chain costs one full download
+                with tempfile.TemporaryFile() as base:
+                    self.fetch({"key": header["base"]}, base, chain)
+                    apply_patch(header, literal, lambda offset, length: os.pread(base.fileno(), length, offset), out)
+            else:
+                apply_patch(header, literal, lambda offset, length: self.target.get_range(header["base"], offset, length),
+                            out)
+        elif "size" in entry:
+            for offset, length in part_ranges(entry["size"], PART_SIZE):
+                out.write(self.target.get_range(key, offset, length))
+        else:
+            out.write(self.target.get(key))
+
+    def backup(self, sources):
+        """Upload every file below sources and record them as a new snapshot."""
+        result = UploadResult()
+        previous = self.snapshots()
+        previous = self.load_snapshot(previous[-1])["files"] if previous else {}
+        files = {}
+        packer = Packer(self, result)
+        pending = threading.BoundedSemaphore(self.workers * 4)
+
+        def task(path, entry, size, old):
+            try:
+                if size < SMALL_FILE:
+                    self.upload_small(packer, path, entry, result)
+                else:
+                    self.upload_large(path, entry, result, old)
+            finally:
+                pending.release()
+                if self.progress is not None:
+                    self.progress(1, size)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for source in sources:
+                source = source.rstrip(os.sep) or os.sep
+                for path, rel_path, st in self.walk(source, result):
+                    result.files += 1
+                    result.bytes += st.st_size
+                    old = previous.get(rel_path)
+                    if old and (old["size"], old["mtime_ns"]) == (st.st_size, st.st_mtime_ns):
+                        files[rel_path] = old
+                        result.skipped += 1
+                        if self.progress is not None:
+                            self.progress(1, st.st_size)
+                        continue
+                    entry = {"source": path, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "mode": st.st_mode}
+                    files[rel_path] = entry
+                    pending.acquire()
+                    executor.submit(task, path, entry, st.st_size, old)
+        packer.flush()
+
+        if not self.running:
+            return result
+        # Failed entries were cleared, they must not appear in the snapshot as if they were stored
+        files = {rel_path: entry for rel_path, entry in files.items() if "key" in entry}
+        for entry in files.values():
+            entry.pop("source", None)
+        result.snapshot_key = f"{SNAPSHOT_PREFIX}{self.host}-{time.strftime('%Y%m%dT%H%M%S')}.json.gz"
+        snapshot = {"host": self.host, "created": time.time(), "files": files}
+        self.target.put(result.snapshot_key, gzip.compress(json.dumps(snapshot, separators=(",", ":")).encode()))
+        return result
@@ -0,0 +1,266 @@
+import os
+import sqlite3
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from copy_engine import copy_file
+
+# Files below this size are appended to pack files, larger ones are copied as normal files
+SMALL_FILE = 64 * 1024
+PACK_SIZE = 64 * 1024 * 1024
+PACK_DIR = "packs"
+INDEX_NAME = "index.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    pack TEXT,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    mode INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class PackResult:
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.packed = 0  # Small files appended to packs
+        self.unchanged = 0  # Files the index already holds in this version
+        self.errors = []  # List of (path, message) tuples
+        self.rows = []  # Index rows of stored files
+        self.lock = threading.Lock()
+
+    def add_error(self, path, error):
+        with self.lock:
+            self.errors.append((path, str(error)))
+
+    def add_row(self, row, packed):
+        with self.lock:
+            self.rows.append(row)
+            self.packed += packed
+
+
+class PackWriter:
+    """Appends data to the current pack file and starts a new one when it is full.
+
+    Packs are only ever appended to by the run that created them, so a reader of an
+    older index never sees bytes move.
+    """
+
+    def __init__(self, root, pack_size=PACK_SIZE):
+        self.root = root
+        self.pack_size = pack_size
+        self.lock = threading.Lock()
+        self.file = None
+        self.name = None
+        self.size = 0
+        numbers = [int(name.split(".")[0]) for name in os.listdir(root) if name.endswith(".pack")]
+        self.number = max(numbers, default=0)
+
+    def append(self, data):
+        """Write data and return (pack name, offset) of where it landed."""
+        with self.lock:
+            if self.file is None or self.size + len(data) > self.pack_size and self.size:
+                self.rotate()
+            offset = self.size
+            self.file.write(data)
+            self.size += len(data)
+            return self.name, offset
+
+    def rotate(self):
+        self.close()
+        self.number += 1
+        self.name = f"{self.number:08d}.pack"
+        self.file = open(os.path.join(self.root, self.name), "xb")
+        self.size = 0
+
+    def close(self):
+        """Flush the current pack to disk; the index may only point at data that is there."""
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
+
+
+class PackStore:
+    """Destination layout that packs small files into append-only pack files.
+
+    Small files and symlinks are appended to <destination>/packs/NNNNNNNN.pack and
+    located through an SQLite index of path, pack, offset, length, mode and mtime.
+    Large files are copied to <destination>/<source name>/... as usual. Writing a few
+    big sequential files instead of thousands of tiny ones is what makes this fast
+    on USB sticks and network shares.
+    """
+
+    def __init__(self, destination, workers=None):
+        self.destination = destination
+        self.root = os.path.join(destination, PACK_DIR)
+        os.makedirs(self.root, exist_ok=True)
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(self.root, INDEX_NAME), check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.running = True
+        self.rules = {}  # Source: compiled rules.Rules
+        self.progress = None  # Optional callable(files, bytes, skipped=False) invoked per finished file
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def walk(self, source, result):
+        """Yield (path, stored path, stat) for files and symlinks below source."""
+        stack = [(source, os.path.basename(source))]
+        rules = self.rules.get(source)
+        skip = len(os.path.basename(source)) + 1  # Rules see paths relative to the source
+        while stack and self.running:
+            path, rel_dir = stack.pop()
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        rel_path = f"{rel_dir}/{entry.name}"
+                        try:
+                            if rules is not None and rules.excludes(rel_path[skip:], entry.is_dir(follow_symlinks=False)):
+                                continue
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append((entry.path, rel_path))
+                            elif entry.is_file(follow_symlinks=False) or entry.is_symlink():
+                                yield entry.path, rel_path, entry.stat(follow_symlinks=False)
+                        except OSError as e:
+                            result.add_error(entry.path, e)
+            except OSError as e:
+                result.add_error(path, e)
+
+    def store(self, writer, path, rel_path, st, result):
+        try:
+            if stat.S_ISLNK(st.st_mode):
+                data = os.fsencode(os.readlink(path))
+            elif st.st_size < SMALL_FILE:
+                with open(path, "rb") as f:
+                    data = f.read()
+            else:
+                target = os.path.join(self.destination, rel_path)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                size = copy_file(path, target, st)
+                result.add_row((rel_path, None, 0, size, st.st_mode, st.st_mtime_ns), False)
+                return
+            pack, offset = writer.append(data)
+            result.add_row((rel_path, pack, offset, len(data), st.st_mode, st.st_mtime_ns), True)
+        except OSError as e:
+            result.add_error(path, e)
+        finally:
+            if self.progress is not None:
+                self.progress(1, st.st_size)
+
+    def backup(self, sources):
+        """Store every file below sources, skipping those the index already has unchanged."""
+        result = PackResult()
+        with self.lock:
+            known = {path: (pack, length, mode, mtime_ns) for path, pack, length, mode, mtime_ns
+                     in self.conn.execute("SELECT path, pack, length, mode, mtime_ns FROM files")}
+        seen = set()
+        writer = PackWriter(self.root)
+        pending = threading.BoundedSemaphore(self.workers * 4)
+
+        def task(path, rel_path, st):
+            try:
+                self.store(writer, path, rel_path, st, result)
+            finally:
+                pending.release()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for source in sources:
+                    source = source.rstrip(os.sep) or os.sep
+                    for path, rel_path, st in self.walk(source, result):
+                        result.files += 1
+                        result.bytes += st.st_size
+                        seen.add(rel_path)
+                        old = known.get(rel_path)
+                        # Symlink lengths are those of their target string, which lstat also reports
+                        if old is not None and old[1:] == (st.st_size, st.st_mode, st.st_mtime_ns):
+                            result.unchanged += 1
+                            if self.progress is not None:
+                                self.progress(1, st.st_size, skipped=True)
+                            continue
+                        pending.acquire()
+                        executor.submit(task, path, rel_path, st)
+        finally:
+            writer.close()
+
+        if not self.running:
+            return result  # Appended data stays unreferenced, the index is untouched
+        # Loose copies of files that are now packed would otherwise linger
+        stale = [row[0] for row in result.rows if row[1] is not None and row[0] in known and known[row[0]][0] is None]
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", result.rows)
+            # After a walk error, files not seen may still exist; keep them and their loose copies
+            if not result.errors:
+                removed = [path for path in known if path not in seen]
+                self.conn.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in removed])
+                stale += [path for path in removed if known[path][0] is None]
+        for path in stale:
+            try:
+                os.unlink(os.path.join(self.destination, path))
+            except OSError:
+                pass
+        return result
+
+    def entries(self, pattern=None):
+        """Return (path, size, mode, mtime_ns) of stored files, optionally matching a GLOB pattern."""
+        query = "SELECT path, length, mode, mtime_ns FROM files"
+        with self.lock:
+            if pattern is None:
+                return self.conn.execute(query + " ORDER BY path").fetchall()
+            return self.conn.execute(query + " WHERE path GLOB ? ORDER BY path", (pattern,)).fetchall()
+
+    def locate(self, rel_path):
+        """Return (file, offset, length, pack) of a stored file; pack is None for a loose copy."""
+        with self.lock:
+            row = self.conn.execute("SELECT pack, offset, length FROM files WHERE path = ?", (rel_path,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(rel_path)
+        pack, offset, length = row
+        path = os.path.join(self.root, pack) if pack else os.path.join(self.destination, rel_path)
+        return path, offset, length, pack
+
+    def read(self, rel_path):
+        """Return the content of one stored file (the target of a symlink) through the index."""
+        path, offset, length, _ = self.locate(rel_path)
+        with open(path, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def restore(self, target, paths=None):
+        """Recreate stored files below target, optionally only the given stored paths; return errors."""
+        errors = []
+        with self.lock:
+            rows = self.conn.execute("SELECT path, pack, mode, mtime_ns FROM files ORDER BY path").fetchall()
+        for rel_path, pack, mode, mtime_ns in rows:
+            if paths is not None and rel_path not in paths:
+                continue
+            dst = os.path.join(target, rel_path)
+            try:
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                if pack is None:
+                    loose = os.path.join(self.destination, rel_path)
+                    copy_file(loose, dst, os.stat(loose))
+                    continue
+                data = self.read(rel_path)
+                if stat.S_ISLNK(mode):
+                    os.symlink(os.fsdecode(data), dst)
+                    continue
+                with open(dst, "wb") as f:
+                    f.write(data)
+                os.chmod(dst, stat.S_IMODE(mode))
+                os.utime(dst, ns=(mtime_ns, mtime_ns))
+            except OSError as e:
+                errors.append((rel_path, str(e)))
+        return errors
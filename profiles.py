@@ -0,0 +1,215 @@
+import json
+import os
+import sqlite3
+import stat
+import threading
+from urllib.parse import quote
+from copy_engine import copy_file
+from manifest import state_dir
+
+# A folder holding this file is a Firefox-family (Firefox, LibreWolf) profile
+PROFILE_MARKER = "prefs.js"
+# Regenerated by the browser, never worth backing up; relative to a profile
+PROFILE_EXCLUDES = [
+    "cache2/", "startupCache/", "thumbnails/", "safebrowsing/", "shader-cache/", "jumpListCache/",
+    "OfflineCache/", "storage/temporary/", "saved-telemetry-pings/", "crashes/", "minidumps/",
+]
+DATABASE_SUFFIX = ".sqlite"
+JOURNAL_SUFFIXES = ("-wal", "-shm", "-journal")
+SQLITE_HEADER = b"SQLite format 3\0"
+# Pages copied per backup step; the source is only read-locked for the duration of a step
+PAGES_PER_STEP = 256
+STEP_SLEEP = 0.05
+LOCK_TIMEOUT = 5.0
+STATE_NAME = "databases.json"
+
+
+def find_profiles(source):
+    """Return the paths, relative to source, of the browser profiles in it ("" for source itself).
+
+    Profiles are looked for in the source and two levels below, which covers pointing
+    a source at a profile, at ~/.librewolf or at ~/.mozilla.
+    """
+    profiles = []
+    level = [""]
+    for _ in range(3):
+        below = []
+        for rel_dir in level:
+            path = os.path.join(source, rel_dir) if rel_dir else source
+            try:
+                with os.scandir(path) as entries:
+                    entries = list(entries)
+            except OSError:
+                continue
+            if any(entry.name == PROFILE_MARKER for entry in entries):
+                profiles.append(rel_dir)
+                continue
+            below += [f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                      for entry in entries if entry.is_dir(follow_symlinks=False)]
+        level = below
+    return profiles
+
+
+def profile_rules(profiles, databases=True):
+    """Exclude rules for the caches of profiles, and for their databases when a database stage copies them."""
+    lines = []
+    for rel_dir in profiles:
+        prefix = f"/{rel_dir}/" if rel_dir else "/"
+        lines += [prefix + pattern for pattern in PROFILE_EXCLUDES]
+        if databases:
+            lines += [f"{prefix}**/*{DATABASE_SUFFIX}{suffix}" for suffix in ("",) + JOURNAL_SUFFIXES]
+    return lines
+
+
+def fingerprint(path):
+    """Return what identifies the current content of a database, or None if it is not one.
+
+    The change counter in the header moves with every commit in rollback journal
+    mode; in WAL mode commits land in the -wal file first, so its size and mtime
+    count as well.
+    """
+    with open(path, "rb") as f:
+        header = f.read(100)
+    if not header.startswith(SQLITE_HEADER):
+        return None
+    st = os.stat(path)
+    try:
+        wal = os.stat(path + "-wal")
+        wal_state = [wal.st_size, wal.st_mtime_ns]
+    except FileNotFoundError:
+        wal_state = [0, 0]
+    return [int.from_bytes(header[24:28], "big"), st.st_size, st.st_mtime_ns] + wal_state
+
+
+def backup_database(path, dst, st):
+    """Copy a live database with the sqlite3 backup API into a consistent file at dst.
+
+    The copy is written next to dst and renamed, so an interrupted run never leaves
+    half a database behind. Returns the size of the copy.
+    """
+    tmp = dst + ".part"
+    if os.path.exists(tmp):
+        os.unlink(tmp)
+    source = sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True, timeout=LOCK_TIMEOUT)
+    try:
+        target = sqlite3.connect(tmp)
+        try:
+            source.backup(target, pages=PAGES_PER_STEP, sleep=STEP_SLEEP)
+        finally:
+            target.close()
+    finally:
+        source.close()
+    os.chmod(tmp, stat.S_IMODE(st.st_mode))
+    os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.replace(tmp, dst)
+    return os.path.getsize(dst)
+
+
+class DatabaseResult:
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.unchanged = 0
+        self.plain = []  # (path, reason) of databases that had to be copied as plain files
+        self.errors = []  # List of (path, message) tuples
+        self.lock = threading.Lock()
+
+    def add_error(self, path, error):
+        with self.lock:
+            self.errors.append((path, str(error)))
+
+
+class DatabaseCopier:
+    """Copies the SQLite databases of browser profiles consistently while the browser runs.
+
+    Databases whose fingerprint matches the one recorded by the previous run in the
+    destination are not read at all: a mirror keeps its copy, a snapshot hardlinks
+    the copy in the previous snapshot.
+    """
+
+    def __init__(self, destination):
+        self.destination = destination
+        self.state_path = os.path.join(state_dir(destination), STATE_NAME)
+        try:
+            with open(self.state_path) as f:
+                self.known = json.load(f)
+        except (OSError, ValueError):
+            self.known = {}
+        self.state = {}
+        self.lock = threading.Lock()
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+    def databases(self, source, profiles, rules=None):
+        """Yield (path, relative path) of the databases in the profiles of a source, skipping excluded folders."""
+        stack = list(profiles)
+        while stack and self.running:
+            rel_dir = stack.pop()
+            try:
+                with os.scandir(os.path.join(source, rel_dir) if rel_dir else source) as entries:
+                    for entry in entries:
+                        rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                        if entry.is_dir(follow_symlinks=False):
+                            if rules is None or not rules.excludes(rel_path, True):
+                                stack.append(rel_path)
+                        elif entry.name.endswith(DATABASE_SUFFIX) and entry.is_file(follow_symlinks=False):
+                            yield entry.path, rel_path
+            except OSError:
+                continue  # Unreadable folders are reported by the copy engine
+
+    def copy(self, source, profiles, target, result, rules=None, previous=None):
+        """Back up the databases of a source into target, linking unchanged ones from previous if given."""
+        for path, rel_path in self.databases(source, profiles, rules):
+            dst = os.path.join(target, rel_path)
+            try:
+                st = os.stat(path)
+                state = fingerprint(path)
+                is_database = state is not None
+                if not is_database:
+                    state = [None, st.st_size, st.st_mtime_ns]  # Named like one, copied like any file
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                if self.known.get(path) == state and self.keep(dst, previous, rel_path):
+                    result.unchanged += 1
+                elif not is_database:
+                    result.bytes += copy_file(path, dst, st)
+                    result.files += 1
+                else:
+                    try:
+                        result.bytes += backup_database(path, dst, st)
+                    except sqlite3.Error as e:
+                        # Locked exclusively or damaged; a plain copy is still better than none,
+                        # but must not count as a good copy next time
+                        result.plain.append((path, str(e)))
+                        result.bytes += copy_file(path, dst, st)
+                        state = None
+                    result.files += 1
+                if state is not None:
+                    with self.lock:
+                        self.state[path] = state
+            except OSError as e:
+                result.add_error(path, e)
+        return result
+
+    def keep(self, dst, previous, rel_path):
+        """Whether an unchanged database is already in place, linking it from the previous snapshot if needed."""
+        if previous is None:
+            return os.path.exists(dst)
+        try:
+            if os.path.lexists(dst):
+                os.unlink(dst)
+            os.link(os.path.join(previous, rel_path), dst)
+        except OSError:
+            return False
+        return True
+
+    def save(self):
+        """Record the fingerprints of this run, keeping those of databases not seen this time."""
+        with self.lock:
+            known = dict(self.known, **self.state)
+            self.known = known  # A watcher saves after every batch
+        tmp = self.state_path + ".part"
+        with open(tmp, "w") as f:
+            json.dump(known, f)
+        os.replace(tmp, self.state_path)
@@ -0,0 +1,180 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Signals per second the UI sees at most, however fast the engines report
+EMIT_RATE = 10
+# Weight of the newest sample in the smoothed throughput
+RATE_SMOOTHING = 0.3
+
+# rsync --info=progress2 line: "    1,234,567  45%   12.34MB/s    0:00:10 (xfr#5, to-chk=10/20)"
+RSYNC_PROGRESS = re.compile(r"^\s*([\d,.]+)\s+(\d+)%")
+
+
+class ScanTotals:
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.per_source = {}  # source -> (files, bytes)
+
+
+def scan_dir(path, rel_dir="", rules=None):
+    """Return (files, bytes, [(subdirectory, relative path)]) for one directory, without recursing."""
+    files = size = 0
+    subdirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if rules is not None and rules.excludes(rel_path, is_dir):
+                        continue
+                    if is_dir:
+                        subdirs.append((entry.path, rel_path))
+                    else:
+                        files += 1
+                        if entry.is_file(follow_symlinks=False):
+                            size += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+    except OSError:
+        pass  # Unreadable directories are reported by the engine that copies them
+    return files, size, subdirs
+
+
+def prescan(sources, workers=None, rules=None):
+    """Count files and bytes below every source, scanning directories in parallel.
+
+    rules maps a source to the compiled exclude rules its engine will apply.
+    """
+    totals = ScanTotals()
+    rules = rules or {}
+    workers = workers or min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        for source in sources:
+            totals.per_source[source] = (0, 0)
+            if os.path.isdir(source):
+                source_rules = rules.get(source.rstrip(os.sep) or os.sep)
+                pending[executor.submit(scan_dir, source, "", source_rules)] = (source, source_rules)
+            elif os.path.exists(source):
+                totals.per_source[source] = (1, os.path.getsize(source))
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                source, source_rules = pending.pop(future)
+                files, size, subdirs = future.result()
+                source_files, source_bytes = totals.per_source[source]
+                totals.per_source[source] = (source_files + files, source_bytes + size)
+                for subdir, rel_path in subdirs:
+                    pending[executor.submit(scan_dir, subdir, rel_path, source_rules)] = (source, source_rules)
+    for files, size in totals.per_source.values():
+        totals.files += files
+        totals.bytes += size
+    return totals
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def parse_rsync_progress(line):
+    """Return the bytes transferred so far from an rsync --info=progress2 line, or None."""
+    match = RSYNC_PROGRESS.match(line)
+    if not match:
+        return None
+    return int(match.group(1).replace(",", "").replace(".", ""))
+
+
+class ProgressTracker:
+    """Byte-accurate progress across concurrent jobs, reported at a fixed rate.
+
+    Incremental engines call add() per file; subprocess jobs that only know their
+    own running total call set_job() and complete_job(). callback(percent, text)
+    runs on whichever thread reported last, at most EMIT_RATE times per second.
+    With a gate (a threading.Event), add() blocks while it is cleared, which pauses
+    the in-process engines after the file they are on; with a throttle.Throttle,
+    add() sleeps as long as the rate limits ask for the work just reported.
+    """
+
+    def __init__(self, totals, callback, rate=EMIT_RATE, gate=None, throttle=None):
+        self.totals = totals
+        self.callback = callback
+        self.gate = gate
+        self.throttle = throttle
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.files = 0
+        self.bytes = 0
+        self.job_bytes = {}
+        self.started = time.monotonic()
+        self.last_emit = 0.0
+        self.last_bytes = 0
+        self.throughput = 0.0
+
+    def add(self, files=0, size=0, skipped=False):
+        """Count finished files; skipped ones were not read and cost nothing against the limits."""
+        with self.lock:
+            self.files += files
+            self.bytes += size
+        self.maybe_emit()
+        if self.throttle is not None and not skipped:
+            self.throttle.take(files, size)
+        if self.gate is not None:
+            self.gate.wait()
+
+    def set_job(self, key, size):
+        with self.lock:
+            self.job_bytes[key] = size
+        self.maybe_emit()
+
+    def complete_job(self, key, files, size):
+        """Account a finished subprocess job with its pre-scanned totals."""
+        with self.lock:
+            self.job_bytes.pop(key, None)
+            self.files += files
+            self.bytes += size
+        self.maybe_emit()
+
+    def done_bytes(self):
+        return self.bytes + sum(self.job_bytes.values())
+
+    def maybe_emit(self, force=False):
+        now = time.monotonic()
+        with self.lock:
+            elapsed = now - self.last_emit
+            if not force and elapsed < self.interval:
+                return
+            done = self.done_bytes()
+            if self.last_emit and elapsed > 0:
+                rate = (done - self.last_bytes) / elapsed
+                self.throughput += RATE_SMOOTHING * (rate - self.throughput)
+            else:
+                self.throughput = done / max(now - self.started, 1e-6)
+            self.last_emit = now
+            self.last_bytes = done
+            percent, text = self.describe(done)
+        self.callback(percent, text)
+
+    def describe(self, done):
+        total = self.totals.bytes
+        percent = 100 if total == 0 else min(100, int(done * 100 / total))
+        text = f"{min(self.files, self.totals.files)}/{self.totals.files} files, {format_bytes(self.throughput)}/s"
+        if self.throughput > 0 and done < total:
+            text += f", ETA {format_duration((total - done) / self.throughput)}"
+        return percent, text
+
+    def finish(self):
+        self.maybe_emit(force=True)
@@ -0,0 +1,336 @@
+import bisect
+import fnmatch
+import os
+import stat
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import archive
+from copy_engine import copy_file
+from manifest import STATE_DIR
+from pack_store import INDEX_NAME, PACK_DIR, PackStore
+from snapshots import SNAPSHOT_DIR, STAMP_FORMAT, list_snapshots, snapshot_root
+
+# Top-level names in a destination that belong to other formats, not to the mirror
+RESERVED = {STATE_DIR, SNAPSHOT_DIR, PACK_DIR, "chunks"}
+# Entries handed to one restore task, so tiny files don't cost a future each
+GROUP_SIZE = 64
+
+
+class RestoreResult:
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.errors = []  # List of (path, message) tuples
+        self.lock = threading.Lock()
+
+    def add_file(self, size):
+        with self.lock:
+            self.files += 1
+            self.bytes += size
+
+    def add_error(self, path, error):
+        with self.lock:
+            self.errors.append((path, str(error)))
+
+
+def entry_type(mode):
+    return "d" if stat.S_ISDIR(mode) else "l" if stat.S_ISLNK(mode) else "f" if stat.S_ISREG(mode) else "o"
+
+
+def safe_path(target, path):
+    """Join a stored path below target, refusing paths that would escape it."""
+    parts = [part for part in path.split("/") if part not in ("", ".")]
+    if ".." in parts:
+        raise ValueError(f"Refusing to restore {path} outside of the target")
+    return os.path.join(target, *parts)
+
+
+def set_metadata(dst, entry):
+    os.chmod(dst, stat.S_IMODE(entry["mode"]))
+    os.utime(dst, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+
+
+def write_file(dst, entry, data):
+    with open(dst, "wb") as f:
+        f.write(data)
+    set_metadata(dst, entry)
+
+
+def replace_symlink(dst, link_target):
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    os.symlink(link_target, dst)
+
+
+class TreeIndex:
+    """A plain directory tree: the mirror or one hardlinked snapshot."""
+
+    def __init__(self, name, kind, created, root, skip=()):
+        self.name = name
+        self.kind = kind
+        self.created = created
+        self.root = root
+        self.skip = skip  # Top-level names that are not part of this backup
+
+    def load(self):
+        """Return the entries of the tree as dicts, read with a metadata-only walk."""
+        entries = []
+        stack = [""]
+        while stack:
+            rel_dir = stack.pop()
+            with os.scandir(os.path.join(self.root, rel_dir)) as scan:
+                for item in scan:
+                    if not rel_dir and (item.name in self.skip or archive.archive_suffix(item.name)
+                                        or item.name.endswith((archive.INDEX_SUFFIX, ".part"))):
+                        continue
+                    rel_path = f"{rel_dir}/{item.name}" if rel_dir else item.name
+                    st = item.stat(follow_symlinks=False)
+                    entry = {"path": rel_path, "type": entry_type(st.st_mode), "size": st.st_size,
+                             "mode": st.st_mode, "mtime_ns": st.st_mtime_ns}
+                    if entry["type"] == "d":
+                        stack.append(rel_path)
+                    entries.append(entry)
+        return sorted(entries, key=lambda entry: entry["path"])
+
+    def groups(self, entries):
+        return [entries[i:i + GROUP_SIZE] for i in range(0, len(entries), GROUP_SIZE)]
+
+    def restore_group(self, entries, target, result):
+        for entry in entries:
+            src = os.path.join(self.root, entry["path"])
+            try:
+                dst = safe_path(target, entry["path"])
+                if entry["type"] == "l":
+                    replace_symlink(dst, os.readlink(src))
+                else:
+                    result.add_file(copy_file(src, dst, os.stat(src)))
+            except (OSError, ValueError) as e:
+                result.add_error(entry["path"], e)
+
+    def close(self):
+        pass
+
+
+class PackIndex:
+    """A packed destination, already indexed by its own SQLite index."""
+
+    kind = "packs"
+
+    def __init__(self, destination, created):
+        self.name = PACK_DIR
+        self.created = created
+        self.store = PackStore(destination)
+
+    def load(self):
+        return [{"path": path, "type": entry_type(mode), "size": size, "mode": mode, "mtime_ns": mtime_ns}
+                for path, size, mode, mtime_ns in self.store.entries()]
+
+    def groups(self, entries):
+        return [entries[i:i + GROUP_SIZE] for i in range(0, len(entries), GROUP_SIZE)]
+
+    def restore_group(self, entries, target, result):
+        for entry in entries:
+            try:
+                dst = safe_path(target, entry["path"])
+                data = self.store.read(entry["path"])
+                if entry["type"] == "l":
+                    replace_symlink(dst, os.fsdecode(data))
+                else:
+                    write_file(dst, entry, data)
+                    result.add_file(len(data))
+            except (OSError, ValueError) as e:
+                result.add_error(entry["path"], e)
+
+    def close(self):
+        self.store.close()
+
+
+class ArchiveIndex:
+    """A framed tar.xz or tar.zst archive, read through its frame table.
+
+    Archives written before the sidecar index existed are scanned once and the
+    index is saved, so only the first restore from them reads everything.
+    """
+
+    kind = "archive"
+
+    def __init__(self, path, created):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.created = created
+        self.suffix = archive.archive_suffix(path)
+        self.frames = None
+        self.members = None
+
+    def load(self):
+        if self.suffix not in archive.DECOMPRESSORS:
+            raise OSError(f"Reading {self.suffix} archives needs the zstandard module")
+        index = archive.load_index(self.path)
+        if index is None:
+            index = self.build_index()
+        self.frames, self.members = index
+        entries = [{"path": name, "type": kind, "size": size, "mode": mode, "mtime_ns": mtime_ns,
+                    "offset": offset, "link": link}
+                   for name, offset, kind, size, mode, mtime_ns, link in self.members]
+        return sorted(entries, key=lambda entry: entry["path"])
+
+    def build_index(self):
+        frames = archive.scan_frames(self.path, self.suffix)
+        reader = archive.FrameReader(self.path, frames, self.suffix)
+        members = []
+        try:
+            with tarfile.TarFile(fileobj=reader, mode="r") as tar:
+                for info in tar:
+                    members.append([info.name, info.offset, archive.member_kind(info), info.size, info.mode, int(info.mtime * 1e9),
+                                    info.linkname or None])
+        finally:
+            reader.close()
+        try:
+            archive.write_index(self.path, frames, members)
+        except OSError:
+            pass  # Read-only destination, the next restore scans again
+        return frames, members
+
+    def groups(self, entries):
+        """Group entries by the frame their header starts in, so each frame is decompressed once."""
+        by_offset = {member[0]: member[1] for member in self.members}
+        raw_offsets = [raw for _, raw in self.frames]
+        groups = {}
+        for entry in entries:
+            offset = entry["offset"]
+            if entry["type"] == "h":
+                offset = by_offset.get(entry["link"], offset)  # Data lives with the first link
+            frame = bisect.bisect_right(raw_offsets, offset) - 1
+            groups.setdefault(frame, []).append((offset, entry))
+        return [[entry for _, entry in sorted(group, key=lambda item: item[0])] for group in groups.values()]
+
+    def restore_group(self, entries, target, result):
+        by_offset = {member[0]: member[1] for member in self.members}
+        reader = archive.FrameReader(self.path, self.frames, self.suffix)
+        try:
+            for entry in entries:
+                try:
+                    dst = safe_path(target, entry["path"])
+                    offset = by_offset[entry["link"]] if entry["type"] == "h" else entry["offset"]
+                    reader.seek(offset)
+                    tar = tarfile.TarFile(fileobj=reader, mode="r")
+                    info = tar.firstmember
+                    if entry["type"] == "l":
+                        replace_symlink(dst, info.linkname)
+                    elif info.isreg():
+                        write_file(dst, entry, tar.extractfile(info).read())
+                        result.add_file(info.size)
+                except (OSError, ValueError, KeyError, tarfile.TarError) as e:
+                    result.add_error(entry["path"], e)
+        finally:
+            reader.close()
+
+    def close(self):
+        pass
+
+
+def parse_stamp(text, fmt):
+    try:
+        return time.mktime(time.strptime(text, fmt))
+    except ValueError:
+        return None
+
+
+def find_backups(destination):
+    """Return every backup in a destination, oldest first: the mirror, snapshots, packs and archives."""
+    backups = []
+    names = set(os.listdir(destination))
+    mirror = [name for name in names if name not in RESERVED and not archive.archive_suffix(name)
+              and not name.endswith((archive.INDEX_SUFFIX, ".part"))]
+    if mirror:
+        created = max(os.lstat(os.path.join(destination, name)).st_mtime for name in mirror)
+        backups.append(TreeIndex("mirror", "mirror", created, destination, skip=RESERVED))
+    for name in list_snapshots(destination):
+        # Runs within the same second get a -2, -3... suffix
+        created = parse_stamp(name.rsplit("-", 1)[0] if name.count("-") > 2 else name, STAMP_FORMAT)
+        backups.append(TreeIndex(name, "snapshot", created, os.path.join(snapshot_root(destination), name)))
+    index_path = os.path.join(destination, PACK_DIR, INDEX_NAME)
+    if os.path.exists(index_path):
+        backups.append(PackIndex(destination, os.path.getmtime(index_path)))
+    for name in names:
+        suffix = archive.archive_suffix(name)
+        if suffix and name.endswith("." + suffix):
+            stamp = name[:-len(suffix) - 1].rsplit("-", 1)[-1]
+            created = parse_stamp(stamp, "%Y%m%dT%H%M%S") or os.path.getmtime(os.path.join(destination, name))
+            backups.append(ArchiveIndex(os.path.join(destination, name), created))
+    return sorted(backups, key=lambda backup: backup.created or 0)
+
+
+def select_backup(backups, name=None, at=None):
+    """Pick a backup by name, or the newest one made at or before the time at, or the newest."""
+    if name is not None:
+        return next((backup for backup in backups if backup.name == name), None)
+    if at is not None:
+        backups = [backup for backup in backups if backup.created is not None and backup.created <= at]
+    return backups[-1] if backups else None
+
+
+def search(entries, patterns=None, since=None, until=None):
+    """Filter entries by path globs and a modification time range (seconds since the epoch).
+
+    A pattern without a slash matches file names anywhere, like `find -name`.
+    """
+    matches = []
+    for entry in entries:
+        if patterns and not any(fnmatch.fnmatchcase(entry["path"] if "/" in pattern
+                                                     else entry["path"].rsplit("/", 1)[-1], pattern)
+                                for pattern in patterns):
+            continue
+        mtime = entry["mtime_ns"] / 1e9
+        if (since is not None and mtime < since) or (until is not None and mtime > until):
+            continue
+        matches.append(entry)
+    return matches
+
+
+def with_parents(entries, all_entries):
+    """Add the folders of the selected entries, so their permissions and times come back too."""
+    folders = {entry["path"]: entry for entry in all_entries if entry["type"] == "d"}
+    selected = {entry["path"]: entry for entry in entries}
+    for path in list(selected):
+        parent = path.rsplit("/", 1)[0] if "/" in path else None
+        while parent and parent not in selected:
+            if parent in folders:
+                selected[parent] = folders[parent]
+            parent = parent.rsplit("/", 1)[0] if "/" in parent else None
+    return sorted(selected.values(), key=lambda entry: entry["path"])
+
+
+def restore(backup, entries, target, workers=None, progress=None):
+    """Restore entries of a backup below target with a pool of writers and return a RestoreResult.
+
+    Folders are created up front and get their metadata last, since writing into
+    them changes their mtime.
+    """
+    result = RestoreResult()
+    folders = [entry for entry in entries if entry["type"] == "d"]
+    files = [entry for entry in entries if entry["type"] in ("f", "l", "h")]
+    for entry in folders + files:
+        try:
+            path = safe_path(target, entry["path"])
+            os.makedirs(path if entry["type"] == "d" else os.path.dirname(path), exist_ok=True)
+        except (OSError, ValueError) as e:
+            result.add_error(entry["path"], e)
+
+    def task(group):
+        backup.restore_group(group, target, result)
+        if progress is not None:
+            progress(len(group), sum(entry["size"] for entry in group if entry["type"] != "d"))
+
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 4)) as executor:
+        for future in [executor.submit(task, group) for group in backup.groups(files)]:
+            future.result()
+
+    for entry in reversed(folders):
+        try:
+            set_metadata(safe_path(target, entry["path"]), entry)
+        except (OSError, ValueError) as e:
+            result.add_error(entry["path"], e)
+    return result
@@ -0,0 +1,126 @@
+import re
+import shlex
+
+# Offered for every new source: caches and build output that can be regenerated
+DEFAULT_EXCLUDES = [
+    "cache2/", ".cache/", "Cache/", "Code Cache/", "GPUCache/", "CachedData/", "ShaderCache/",
+    "node_modules/", "__pycache__/", "*.pyc", ".Trash-*/", "*.tmp", "*~",
+]
+
+
+def translate(pattern):
+    """Turn a gitignore glob into a regex fragment; * and ? never match a slash, ** does."""
+    out = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("/**", i) and i + 3 == len(pattern):
+            out.append("/.*")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+            continue
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body[0] == "!":
+                    body = "^" + body[1:]
+                out.append(f"[{body.replace(chr(92), chr(92) * 2)}]")
+                i = end
+        elif c == "\\" and i + 1 < len(pattern):
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+class Rule:
+    def __init__(self, line):
+        self.negated = line.startswith("!")
+        pattern = line[1:] if self.negated else line
+        self.dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        # A slash anywhere but the end ties the pattern to the source root, as in gitignore
+        self.anchored = "/" in pattern
+        self.pattern = pattern.lstrip("/")
+        prefix = "" if self.anchored else "(?:.*/)?"
+        self.regex = prefix + translate(self.pattern)
+
+    def rsync_pattern(self):
+        pattern = ("/" if self.anchored else "") + self.pattern + ("/" if self.dir_only else "")
+        return f"--{'include' if self.negated else 'exclude'}={shlex.quote(pattern)}"
+
+
+class Rules:
+    """gitignore-style include/exclude rules compiled into a few grouped regexes.
+
+    Paths are relative to the source root with / separators. The last matching rule
+    wins, so consecutive rules of the same kind are joined into one alternation and
+    the groups are tried from the last one back; most rule sets are a single group.
+    """
+
+    def __init__(self, lines):
+        self.lines = [line.strip() for line in lines if line.strip() and not line.strip().startswith("#")]
+        self.rules = [Rule(line) for line in self.lines]
+        self.groups = []  # (negated, regex for folders, regex for files), last group first
+        start = 0
+        for end in range(1, len(self.rules) + 1):
+            if end == len(self.rules) or self.rules[end].negated != self.rules[start].negated:
+                group = self.rules[start:end]
+                self.groups.insert(0, (group[0].negated, self.compile(group),
+                                       self.compile([rule for rule in group if not rule.dir_only])))
+                start = end
+
+    @staticmethod
+    def compile(rules):
+        if not rules:
+            return None
+        return re.compile("(?:" + "|".join(rule.regex for rule in rules) + r")\Z")
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def excludes(self, rel_path, is_dir=False):
+        """Whether a path is excluded by the rules themselves; the walk prunes excluded folders."""
+        for negated, dir_regex, file_regex in self.groups:
+            regex = dir_regex if is_dir else file_regex
+            if regex is not None and regex.match(rel_path):
+                return not negated
+        return False
+
+    def excludes_path(self, rel_path, is_dir=False):
+        """Like excludes, but also true below an excluded folder, for paths that did not come from a walk."""
+        parts = rel_path.split("/")
+        for depth in range(1, len(parts)):
+            if self.excludes("/".join(parts[:depth]), True):
+                return True
+        return self.excludes(rel_path, is_dir)
+
+    def rsync_args(self):
+        """The same rules as rsync options; rsync uses the first match, so the order is reversed."""
+        return " ".join(rule.rsync_pattern() for rule in reversed(self.rules))
+
+
+def compile_rules(rules):
+    """Compile a {source: [pattern lines]} mapping into {normalized source: Rules}, dropping empty ones."""
+    compiled = {}
+    for source, lines in (rules or {}).items():
+        source = source.rstrip("/") or "/"
+        if lines:
+            compiled[source] = Rules(lines)
+    return compiled
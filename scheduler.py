@@ -0,0 +1,140 @@
+import os
+import threading
+
+# Concurrent jobs allowed per device; spinning disks seek themselves to death with more than one
+ROTATIONAL_LIMIT = 1
+SOLID_STATE_LIMIT = 4
+
+
+def device_of(path):
+    """Return st_dev of path, or of its nearest existing parent."""
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except FileNotFoundError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                raise
+            path = parent
+
+
+def is_rotational(dev):
+    """Tell whether a device is a spinning disk according to sysfs."""
+    sys_path = f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}"
+    try:
+        block = os.path.realpath(sys_path)
+    except OSError:
+        return False
+    # Partitions have no queue of their own, the whole disk is one level up
+    for candidate in (block, os.path.dirname(block)):
+        try:
+            with open(os.path.join(candidate, "queue", "rotational")) as f:
+                return f.read().strip() == "1"
+        except OSError:
+            continue
+    return False  # tmpfs, network filesystems and unknown devices
+
+
+class JobResult:
+    def __init__(self, source, error=None):
+        self.source = source
+        self.error = error
+
+
+class SchedulerReport:
+    """Aggregated outcome of every job a scheduler ran."""
+
+    def __init__(self):
+        self.results = []
+
+    @property
+    def errors(self):
+        return [result for result in self.results if result.error]
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+class Job:
+    def __init__(self, source, func, devices):
+        self.source = source
+        self.func = func
+        self.devices = devices
+
+
+class JobScheduler:
+    """Run independent backup jobs concurrently, capped per underlying block device.
+
+    Every job holds a slot on the device of its source and on the device of the
+    destination, so sources on different disks run in parallel while jobs that
+    share a spinning disk take turns.
+    """
+
+    def __init__(self, destination, rotational_limit=ROTATIONAL_LIMIT, solid_state_limit=SOLID_STATE_LIMIT):
+        self.destination_device = device_of(destination)
+        self.rotational_limit = rotational_limit
+        self.solid_state_limit = solid_state_limit
+        self.jobs = []
+        self.limits = {}
+        self.in_use = {}
+        self.cond = threading.Condition()
+        self.running = True
+
+    def limit_for(self, dev):
+        if dev not in self.limits:
+            self.limits[dev] = self.rotational_limit if is_rotational(dev) else self.solid_state_limit
+        return self.limits[dev]
+
+    def add(self, source, func):
+        """Queue func, a callable returning an error message or None, for one source."""
+        try:
+            devices = {device_of(source), self.destination_device}
+        except OSError:
+            devices = {self.destination_device}  # The job itself will report the missing source
+        self.jobs.append(Job(source, func, sorted(devices)))
+
+    def stop(self):
+        """Start no further jobs; running ones are stopped by their own owner."""
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+    def available(self, job):
+        return all(self.in_use.get(dev, 0) < self.limit_for(dev) for dev in job.devices)
+
+    def run_job(self, job, report):
+        try:
+            error = job.func()
+        except Exception as e:  # A crashing job must not take the whole run down
+            error = str(e)
+        with self.cond:
+            report.results.append(JobResult(job.source, error))
+            for dev in job.devices:
+                self.in_use[dev] -= 1
+            self.cond.notify_all()
+
+    def run(self):
+        """Run all queued jobs and block until they finish."""
+        report = SchedulerReport()
+        pending = list(self.jobs)
+        threads = []
+        with self.cond:
+            while True:
+                if not self.running:
+                    pending = []
+                for job in list(pending):
+                    if self.available(job):
+                        pending.remove(job)
+                        for dev in job.devices:
+                            self.in_use[dev] = self.in_use.get(dev, 0) + 1
+                        thread = threading.Thread(target=self.run_job, args=(job, report), daemon=True)
+                        threads.append(thread)
+                        thread.start()
+                if not pending and all(count == 0 for count in self.in_use.values()):
+                    break
+                self.cond.wait()
+        for thread in threads:
+            thread.join()
+        return report
@@ -0,0 +1,179 @@
+import os
+import shutil
+import stat
+import time
+from copy_engine import NativeCopier
+
+SNAPSHOT_DIR = "snapshots"
+# Snapshot names sort in time order, so listing never needs to stat anything
+STAMP_FORMAT = "%Y-%m-%dT%H%M%S"
+PARTIAL_SUFFIX = ".part"
+LATEST = "latest"
+
+
+def snapshot_root(destination):
+    return os.path.join(destination, SNAPSHOT_DIR)
+
+
+def list_snapshots(destination):
+    """Return the names of completed snapshots in destination, oldest first."""
+    try:
+        names = os.listdir(snapshot_root(destination))
+    except FileNotFoundError:
+        return []
+    # The chunk store keeps its .idx files in a folder of the same name
+    return sorted(name for name in names
+                  if name != LATEST and not name.endswith((PARTIAL_SUFFIX, ".idx")))
+
+
+def same_file(old, st):
+    """Whether a file in the previous snapshot still matches the source file's metadata."""
+    return (stat.S_ISREG(old.st_mode) and old.st_mode == st.st_mode and old.st_size == st.st_size
+            and old.st_mtime_ns == st.st_mtime_ns)
+
+
+class LinkCopier(NativeCopier):
+    """Native copier that hardlinks files unchanged since the previous snapshot instead of copying them."""
+
+    def __init__(self, previous=None, workers=None, rules=None, journal=None):
+        super().__init__(workers=workers, rules=rules, journal=journal)
+        self.previous = previous  # Path of the previous snapshot, or None for a full copy
+        self.link_root = None
+
+    def copy_tree(self, source, destination):
+        source = source.rstrip(os.sep) or os.sep
+        if self.previous is not None:
+            self.link_root = os.path.join(self.previous, os.path.basename(source))
+        return super().copy_tree(source, destination)
+
+    def link_unchanged(self, rel_path, dst, st):
+        try:
+            old_path = os.path.join(self.link_root, rel_path)
+            if not same_file(os.lstat(old_path), st):
+                return False
+            os.link(old_path, dst)
+        except OSError:
+            return False  # Missing in the previous snapshot, or too many links: copy it
+        return True
+
+    def copy_entry(self, src, dst, rel_path, st, change, result):
+        if self.link_root is not None and stat.S_ISREG(st.st_mode) and self.link_unchanged(rel_path, dst, st):
+            if self.journal is not None:
+                self.journal.add_done(rel_path, st)
+            with result.lock:
+                result.skipped += 1
+            if self.progress is not None:
+                self.progress(1, st.st_size, skipped=True)
+            return
+        super().copy_entry(src, dst, rel_path, st, change, result)
+
+
+class SnapshotWriter:
+    """Builds one dated snapshot below destination/snapshots.
+
+    The snapshot is written to a .part directory and renamed once complete, so the
+    newest completed snapshot is always a sound base to link against.
+    """
+
+    def __init__(self, destination, workers=None):
+        self.root = snapshot_root(destination)
+        self.workers = workers
+        previous = list_snapshots(destination)
+        self.previous = os.path.join(self.root, previous[-1]) if previous else None
+        self.name = time.strftime(STAMP_FORMAT)
+        suffix = 1
+        while self.name in previous:
+            suffix += 1
+            self.name = f"{time.strftime(STAMP_FORMAT)}-{suffix}"
+        self.path = os.path.join(self.root, self.name + PARTIAL_SUFFIX)
+
+    def begin(self):
+        """Create the partial snapshot directory, continuing the newest one an interrupted run left."""
+        os.makedirs(self.root, exist_ok=True)
+        leftovers = sorted(name for name in os.listdir(self.root)
+                           if name.endswith(PARTIAL_SUFFIX) and name != LATEST + PARTIAL_SUFFIX)
+        for name in leftovers[:-1]:
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+        if leftovers:
+            # Renamed to this run's stamp, the files it already holds are kept
+            os.rename(os.path.join(self.root, leftovers[-1]), self.path)
+        else:
+            os.mkdir(self.path)
+        return bool(leftovers)
+
+    def copier(self, rules=None, journal=None):
+        return LinkCopier(self.previous, workers=self.workers, rules=rules, journal=journal)
+
+    def link_dest(self, source):
+        """Directory rsync --link-dest should compare a source against, or None for the first snapshot."""
+        if self.previous is None:
+            return None
+        return os.path.join(self.previous, os.path.basename(source.rstrip(os.sep)))
+
+    def commit(self):
+        final = os.path.join(self.root, self.name)
+        os.rename(self.path, final)
+        # Swap the latest link atomically so it never dangles
+        tmp_link = os.path.join(self.root, LATEST + PARTIAL_SUFFIX)
+        if os.path.lexists(tmp_link):
+            os.unlink(tmp_link)
+        os.symlink(self.name, tmp_link)
+        os.replace(tmp_link, os.path.join(self.root, LATEST))
+        return self.name
+
+
+def index_tree(root):
+    """Return {relative path: (identity, is directory)} for everything below root.
+
+    Files are identified by inode and symlinks, which are recreated every run, by their target.
+    """
+    index = {}
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        with os.scandir(os.path.join(root, rel_dir) if rel_dir else root) as entries:
+            for entry in entries:
+                rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                st = entry.stat(follow_symlinks=False)
+                is_dir = stat.S_ISDIR(st.st_mode)
+                if is_dir:
+                    stack.append(rel_path)
+                identity = os.readlink(entry.path) if stat.S_ISLNK(st.st_mode) else (st.st_dev, st.st_ino)
+                index[rel_path] = (identity, is_dir)
+    return index
+
+
+def diff_snapshots(destination, old, new):
+    """Return sorted (change, path) pairs between two snapshots without reading file contents.
+
+    Unchanged files are hardlinks of each other, so comparing inodes is enough.
+    """
+    root = snapshot_root(destination)
+    before = index_tree(os.path.join(root, old))
+    after = index_tree(os.path.join(root, new))
+    changes = []
+    for rel_path, (identity, is_dir) in after.items():
+        old_entry = before.get(rel_path)
+        if old_entry is None:
+            changes.append(("added", rel_path))
+        elif not is_dir and identity != old_entry[0]:
+            changes.append(("modified", rel_path))
+    changes.extend(("removed", rel_path) for rel_path in before if rel_path not in after)
+    return sorted(changes, key=lambda change: change[1])
+
+
+def prune_snapshots(destination, keep=30, max_age_days=None):
+    """Delete snapshots beyond the newest keep, or older than max_age_days, and return their names.
+
+    The newest snapshot is never deleted. Removing a snapshot only frees the files no
+    other snapshot links to.
+    """
+    names = list_snapshots(destination)
+    cutoff = time.strftime(STAMP_FORMAT, time.localtime(time.time() - max_age_days * 86400)) \
+        if max_age_days is not None else None
+    removed = []
+    for index, name in enumerate(names[:-1]):
+        if index < len(names) - keep or (cutoff is not None and name < cutoff):
+            shutil.rmtree(os.path.join(snapshot_root(destination), name))
+            removed.append(name)
+    return removed
@@ -0,0 +1,123 @@
+import os
+import queue
+import threading
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, QObject, Qt, pyqtSignal
+from progress import format_bytes, prescan
+from rules import compile_rules
+
+# Role holding the full path of a source; the display text shows the folder name and its size
+PATH_ROLE = Qt.UserRole
+# Directories the background sizer scans at once, kept low so it does not compete with a sync
+SCAN_WORKERS = 4
+
+
+class SizeScanner(QObject):
+    """Counts the files and bytes of sources in a background thread, one source at a time.
+
+    Sources are measured only once a view asks for them, in the order it asks;
+    results arrive through measured(path, files, bytes) on the GUI thread.
+    """
+    measured = pyqtSignal(str, int, int)
+
+    def __init__(self):
+        super().__init__()
+        self.requests = queue.Queue()
+        self.thread = None
+
+    def request(self, path, patterns):
+        """Queue a source for measuring with the exclude patterns its engine will apply."""
+        if self.thread is None:
+            # A daemon thread, so a scan of a huge tree never holds up closing the window
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        self.requests.put((path, list(patterns)))
+
+    def run(self):
+        while True:
+            path, patterns = self.requests.get()
+            key = path.rstrip(os.sep) or os.sep
+            totals = prescan([path], SCAN_WORKERS, compile_rules({key: patterns}))
+            self.measured.emit(path, *totals.per_source[path])
+
+
+class SourceListModel(QAbstractListModel):
+    """The sources of one mode, as a list model for a QListView.
+
+    Adding and removing sources touches only the affected rows. Sizes are measured
+    lazily by a shared SizeScanner, the first time a row is displayed; rules maps
+    paths to their exclude patterns and is shared with the owning widget.
+    """
+
+    def __init__(self, mode, scanner, rules, parent=None):
+        super().__init__(parent)
+        self.mode = mode
+        self.scanner = scanner
+        self.rules = rules
+        self.paths = []
+        self.rows = {}  # Path: row
+        self.sizes = {}  # Path: (files, bytes), or None while it is being measured
+        scanner.measured.connect(self.set_size)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.paths)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        path = self.paths[index.row()]
+        if role == Qt.DisplayRole:
+            if path not in self.sizes:
+                self.sizes[path] = None
+                self.scanner.request(path, self.rules.get(path, []))
+            size = self.sizes[path]
+            name = os.path.basename(path.rstrip(os.sep)) or path
+            if size is None:
+                return f"{name}  (counting...)"
+            return f"{name}  ({size[0]} files, {format_bytes(size[1])})"
+        if role in (Qt.ToolTipRole, PATH_ROLE):
+            return path
+        return None
+
+    def add_paths(self, paths):
+        """Append the given sources that are not listed yet, in a single insert; return those added."""
+        new = []
+        for path in paths:
+            if path not in self.rows:
+                self.rows[path] = len(self.paths) + len(new)
+                new.append(path)
+        if new:
+            self.beginInsertRows(QModelIndex(), len(self.paths), len(self.paths) + len(new) - 1)
+            self.paths += new
+            self.endInsertRows()
+        return new
+
+    def remove_rows(self, rows):
+        """Remove sources by row; return their paths."""
+        removed = []
+        for row in sorted(set(rows), reverse=True):
+            self.beginRemoveRows(QModelIndex(), row, row)
+            path = self.paths.pop(row)
+            del self.rows[path]
+            self.sizes.pop(path, None)  # A measurement still under way is dropped when it arrives
+            self.endRemoveRows()
+            removed.append(path)
+        if removed:
+            for row in range(min(rows), len(self.paths)):
+                self.rows[self.paths[row]] = row
+        return removed
+
+    def set_size(self, path, files, size):
+        row = self.rows.get(path)
+        if row is None or path not in self.sizes:
+            return  # Not ours, or removed while it was measured
+        self.sizes[path] = (files, size)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+    def remeasure(self, path):
+        """Forget the size of a source, e.g. after its exclude rules changed."""
+        row = self.rows.get(path)
+        if row is not None:
+            self.sizes.pop(path, None)
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.DisplayRole])
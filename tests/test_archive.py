@@ -0,0 +1,71 @@
+import io
+import os
+import tarfile
+
+from archive import ArchiveWriter, FrameReader, FrameWriter, MemberReader, compress_xz, load_index
+from rules import compile_rules
+
+
+def make_source(tmp_path):
+    source = tmp_path / "src"
+    (source / "sub").mkdir(parents=True)
+    (source / "sub" / "big").write_bytes(os.urandom(300 * 1024))
+    (source / "note").write_text("note")
+    (source / "skip.tmp").write_text("temporary")
+    os.symlink("note", source / "link")
+    return source
+
+
+def test_archive_round_trip_with_index(tmp_path):
+    source = make_source(tmp_path)
+    (tmp_path / "out").mkdir()
+    writer = ArchiveWriter(str(tmp_path / "out"), workers=2)
+    writer.rules = compile_rules({str(source): ["*.tmp"]})
+    result = writer.write([str(source)], host="test")
+    assert not result.errors and result.files == 3
+    assert os.path.basename(result.path).startswith("test-") and result.path.endswith(".tar.xz")
+
+    with tarfile.open(result.path) as tar:
+        assert sorted(tar.getnames()) == ["src", "src/link", "src/note", "src/sub", "src/sub/big"]
+        assert tar.extractfile("src/sub/big").read() == (source / "sub" / "big").read_bytes()
+
+    frames, members = load_index(result.path)
+    _, offset, _, size = next(member for member in members if member[0] == "src/sub/big")[:4]
+    reader = FrameReader(result.path, frames, "tar.xz")
+    reader.seek(offset)  # Members are read on their own, the way a restore does
+    tar = tarfile.TarFile(fileobj=reader, mode="r")
+    assert tar.firstmember.size == size
+    assert tar.extractfile(tar.firstmember).read() == (source / "sub" / "big").read_bytes()
+    reader.close()
+
+
+def test_frames_are_read_back_individually(tmp_path):
+    data = os.urandom(200 * 1024)
+    with open(tmp_path / "framed.xz", "wb") as f:
+        writer = FrameWriter(f, compress_xz, workers=2, frame_size=64 * 1024)
+        writer.write(data)
+        writer.close()
+    assert [raw for _, raw in writer.frames] == [0, 65536, 131072, 196608]
+    reader = FrameReader(str(tmp_path / "framed.xz"), writer.frames, "tar.xz")
+    reader.seek(100_000)
+    assert reader.read(50_000) == data[100_000:150_000]
+    assert reader.index == 2  # Only the frames covering the read were decompressed
+    reader.seek(0)
+    assert reader.read() == data
+    reader.close()
+
+
+def test_cancelled_archive_leaves_nothing(tmp_path):
+    source = make_source(tmp_path)
+    (tmp_path / "out").mkdir()
+    writer = ArchiveWriter(str(tmp_path / "out"))
+    writer.stop()
+    result = writer.write([str(source)], host="test")
+    assert result.path is None
+    assert os.listdir(tmp_path / "out") == []
+
+
+def test_member_reader_pads_a_shrunken_file():
+    reader = MemberReader(io.BytesIO(b"abc"), 6)
+    assert reader.read(4) + reader.read(4) == b"abc\0\0\0"
+    assert "shrank" in reader.error
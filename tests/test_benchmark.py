@@ -0,0 +1,42 @@
+import json
+import os
+import random
+
+import benchmark
+
+
+def test_trees_are_deterministic_and_reused(tmp_path):
+    first = benchmark.ensure_tree(str(tmp_path / "one"), "deep", 0.05, 7)
+    second = benchmark.ensure_tree(str(tmp_path / "two"), "deep", 0.05, 7)
+    totals = benchmark.tree_totals(first)
+    assert totals == benchmark.tree_totals(second) == (90, totals[1])
+    marker = os.path.join(os.path.dirname(first), ".complete")
+    before = os.stat(marker).st_mtime_ns
+    assert benchmark.ensure_tree(str(tmp_path / "one"), "deep", 0.05, 7) == first
+    assert os.stat(marker).st_mtime_ns == before  # Not generated again
+
+
+def test_fill_is_half_compressible():
+    data = benchmark.fill(random.Random(1), 10000)
+    assert len(data) == 10000
+    assert data[2048:4096] == b"\0" * 2048
+
+
+def test_compare_flags_regressions_beyond_the_threshold(tmp_path, capsys):
+    def results(wall, rss):
+        return {"results": [{"target": "/dev/shm", "tree": "dotfiles", "engine": "native",
+                             "wall_s": wall, "peak_rss_kb": rss, "syscalls": None}]}
+
+    for name, data in (("old.json", results(1.0, 1000)), ("same.json", results(1.05, 900)),
+                       ("slow.json", results(1.5, 1000))):
+        with open(tmp_path / name, "w") as f:
+            json.dump(data, f)
+    assert benchmark.compare(str(tmp_path / "old.json"), str(tmp_path / "same.json")) == 0
+    assert benchmark.compare(str(tmp_path / "old.json"), str(tmp_path / "slow.json")) == 1
+    assert "REGRESSION" in capsys.readouterr().out
+
+
+def test_measure_chunking_reports_both_modes(capsys):
+    figures = benchmark.measure_chunking(1)
+    assert set(figures) == {"content_defined", "fixed"}
+    assert all(rate > 0 for rate in figures.values())
@@ -0,0 +1,71 @@
+import io
+import os
+import random
+
+import chunk_store
+from chunk_store import AVG_CHUNK, CDC_MAX_FILE, GEAR, MASK_L, MASK_S, MAX_CHUNK, MIN_CHUNK, ChunkStore, iter_chunks
+
+
+def reference_cut(data, start, end):
+    """find_cut with the full 32-bit hash, as first written."""
+    if end - start <= MIN_CHUNK:
+        return end
+    h = 0
+    i = start + MIN_CHUNK
+    while i < min(start + MAX_CHUNK, end):
+        h = ((h << 1) + GEAR[data[i]]) & 0xFFFFFFFF
+        i += 1
+        if not h & (MASK_S if i <= start + AVG_CHUNK else MASK_L):
+            return i
+    return min(start + MAX_CHUNK, end)
+
+
+def test_cuts_match_the_full_hash():
+    data = random.Random(1).randbytes(2 * 1024 * 1024)
+    pos = 0
+    while pos < len(data):
+        cut = chunk_store.find_cut(data, pos, len(data))
+        assert cut == reference_cut(data, pos, len(data))
+        pos = cut
+
+
+def test_insert_only_changes_nearby_chunks():
+    data = random.Random(2).randbytes(1024 * 1024)
+    before = set(iter_chunks(io.BytesIO(data)))
+    after = list(iter_chunks(io.BytesIO(data[:1000] + b"inserted" + data[1000:])))
+    assert len([chunk for chunk in after if chunk not in before]) <= 2
+
+
+def test_large_files_use_fixed_chunks():
+    data = random.Random(3).randbytes(CDC_MAX_FILE + AVG_CHUNK + 10)
+    chunks = list(iter_chunks(io.BytesIO(data), len(data)))
+    assert b"".join(chunks) == data
+    assert [len(chunk) for chunk in chunks[:-1]] == [AVG_CHUNK] * (len(chunks) - 1)
+
+
+def test_backup_deduplicates_and_restores(tmp_path):
+    source = tmp_path / "src"
+    (source / "sub").mkdir(parents=True)
+    shared = os.urandom(300 * 1024)
+    (source / "a").write_bytes(shared)
+    (source / "sub" / "b").write_bytes(shared)  # Same content, stored once
+    big = bytearray(os.urandom(CDC_MAX_FILE + 8 * AVG_CHUNK))
+    (source / "big.sqlite").write_bytes(big)
+    os.symlink("a", source / "link")
+
+    store = ChunkStore(str(tmp_path / "store"))
+    first = store.backup([str(source)], host="test")
+    assert not first.errors
+    assert first.new_bytes < len(shared) * 2 + len(big)
+
+    big[AVG_CHUNK * 3 + 10:AVG_CHUNK * 3 + 20] = b"x" * 10  # A page rewritten in place
+    (source / "big.sqlite").write_bytes(big)
+    second = store.backup([str(source)], host="test")
+    assert second.reused == 2
+    assert second.new_chunks == 1 and second.new_bytes == AVG_CHUNK
+
+    store.restore(second.path, str(tmp_path / "out"))
+    out = tmp_path / "out" / "src"
+    assert (out / "sub" / "b").read_bytes() == shared
+    assert (out / "big.sqlite").read_bytes() == bytes(big)
+    assert os.readlink(out / "link") == "a"
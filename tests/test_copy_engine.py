@@ -0,0 +1,111 @@
+import errno
+import os
+import stat
+
+import copy_engine
+from copy_engine import BATCH_FILES, NativeCopier
+
+
+def make_tree(root, files=5):
+    (root / "sub" / "deeper").mkdir(parents=True)
+    for index in range(files):
+        (root / f"f{index}").write_bytes(os.urandom(100 + index))
+    (root / "sub" / "deeper" / "big").write_bytes(os.urandom(3 * 1024 * 1024))
+    (root / "sub" / "exec").write_bytes(b"#!/bin/sh\n")
+    os.chmod(root / "sub" / "exec", 0o750)
+    os.utime(root / "sub" / "exec", ns=(1_000_000_000, 1_000_000_000))
+    os.symlink("sub/exec", root / "link")
+    os.mkfifo(root / "fifo")
+
+
+def test_copies_tree_with_metadata(tmp_path):
+    source = tmp_path / "src"
+    source.mkdir()
+    make_tree(source)
+    result = NativeCopier(workers=4).copy_tree(str(source), str(tmp_path / "dst"))
+    copy = tmp_path / "dst" / "src"
+    assert not result.errors
+    assert result.files == 8  # Files and the symlink; the fifo is not copied
+    for path in ("f0", "f4", "sub/deeper/big", "sub/exec"):
+        assert (copy / path).read_bytes() == (source / path).read_bytes()
+    st = os.stat(copy / "sub" / "exec")
+    assert stat.S_IMODE(st.st_mode) == 0o750
+    assert st.st_mtime_ns == 1_000_000_000
+    assert os.readlink(copy / "link") == "sub/exec"
+    assert not (copy / "fifo").exists()
+    assert os.stat(copy / "sub").st_mtime_ns == os.stat(source / "sub").st_mtime_ns
+
+
+def test_many_small_files_in_batches(tmp_path):
+    source = tmp_path / "src"
+    source.mkdir()
+    for index in range(BATCH_FILES * 5 + 3):
+        (source / f"f{index}").write_bytes(b"%d" % index)
+    reported = []
+    copier = NativeCopier(workers=3)
+    copier.progress = lambda files, size, skipped=False: reported.append(files)
+    result = copier.copy_tree(str(source), str(tmp_path / "dst"))
+    assert result.files == len(reported) == BATCH_FILES * 5 + 3
+    assert copier.queue_depth() == 0
+    assert (tmp_path / "dst" / "src" / "f100").read_bytes() == b"100"
+
+
+def test_errors_are_reported_per_file(tmp_path):
+    source = tmp_path / "src"
+    source.mkdir()
+    make_tree(source)
+    (tmp_path / "dst" / "src" / "f1").mkdir(parents=True)  # Where a file should go
+    result = NativeCopier().copy_tree(str(source), str(tmp_path / "dst"))
+    assert [path for path, _ in result.errors] == [str(source / "f1")]
+    assert result.files == 7
+
+
+def test_stop_leaves_queued_files(tmp_path):
+    source = tmp_path / "src"
+    source.mkdir()
+    for index in range(BATCH_FILES * 4):
+        (source / f"f{index}").write_bytes(b"x")
+    copier = NativeCopier(workers=1)
+    copier.progress = lambda files, size, skipped=False: copier.stop()
+    result = copier.copy_tree(str(source), str(tmp_path / "dst"))
+    assert 1 <= result.files < BATCH_FILES * 4
+    assert copier.queue_depth() == 0
+
+
+def test_sparse_file_keeps_its_holes(tmp_path):
+    src, dst = tmp_path / "sparse", tmp_path / "copy"
+    with open(src, "wb") as f:
+        f.write(b"head")
+        f.seek(64 * 1024 * 1024)
+        f.write(b"middle")
+        f.truncate(128 * 1024 * 1024)  # Ends in a hole
+    st = os.stat(src)
+    assert copy_engine.is_sparse(st)
+    assert copy_engine.copy_file(str(src), str(dst), st) == st.st_size
+    copy = os.stat(dst)
+    assert copy.st_size == st.st_size
+    assert copy.st_blocks <= st.st_blocks + 64
+    with open(dst, "rb") as f:
+        assert f.read(4) == b"head"
+        f.seek(64 * 1024 * 1024)
+        assert f.read(6) == b"middle"
+
+
+def test_reflink_support_is_learned_per_device_pair(tmp_path, monkeypatch):
+    calls = []
+    failure = [errno.EINVAL]  # Rules out only this file
+
+    def ioctl(fd, request, arg):
+        calls.append(request)
+        raise OSError(failure[0], "no clone")
+
+    monkeypatch.setattr(copy_engine.fcntl, "ioctl", ioctl)
+    monkeypatch.setattr(copy_engine, "clone_support", {})
+    (tmp_path / "src").write_bytes(b"x" * 100)
+    st = os.stat(tmp_path / "src")
+    copy_engine.copy_file(str(tmp_path / "src"), str(tmp_path / "a"), st)
+    failure[0] = errno.EOPNOTSUPP  # Rules out the pair of filesystems
+    copy_engine.copy_file(str(tmp_path / "src"), str(tmp_path / "b"), st)
+    copy_engine.copy_file(str(tmp_path / "src"), str(tmp_path / "c"), st)
+    assert calls == [copy_engine.FICLONE] * 2
+    assert (tmp_path / "c").read_bytes() == b"x" * 100
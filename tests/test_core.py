@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+import confback
+from core import BackupRun
+
+
+class ListLog:
+    def __init__(self):
+        self.lines = []
+
+    def push(self, message):
+        self.lines.append(message)
+
+
+def test_verify_reports_the_worst_destination(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))  # Source hash cache
+    source = tmp_path / "src"
+    source.mkdir()
+    (source / "f").write_bytes(b"content")
+    destinations = [str(tmp_path / "d1"), str(tmp_path / "d2")]
+    for destination in destinations:
+        (tmp_path / destination).mkdir()
+    assert BackupRun([(str(source), "native")], destinations, ListLog()).run() is None
+
+    (tmp_path / "d2" / "src" / "f").write_bytes(b"CONTENT")
+    error = BackupRun([(str(source), "native")], destinations, ListLog()).run_verify(full=True)
+    assert error == f"{destinations[1]}: 1 file(s) differ from the source"
+    assert list((tmp_path / "d1" / ".confback").glob("verify-*.json"))
+
+
+def test_invalid_limit_is_a_usage_error(tmp_path, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        confback.main(["run", "--limit", "abc", str(tmp_path / "job.json")])
+    assert exit_info.value.code == confback.EXIT_USAGE
+    assert "not a rate" in capsys.readouterr().err
+
+
+def copied(destination):
+    return sum(1 for path in destination.rglob("f*") if path.is_file())
+
+
+def start(tmp_path, files=400):
+    source, destination = tmp_path / "src", tmp_path / "dst"
+    source.mkdir()
+    destination.mkdir()
+    for index in range(files):
+        (source / f"f{index}").write_bytes(b"x" * 100)
+    run = BackupRun([(str(source), "native")], str(destination), ListLog())
+    run.pause()  # Engines halt after the first file each of their threads finishes
+    outcome = []
+    thread = threading.Thread(target=lambda: outcome.append(run.run()))
+    thread.start()
+    time.sleep(0.3)
+    return run, thread, outcome, destination
+
+
+def test_paused_run_holds_until_resumed(tmp_path):
+    run, thread, outcome, destination = start(tmp_path)
+    held = copied(destination)
+    time.sleep(0.2)
+    assert copied(destination) == held < 400
+    run.resume()
+    thread.join(10)
+    assert outcome == [None]
+    assert copied(destination) == 400
+
+
+def test_stop_wakes_a_paused_run(tmp_path):
+    run, thread, outcome, destination = start(tmp_path)
+    started = time.monotonic()
+    run.stop()
+    thread.join(10)
+    assert not thread.is_alive() and time.monotonic() - started < 5
+    assert not run.running
+    assert copied(destination) < 400
@@ -0,0 +1,59 @@
+import io
+import os
+
+from delta import BLOCK_SIZE, apply_patch, decode_patch, encode_patch, make_delta, scan_file
+
+
+def rebuild(base, new):
+    """Delta new against base and apply the patch; return the rebuilt bytes and the literal size."""
+    _, signature = scan_file(str(base))
+    sha256, _ = scan_file(str(new))
+    recipe, literal = make_delta(str(new), signature)
+    header, literal = decode_patch(encode_patch("base", os.path.getsize(new), sha256, recipe, literal, BLOCK_SIZE))
+    data = base.read_bytes()
+    out = io.BytesIO()
+    apply_patch(header, literal, lambda offset, length: data[offset:offset + length], out)
+    return out.getvalue(), len(literal)
+
+
+def test_round_trip_aligned_change(tmp_path):
+    data = bytearray(os.urandom(BLOCK_SIZE * 20 + 100))
+    base = tmp_path / "base"
+    base.write_bytes(data)
+    data[BLOCK_SIZE * 5 + 10:BLOCK_SIZE * 5 + 20] = b"x" * 10
+    new = tmp_path / "new"
+    new.write_bytes(data)
+    rebuilt, literal = rebuild(base, new)
+    assert rebuilt == bytes(data)
+    assert literal == BLOCK_SIZE  # Only the page that changed
+
+
+def test_round_trip_shifted_data(tmp_path):
+    data = os.urandom(BLOCK_SIZE * 20)
+    base = tmp_path / "base"
+    base.write_bytes(data)
+    changed = data[:BLOCK_SIZE * 3] + b"inserted" + data[BLOCK_SIZE * 3:]
+    new = tmp_path / "new"
+    new.write_bytes(changed)
+    rebuilt, literal = rebuild(base, new)
+    assert rebuilt == changed
+    assert literal < BLOCK_SIZE * 2  # The rolling checksum found the blocks after the insert
+
+
+def test_round_trip_empty_and_short(tmp_path):
+    base = tmp_path / "base"
+    base.write_bytes(os.urandom(BLOCK_SIZE + 5))
+    for content in (b"", b"short"):
+        new = tmp_path / "new"
+        new.write_bytes(content)
+        assert rebuild(base, new)[0] == content
+
+
+def test_rewritten_file_gives_up(tmp_path):
+    base = tmp_path / "base"
+    base.write_bytes(os.urandom(BLOCK_SIZE * 64))
+    new = tmp_path / "new"
+    new.write_bytes(os.urandom(BLOCK_SIZE * 64))
+    _, signature = scan_file(str(base))
+    assert make_delta(str(new), signature, max_literal=BLOCK_SIZE * 8) is None
+    assert make_delta(str(base), signature, max_literal=0) == ([[0, 0, 64]], b"")
@@ -0,0 +1,39 @@
+import os
+
+from fanout import CHUNK, Target, TeeCopier, temp_path
+
+
+def test_tee_writes_every_root(tmp_path):
+    source = tmp_path / "src"
+    (source / "sub").mkdir(parents=True)
+    (source / "big").write_bytes(os.urandom(CHUNK * 3 + 5))
+    (source / "sub" / "small").write_bytes(b"small")
+    os.symlink("big", source / "link")
+    roots = [str(tmp_path / "d1"), str(tmp_path / "d2")]
+    results = TeeCopier(workers=2).tee_tree(str(source), roots)
+    assert all(not result.errors and result.files == 3 for result in results)
+    for root in roots:
+        assert open(os.path.join(root, "big"), "rb").read() == (source / "big").read_bytes()
+        assert open(os.path.join(root, "sub", "small"), "rb").read() == b"small"
+        assert os.readlink(os.path.join(root, "link")) == "big"
+
+    os.unlink(os.path.join(roots[1], "sub", "small"))
+    results = TeeCopier(workers=2).tee_tree(str(source), roots)
+    # Symlinks are always recreated
+    assert [(result.files, result.skipped) for result in results] == [(1, 2), (2, 1)]
+
+
+def test_failed_write_is_cleaned_up_and_the_queue_drained(tmp_path):
+    (tmp_path / "taken" / "child").mkdir(parents=True)  # Renaming a file over it fails
+    st = os.stat(tmp_path / "taken")
+    target = Target(str(tmp_path), CHUNK * 8)
+    taken, broken, fine = (str(tmp_path / name) for name in ("taken", "broken", "fine"))
+    target.put(taken, st, 0, b"data", True)
+    target.put(broken, st, 0, b"start", False)
+    target.put(broken, st, 5, 12345, True)  # Not bytes, fails outside of any OSError
+    target.put(fine, st, 0, b"fine", True)
+    target.close()
+
+    assert sorted(path for path, _ in target.result.errors) == [broken, taken]
+    assert open(fine, "rb").read() == b"fine"
+    assert not any(os.path.exists(temp_path(path)) for path in (taken, broken, fine))
@@ -0,0 +1,117 @@
+import os
+
+import journal
+from copy_engine import NativeCopier
+from journal import Journal
+
+
+def test_reload_skips_torn_line(tmp_path):
+    src = tmp_path / "f"
+    src.write_bytes(b"x" * 10)
+    st = os.stat(src)
+    log = Journal(str(tmp_path / "j.log"))
+    log.add_partial("f", 4, st)
+    log.add_done("g", st)
+    log.close()
+    with open(tmp_path / "j.log", "a") as f:
+        f.write('["done", "h", 1')  # Cut short by a crash
+
+    log = Journal(str(tmp_path / "j.log"))
+    assert log.resume_offset("f", st) == 4
+    assert "h" not in log.done
+    os.utime(src, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+    assert log.resume_offset("f", os.stat(src)) == 0  # Changed since, start over
+    log.close()
+
+
+def test_finished_needs_the_copy_in_place(tmp_path):
+    src = tmp_path / "f"
+    src.write_bytes(b"data")
+    st = os.stat(src)
+    dst = tmp_path / "copy"
+    log = Journal(str(tmp_path / "j.log"))
+    log.add_done("f", st)
+    log.close()
+
+    log = Journal(str(tmp_path / "j.log"))  # Records are what an earlier run finished
+    assert not log.finished("f", st, str(dst))
+    dst.write_bytes(b"data")
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert log.finished("f", st, str(dst))
+    log.close()
+
+
+def test_interrupted_copy_resumes(tmp_path, monkeypatch):
+    step = 64 * 1024
+    monkeypatch.setattr(journal, "PARTIAL_STEP", step)
+    source = tmp_path / "src"
+    source.mkdir()
+    data = os.urandom(16 * step + 123)
+    (source / "big").write_bytes(data)
+    (source / "small").write_bytes(b"small")
+    destination = tmp_path / "dst"
+    path = str(tmp_path / "j.log")
+
+    copier = NativeCopier(workers=1, journal=Journal(path))
+    copied = []
+
+    def stop_halfway(size):
+        copied.append(size)
+        if sum(copied) >= len(data) // 2:
+            copier.stop()
+
+    copier.charge = stop_halfway
+    copier.copy_tree(str(source), str(destination))
+    copier.journal.close()
+    assert not (destination / "src" / "big").exists()
+
+    log = Journal(path)
+    assert 0 < log.resume_offset("big", os.stat(source / "big")) < len(data)
+    copier = NativeCopier(workers=1, journal=log)
+    resumed = []
+    copier.charge = resumed.append
+    result = copier.copy_tree(str(source), str(destination))
+    log.remove()
+    assert not result.errors
+    assert (destination / "src" / "big").read_bytes() == data
+    assert (destination / "src" / "small").read_bytes() == b"small"
+    assert sum(resumed) < len(data)  # Only the part after the last checkpoint was copied again
+
+
+def test_done_files_are_synced_in_batches(tmp_path, monkeypatch):
+    syncs = []
+    monkeypatch.setattr(journal, "sync_filesystem", syncs.append)
+    monkeypatch.setattr(journal, "SYNC_SECONDS", 3600)
+    monkeypatch.setattr(journal, "SYNC_RECORDS", 10)
+    src = tmp_path / "f"
+    src.write_bytes(b"x")
+    st = os.stat(src)
+    path = str(tmp_path / "j.log")
+    log = Journal(path)
+    for index in range(9):
+        log.add_done(f"f{index}", st)
+    assert not syncs
+    assert not Journal(path).done  # Nothing recorded before the batch is on disk
+    log.add_done("f9", st)
+    assert len(syncs) == 1
+    assert len(Journal(path).done) == 10
+    log.add_done("f10", st)
+    log.close()
+    assert len(syncs) == 2
+    assert len(Journal(path).done) == 11
+
+
+def test_commit_does_not_fsync_each_file(tmp_path, monkeypatch):
+    fsyncs = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: fsyncs.append(fd) or real_fsync(fd))
+    source = tmp_path / "src"
+    source.mkdir()
+    for index in range(50):
+        (source / f"f{index}").write_bytes(b"data")
+    log = Journal(str(tmp_path / "j.log"))
+    result = NativeCopier(workers=2, journal=log).copy_tree(str(source), str(tmp_path / "dst"))
+    log.close()
+    assert result.files == 50
+    assert len(fsyncs) <= 2  # The journal's own, not one per file
+    assert not [name for name in os.listdir(tmp_path / "dst" / "src") if name.startswith(".")]
@@ -0,0 +1,31 @@
+import threading
+
+from log_pipeline import LogPipeline, RotatingLog
+
+
+def test_view_is_bounded_and_the_file_gets_everything(tmp_path):
+    log = LogPipeline(str(tmp_path / "logs" / "run.log"), capacity=100)
+    threads = [threading.Thread(target=lambda n=n: [log.push(f"worker {n} line {i}") for i in range(100)])
+               for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    lines, dropped = log.drain()
+    assert (len(lines), dropped) == (100, 300)
+    assert log.drain() == ([], 0)
+    log.close()
+    written = (tmp_path / "logs" / "run.log").read_text().splitlines()
+    assert len(written) == 400
+    assert written[0].endswith("line 0")
+
+
+def test_rotating_log_keeps_a_fixed_number_of_backups(tmp_path):
+    path = tmp_path / "run.log"
+    log = RotatingLog(str(path), max_bytes=100, backups=2)
+    for index in range(10):
+        log.write_lines([f"{index}" * 60])
+    log.close()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["run.log", "run.log.1", "run.log.2"]
+    assert path.read_text() == "9" * 60 + "\n"
+    assert (tmp_path / "run.log.2").read_text() == "7" * 60 + "\n"
@@ -0,0 +1,57 @@
+import os
+
+from copy_engine import NativeCopier
+from manifest import Manifest
+
+
+def backup(source, destination):
+    manifest = Manifest(str(destination))
+    run_id = manifest.begin_run()
+    result = NativeCopier(workers=2, manifest=manifest, run_id=run_id).copy_tree(str(source), str(destination))
+    manifest.finish_run(run_id, result.files, result.bytes)
+    return manifest, result
+
+
+def test_unchanged_files_are_skipped_and_changes_recorded(tmp_path):
+    source, destination = tmp_path / "src", tmp_path / "dst"
+    (source / "sub").mkdir(parents=True)
+    destination.mkdir()
+    for name in ("a", "b", "sub/c"):
+        (source / name).write_bytes(name.encode())
+    manifest, result = backup(source, destination)
+    assert result.files == 3
+    manifest.close()
+
+    (source / "a").write_bytes(b"changed")
+    (source / "b").unlink()
+    (source / "d").write_bytes(b"new")
+    manifest, result = backup(source, destination)
+    assert (result.files, result.skipped) == (2, 1)
+    assert manifest.changes() == [(str(source), "a", "modified"), (str(source), "b", "deleted"),
+                                  (str(source), "d", "added")]
+    assert set(manifest.load(str(source))) == {"a", "d", "sub/c"}
+    manifest.close()
+
+
+def test_unlisted_folder_is_not_taken_as_deleted(tmp_path, monkeypatch):
+    source, destination = tmp_path / "src", tmp_path / "dst"
+    (source / "locked").mkdir(parents=True)
+    destination.mkdir()
+    (source / "locked" / "kept").write_bytes(b"data")
+    (source / "gone").write_bytes(b"data")
+    backup(source, destination)[0].close()
+
+    (source / "gone").unlink()
+    real_scandir = os.scandir
+
+    def scandir(path):
+        if str(path).endswith("locked"):
+            raise PermissionError(13, "Permission denied", str(path))
+        return real_scandir(path)
+
+    monkeypatch.setattr(os, "scandir", scandir)
+    manifest, result = backup(source, destination)
+    assert result.errors
+    assert manifest.changes() == [(str(source), "gone", "deleted")]
+    assert "locked/kept" in manifest.load(str(source))
+    manifest.close()
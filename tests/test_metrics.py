@@ -0,0 +1,67 @@
+import json
+import os
+import threading
+import time
+
+import metrics
+from core import BackupRun
+from metrics import Profiler, RunMetrics, error_code
+
+
+def test_report_counts_latencies_errors_and_queues(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "QUEUE_INTERVAL", 0.01)
+    run = RunMetrics()
+    with run.phase("copy"):
+        for index in range(30):
+            run.file(f"/src/dir{index % 2}/f{index}", index / 1000, 100)
+    run.add_errors([("/a", "[Errno 13] Permission denied: '/a'"), ("/b", "[Errno 28] No space"), ("/c", "odd")])
+    run.watch("copy", lambda: 5)
+    time.sleep(0.05)
+    run.finish(30, 3000)
+    run.finished = time.time()
+    data = run.to_dict(job="test")
+    assert data["latency"]["count"] == 30
+    assert len(data["slowest_files"]) == metrics.SLOWEST
+    assert data["slowest_files"][0]["path"] == "/src/dir1/f29"
+    assert data["errors"] == {"EACCES": 1, "ENOSPC": 1, "other": 1}
+    assert data["queues"]["copy"]["max"] == 5
+    text = run.prometheus("test", status="failed")
+    assert 'confback_last_run_success{job="test"} 0' in text
+    assert 'confback_file_duration_seconds_bucket{job="test",le="+Inf"} 30' in text
+    assert 'confback_errors{job="test",errno="EACCES"} 1' in text
+    path = run.write_textfile(str(tmp_path), job="my job")
+    assert os.path.basename(path) == "confback_my_job.prom"
+    assert error_code("[Errno 2] No such file") == "ENOENT"
+
+
+def test_run_leaves_a_report_and_textfile(tmp_path):
+    source, destination = tmp_path / "src", tmp_path / "dst"
+    for folder in (source, destination, tmp_path / "prom"):
+        folder.mkdir()
+    (source / "f").write_bytes(b"data")
+
+    class Log:
+        def push(self, message):
+            pass
+
+    run = BackupRun([(str(source), "native")], str(destination), Log(), name="nightly",
+                    textfile_dir=str(tmp_path / "prom"))
+    assert run.run() is None
+    reports = [name for name in os.listdir(destination / ".confback") if name.startswith("run-")]
+    assert reports
+    with open(destination / ".confback" / sorted(reports)[-1]) as f:
+        assert json.load(f)["files"] == 1
+    assert (tmp_path / "prom" / "confback_nightly.prom").exists()
+
+
+def test_profiler_covers_threads(tmp_path):
+    profiler = Profiler(str(tmp_path / "profile"), "my run")
+    run = RunMetrics()
+    profiler.start()
+    thread = threading.Thread(target=lambda: sum(range(10000)))
+    thread.start()
+    thread.join()
+    stats_path, memory_path = profiler.stop(run)
+    assert os.path.basename(stats_path) == "my_run.pstats" and os.path.exists(stats_path)
+    assert open(memory_path).readline().startswith("Peak traced memory")
+    assert run.memory_peak is not None
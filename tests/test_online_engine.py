@@ -0,0 +1,81 @@
+import io
+import os
+
+import pytest
+
+from online_engine import LocalTarget, Uploader
+from rules import compile_rules
+
+
+@pytest.fixture
+def uploader(tmp_path):
+    target = LocalTarget(str(tmp_path / "bucket"))
+    uploader = Uploader(target, workers=4, host="test", signature_cache=str(tmp_path / "signatures"))
+    yield uploader
+    target.close()
+
+
+def backup(uploader, source, content=None, mtime_ns=None):
+    """Write content to source/big (if given), back it up, and return the snapshot entry."""
+    path = source / "big"
+    if content is not None:
+        path.write_bytes(content)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    result = uploader.backup([str(source)])
+    assert not result.errors
+    return uploader.load_snapshot(result.snapshot_key)["files"]["src/big"]
+
+
+def fetched(uploader, entry):
+    out = io.BytesIO()
+    uploader.fetch(entry, out)
+    return out.getvalue()
+
+
+def changed(data, block):
+    data = bytearray(data)
+    data[block * 16384:block * 16384 + 100] = os.urandom(100)
+    return bytes(data)
+
+
+@pytest.fixture
+def source(tmp_path):
+    source = tmp_path / "src"
+    source.mkdir()
+    return source
+
+
+def test_touch_reuses_delta(uploader, source):
+    a = os.urandom(2 * 1024 * 1024)
+    b = changed(a, 5)
+    backup(uploader, source, a, 1_000_000_000)
+    entry = backup(uploader, source, b, 2_000_000_000)
+    assert entry["key"].startswith("deltas/")
+    touched = backup(uploader, source, mtime_ns=3_000_000_000)
+    assert touched["key"] == entry["key"]
+    assert touched["depth"] == entry["depth"]
+    assert fetched(uploader, touched) == b
+
+
+def test_changed_back_does_not_loop(uploader, source):
+    a = os.urandom(2 * 1024 * 1024)
+    b = changed(a, 5)
+    c = changed(b, 10)
+    backup(uploader, source, a, 1_000_000_000)
+    backup(uploader, source, b, 2_000_000_000)
+    assert fetched(uploader, backup(uploader, source, c, 3_000_000_000)) == c
+    entry = backup(uploader, source, b, 4_000_000_000)
+    assert fetched(uploader, entry) == b
+
+
+def test_walk_applies_exclude_rules(uploader, tmp_path):
+    source = tmp_path / "src"
+    (source / "node_modules" / "pkg").mkdir(parents=True)
+    (source / "node_modules" / "pkg" / "index.js").write_bytes(b"js")
+    (source / "notes.txt").write_bytes(b"notes")
+    (source / "notes.txt~").write_bytes(b"backup")
+    uploader.rules = compile_rules({str(source): ["node_modules/", "*~"]})
+    result = uploader.backup([str(source) + "/"])
+    assert not result.errors
+    assert list(uploader.load_snapshot(result.snapshot_key)["files"]) == ["src/notes.txt"]
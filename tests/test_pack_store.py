@@ -0,0 +1,85 @@
+import os
+
+from pack_store import SMALL_FILE, PackStore
+
+
+def make_source(tmp_path):
+    source = tmp_path / "src"
+    source.mkdir()
+    (source / "small").write_bytes(b"small")
+    (source / "big").write_bytes(os.urandom(SMALL_FILE * 2))
+    (source / "gone").write_bytes(os.urandom(SMALL_FILE * 2))
+    (source / "gone_small").write_bytes(b"gone")
+    os.symlink("small", source / "link")
+    return source
+
+
+def stored(store):
+    return {path for path, _, _, _ in store.entries()}
+
+
+def test_round_trip(tmp_path):
+    source = make_source(tmp_path)
+    store = PackStore(str(tmp_path / "dst"))
+    result = store.backup([str(source)])
+    assert not result.errors
+    assert store.read("src/small") == b"small"
+    assert store.read("src/big") == (source / "big").read_bytes()
+    assert store.read("src/link") == b"small"
+    assert store.backup([str(source)]).unchanged == 5
+
+    errors = store.restore(str(tmp_path / "out"))
+    store.close()
+    assert not errors
+    assert (tmp_path / "out" / "src" / "big").read_bytes() == (source / "big").read_bytes()
+    assert os.readlink(tmp_path / "out" / "src" / "link") == "small"
+
+
+def test_removed_files_are_collected(tmp_path):
+    source = make_source(tmp_path)
+    destination = tmp_path / "dst"
+    store = PackStore(str(destination))
+    store.backup([str(source)])
+    assert (destination / "src" / "gone").exists()
+
+    os.unlink(source / "gone")
+    os.unlink(source / "gone_small")
+    store.backup([str(source)])
+    assert stored(store) == {"src/small", "src/big", "src/link"}
+    assert not (destination / "src" / "gone").exists()
+    store.close()
+
+
+def test_walk_error_keeps_unseen_files(tmp_path, monkeypatch):
+    source = make_source(tmp_path)
+    destination = tmp_path / "dst"
+    store = PackStore(str(destination))
+    store.backup([str(source)])
+    os.unlink(source / "gone")
+    os.unlink(source / "gone_small")
+
+    walk = PackStore.walk
+
+    def failing_walk(self, path, result):
+        result.add_error(path, OSError("unreadable folder"))
+        yield from walk(self, path, result)
+
+    monkeypatch.setattr(PackStore, "walk", failing_walk)
+    result = store.backup([str(source)])
+    assert result.errors
+    # Not seen is not the same as removed: the index and the loose copy stay
+    assert {"src/gone", "src/gone_small"} <= stored(store)
+    assert (destination / "src" / "gone").exists()
+    store.close()
+
+
+def test_loose_copy_removed_once_packed(tmp_path):
+    source = make_source(tmp_path)
+    destination = tmp_path / "dst"
+    store = PackStore(str(destination))
+    store.backup([str(source)])
+    (source / "big").write_bytes(b"now small")
+    store.backup([str(source)])
+    assert store.read("src/big") == b"now small"
+    assert not (destination / "src" / "big").exists()
+    store.close()
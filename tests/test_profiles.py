@@ -0,0 +1,79 @@
+import os
+import sqlite3
+
+from core import BackupRun
+from profiles import DatabaseCopier, DatabaseResult, find_profiles, fingerprint, profile_rules
+from rules import Rules
+
+
+class ListLog:
+    def __init__(self):
+        self.lines = []
+
+    def push(self, message):
+        self.lines.append(message)
+
+
+def make_profile(root):
+    root.mkdir(parents=True)
+    (root / "prefs.js").write_text("// prefs")
+    db = sqlite3.connect(root / "places.sqlite")
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("CREATE TABLE t (x)")
+    db.execute("INSERT INTO t VALUES (1)")
+    db.commit()
+    return db
+
+
+def rows(path):
+    with sqlite3.connect(f"file:{path}?immutable=1", uri=True) as db:
+        return db.execute("SELECT count(*) FROM t").fetchone()[0]
+
+
+def test_profiles_are_found_two_levels_down(tmp_path):
+    make_profile(tmp_path / "Profiles" / "abc.default").close()
+    (tmp_path / "Profiles" / "abc.default" / "nested").mkdir()
+    (tmp_path / "Profiles" / "abc.default" / "nested" / "prefs.js").write_text("")
+    assert find_profiles(str(tmp_path)) == ["Profiles/abc.default"]
+    rules = Rules(profile_rules(["Profiles/abc.default"]))
+    assert rules.excludes("Profiles/abc.default/cache2", True)
+    assert rules.excludes("Profiles/abc.default/places.sqlite-wal")
+    assert not rules.excludes("Profiles/abc.default/prefs.js")
+    assert not Rules(profile_rules([""], databases=False)).excludes("places.sqlite")
+
+
+def test_live_database_is_copied_consistently_and_only_when_changed(tmp_path):
+    source, destination = tmp_path / "src", tmp_path / "dst"
+    db = make_profile(source)
+    destination.mkdir()
+    first = DatabaseCopier(str(destination))
+    result = first.copy(str(source), [""], str(destination / "src"), DatabaseResult())
+    first.save()
+    assert (result.files, result.errors, result.plain) == (1, [], [])
+    assert rows(destination / "src" / "places.sqlite") == 1  # Committed rows still in the -wal file
+
+    again = DatabaseCopier(str(destination))
+    assert again.copy(str(source), [""], str(destination / "src"), DatabaseResult()).unchanged == 1
+    before = fingerprint(str(source / "places.sqlite"))
+    db.execute("INSERT INTO t VALUES (2)")
+    db.commit()
+    assert fingerprint(str(source / "places.sqlite")) != before
+    assert again.copy(str(source), [""], str(destination / "src"), DatabaseResult()).files == 1
+    assert rows(destination / "src" / "places.sqlite") == 2
+    db.close()
+
+
+def test_mirror_run_backs_up_profile_databases(tmp_path):
+    source, destination = tmp_path / "src", tmp_path / "dst"
+    make_profile(source / "abc.default").close()
+    (source / "abc.default" / "cache2").mkdir()
+    (source / "abc.default" / "cache2" / "entry").write_bytes(b"cached")
+    (source / "abc.default" / "fake.sqlite").write_bytes(b"not a database")
+    destination.mkdir()
+    log = ListLog()
+    assert BackupRun([(str(source), "native")], str(destination), log).run() is None
+    copy = destination / "src" / "abc.default"
+    assert rows(copy / "places.sqlite") == 1
+    assert (copy / "fake.sqlite").read_bytes() == b"not a database"
+    assert not (copy / "cache2").exists()
+    assert not os.path.exists(copy / "places.sqlite-wal")
@@ -0,0 +1,49 @@
+import threading
+
+from progress import ProgressTracker, ScanTotals, format_duration, parse_rsync_progress, prescan
+from rules import compile_rules
+
+
+def test_prescan_counts_files_and_bytes_per_source(tmp_path):
+    (tmp_path / "a" / "deep" / "er").mkdir(parents=True)
+    (tmp_path / "a" / "one").write_bytes(b"x" * 10)
+    (tmp_path / "a" / "deep" / "er" / "two").write_bytes(b"x" * 20)
+    (tmp_path / "a" / "deep" / "skip.tmp").write_bytes(b"x" * 1000)
+    (tmp_path / "file").write_bytes(b"x" * 5)
+    sources = [str(tmp_path / "a") + "/", str(tmp_path / "file"), str(tmp_path / "missing")]
+    totals = prescan(sources, workers=3, rules=compile_rules({str(tmp_path / "a"): ["*.tmp"]}))
+    assert totals.per_source == {sources[0]: (2, 30), sources[1]: (1, 5), sources[2]: (0, 0)}
+    assert (totals.files, totals.bytes) == (3, 35)
+
+
+def test_tracker_emits_at_a_bounded_rate():
+    totals = ScanTotals()
+    totals.files, totals.bytes = 1000, 1000 * 100
+    emitted = []
+    tracker = ProgressTracker(totals, lambda percent, text: emitted.append((percent, text)), rate=1)
+    threads = [threading.Thread(target=lambda: [tracker.add(1, 100) for _ in range(250)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    tracker.finish()
+    assert len(emitted) == 2  # The first report and the forced last one
+    assert emitted[-1][0] == 100
+    assert emitted[-1][1].startswith("1000/1000 files")
+
+
+def test_subprocess_jobs_count_while_running():
+    totals = ScanTotals()
+    totals.files, totals.bytes = 10, 1000
+    emitted = []
+    tracker = ProgressTracker(totals, lambda percent, text: emitted.append(percent), rate=1000)
+    tracker.set_job("rsync", 250)
+    assert tracker.done_bytes() == 250
+    tracker.complete_job("rsync", 5, 500)
+    assert (tracker.files, tracker.done_bytes()) == (5, 500)
+
+
+def test_rsync_progress_and_durations():
+    assert parse_rsync_progress("    1,234,567  45%   12.34MB/s    0:00:10 (xfr#5, to-chk=10/20)") == 1234567
+    assert parse_rsync_progress("sending incremental file list") is None
+    assert format_duration(3725) == "1:02:05"
@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+from archive import ArchiveWriter
+from copy_engine import NativeCopier
+from pack_store import SMALL_FILE, PackStore
+from restore import find_backups, restore, safe_path, search, select_backup, with_parents
+
+
+def make_source(tmp_path):
+    source = tmp_path / "src"
+    (source / "conf" / "nested").mkdir(parents=True)
+    (source / "conf" / "nested" / "app.ini").write_bytes(b"[app]\n")
+    (source / "conf" / "large.bin").write_bytes(os.urandom(SMALL_FILE * 2))
+    (source / "notes.txt").write_bytes(b"notes")
+    os.chmod(source / "conf" / "nested", 0o700)
+    os.utime(source / "notes.txt", ns=(1_000_000_000, 1_000_000_000))
+    return source
+
+
+def restored(backup, tmp_path, patterns):
+    entries = backup.load()
+    selected = with_parents(search(entries, patterns), entries)
+    result = restore(backup, selected, str(tmp_path / "out"), workers=2)
+    assert not result.errors
+    backup.close()
+    return tmp_path / "out"
+
+
+def test_mirror_restore_brings_back_parents_and_metadata(tmp_path):
+    source = make_source(tmp_path)
+    (tmp_path / "dst").mkdir()
+    NativeCopier(workers=2).copy_tree(str(source), str(tmp_path / "dst"))
+    backups = find_backups(str(tmp_path / "dst"))
+    assert [backup.kind for backup in backups] == ["mirror"]
+    out = restored(select_backup(backups), tmp_path, ["*.ini", "src/notes.txt"])
+    assert (out / "src" / "conf" / "nested" / "app.ini").read_bytes() == b"[app]\n"
+    assert not (out / "src" / "conf" / "large.bin").exists()
+    assert os.stat(out / "src" / "conf" / "nested").st_mode & 0o777 == 0o700
+    assert os.stat(out / "src" / "notes.txt").st_mtime_ns == 1_000_000_000
+
+
+@pytest.mark.parametrize("kind", ["packs", "archive"])
+def test_packed_and_archived_files_are_restored(tmp_path, kind):
+    source = make_source(tmp_path)
+    (tmp_path / "dst").mkdir()
+    if kind == "packs":
+        store = PackStore(str(tmp_path / "dst"))
+        assert not store.backup([str(source)]).errors
+        store.close()
+    else:
+        assert not ArchiveWriter(str(tmp_path / "dst")).write([str(source)], host="test").errors
+    backup = [backup for backup in find_backups(str(tmp_path / "dst")) if backup.kind != "mirror"][-1]
+    out = restored(backup, tmp_path, ["src/conf/*"])
+    assert (out / "src" / "conf" / "large.bin").read_bytes() == (source / "conf" / "large.bin").read_bytes()
+    assert not (out / "src" / "notes.txt").exists()
+
+
+def test_stored_paths_cannot_escape_the_target(tmp_path):
+    assert safe_path(str(tmp_path), "/a/./b") == str(tmp_path / "a" / "b")
+    with pytest.raises(ValueError):
+        safe_path(str(tmp_path), "a/../../etc/passwd")
@@ -0,0 +1,45 @@
+import pytest
+
+from rules import Rules, compile_rules
+
+
+@pytest.mark.parametrize("pattern, path, is_dir, excluded", [
+    ("*.log", "a.log", False, True),
+    ("*.log", "deep/down/a.log", False, True),
+    ("*.log", "a.log.txt", False, False),
+    ("cache/", "x/cache", True, True),
+    ("cache/", "x/cache", False, False),  # Only folders
+    ("/top", "top", False, True),
+    ("/top", "sub/top", False, False),  # Anchored to the source root
+    ("a/*.txt", "a/b.txt", False, True),
+    ("a/*.txt", "a/b/c.txt", False, False),  # * does not cross a slash
+    ("a/**/c.txt", "a/b/b/c.txt", False, True),
+    ("a/**/c.txt", "a/c.txt", False, True),
+    ("**/build/", "x/y/build", True, True),
+    ("logs/**", "logs/a/b", False, True),
+    ("file[0-9]", "file7", False, True),
+    ("file[!0-9]", "file7", False, False),
+    ("\\#hash", "#hash", False, True),
+])
+def test_gitignore_patterns(pattern, path, is_dir, excluded):
+    assert Rules([pattern]).excludes(path, is_dir) is excluded
+
+
+def test_last_matching_rule_wins():
+    rules = Rules(["*.conf", "!keep.conf", "# comment", "", "keep.conf.d/", "!important/keep.conf"])
+    assert rules.excludes("other.conf")
+    assert not rules.excludes("keep.conf")
+    assert rules.excludes("keep.conf.d", True)
+    assert len(rules.groups) == 4
+
+
+def test_paths_below_an_excluded_folder():
+    rules = Rules(["node_modules/"])
+    assert not rules.excludes("node_modules/pkg/index.js")
+    assert rules.excludes_path("node_modules/pkg/index.js")
+
+
+def test_rsync_args_and_compiled_sources():
+    assert Rules(["/cache/", "!cache/keep"]).rsync_args() == "--include=/cache/keep --exclude=/cache/"
+    compiled = compile_rules({"/home/me/": ["*.tmp"], "/srv": []})
+    assert list(compiled) == ["/home/me"]
@@ -0,0 +1,56 @@
+import threading
+import time
+
+from scheduler import JobScheduler
+
+
+def test_jobs_share_a_device_up_to_its_limit(tmp_path):
+    scheduler = JobScheduler(str(tmp_path), rotational_limit=2, solid_state_limit=2)
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def job():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+        return None
+
+    for index in range(5):
+        (tmp_path / f"s{index}").mkdir()
+        scheduler.add(str(tmp_path / f"s{index}"), job)
+    report = scheduler.run()
+    assert report.ok and len(report.results) == 5
+    assert max(peak) == 2
+
+
+def test_errors_and_crashes_are_reported_per_job(tmp_path):
+    scheduler = JobScheduler(str(tmp_path))
+
+    def crash():
+        raise RuntimeError("boom")
+
+    scheduler.add(str(tmp_path), lambda: None)
+    scheduler.add(str(tmp_path), lambda: "failed")
+    scheduler.add(str(tmp_path), crash)
+    scheduler.add(str(tmp_path / "missing"), lambda: None)  # Falls back to the destination device
+    report = scheduler.run()
+    assert sorted(result.error for result in report.errors) == ["boom", "failed"]
+    assert len(report.results) == 4
+
+
+def test_stop_starts_no_further_jobs(tmp_path):
+    scheduler = JobScheduler(str(tmp_path), rotational_limit=1, solid_state_limit=1)
+    started = []
+
+    def job():
+        started.append(1)
+        scheduler.stop()
+
+    for _ in range(3):
+        scheduler.add(str(tmp_path), job)
+    scheduler.run()
+    assert len(started) == 1
@@ -0,0 +1,59 @@
+import os
+
+from core import BackupRun
+from snapshots import (LATEST, PARTIAL_SUFFIX, SnapshotWriter, diff_snapshots, list_snapshots, prune_snapshots,
+                       snapshot_root)
+
+
+class ListLog:
+    def push(self, message):
+        pass
+
+
+def snapshot(source, destination):
+    assert BackupRun([(str(source), "native")], str(destination), ListLog(), "snapshots").run() is None
+    return list_snapshots(str(destination))[-1]
+
+
+def test_unchanged_files_are_hardlinked_between_snapshots(tmp_path):
+    source, destination = tmp_path / "src", tmp_path / "dst"
+    (source / "sub").mkdir(parents=True)
+    destination.mkdir()
+    (source / "same").write_bytes(b"same")
+    (source / "edited").write_bytes(b"before")
+    (source / "sub" / "removed").write_bytes(b"removed")
+    first = snapshot(source, destination)
+
+    (source / "edited").write_bytes(b"after!")
+    (source / "sub" / "removed").unlink()
+    (source / "added").write_bytes(b"added")
+    second = snapshot(source, destination)
+
+    root = snapshot_root(str(destination))
+    assert os.readlink(os.path.join(root, LATEST)) == second
+    old, new = os.path.join(root, first, "src"), os.path.join(root, second, "src")
+    assert os.stat(os.path.join(old, "same")).st_ino == os.stat(os.path.join(new, "same")).st_ino
+    assert open(os.path.join(old, "edited"), "rb").read() == b"before"
+    assert open(os.path.join(new, "edited"), "rb").read() == b"after!"
+    assert diff_snapshots(str(destination), first, second) == [
+        ("added", "src/added"), ("modified", "src/edited"), ("removed", "src/sub/removed")]
+
+
+def test_prune_keeps_the_newest(tmp_path):
+    root = tmp_path / "snapshots"
+    for name in ("2024-01-01T000000", "2024-02-01T000000", "2024-03-01T000000", "2024-04-01T000000.part"):
+        (root / name).mkdir(parents=True)
+    assert prune_snapshots(str(tmp_path), keep=1) == ["2024-01-01T000000", "2024-02-01T000000"]
+    assert list_snapshots(str(tmp_path)) == ["2024-03-01T000000"]
+    assert prune_snapshots(str(tmp_path), keep=0, max_age_days=1) == []
+
+
+def test_interrupted_snapshot_is_continued(tmp_path):
+    root = tmp_path / "snapshots"
+    (root / "2024-01-01T000000.part").mkdir(parents=True)
+    (root / "2024-01-02T000000.part").mkdir()
+    (root / "2024-01-02T000000.part" / "copied").write_bytes(b"kept")
+    writer = SnapshotWriter(str(tmp_path))
+    assert writer.begin()
+    assert os.listdir(root) == [writer.name + PARTIAL_SUFFIX]
+    assert (root / (writer.name + PARTIAL_SUFFIX) / "copied").read_bytes() == b"kept"
@@ -0,0 +1,36 @@
+import time
+
+import pytest
+
+QtCore = pytest.importorskip("PyQt5.QtCore")
+from source_model import PATH_ROLE, SizeScanner, SourceListModel
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+
+
+def test_bulk_add_remove_and_lazy_sizes(app, tmp_path):
+    folders = []
+    for name in ("a", "b", "c"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "keep").write_bytes(b"x" * 10)
+        (tmp_path / name / "skip.tmp").write_bytes(b"x" * 1000)
+        folders.append(str(tmp_path / name))
+    model = SourceListModel("native", SizeScanner(), {folders[1]: ["*.tmp"]})
+    inserts = []
+    model.rowsInserted.connect(lambda parent, first, last: inserts.append((first, last)))
+    assert model.add_paths(folders + folders[:1]) == folders
+    assert inserts == [(0, 2)]  # One insert for the whole batch, duplicates dropped
+
+    assert model.data(model.index(1)) == "b  (counting...)"
+    deadline = time.monotonic() + 5
+    while model.sizes[folders[1]] is None and time.monotonic() < deadline:
+        app.processEvents()
+        time.sleep(0.01)
+    assert model.data(model.index(1)) == "b  (1 files, 10.0 B)"
+
+    assert model.remove_rows([0, 2]) == [folders[2], folders[0]]
+    assert model.rowCount() == 1 and model.rows == {folders[1]: 0}
+    assert model.data(model.index(0), PATH_ROLE) == folders[1]
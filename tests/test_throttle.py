@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+import throttle
+from throttle import Throttle, TokenBucket, parse_rate
+
+
+def test_parse_rate():
+    assert parse_rate("500K") == 500 * 1024
+    assert parse_rate(" 1.5 MiB/s ") == int(1.5 * 1024 ** 2)
+    assert parse_rate("2g") == 2 * 1024 ** 3
+    assert parse_rate(100) == 100
+    with pytest.raises(ValueError):
+        parse_rate("fast")
+
+
+def test_bucket_sleeps_off_its_debt_until_stopped():
+    stopped = threading.Event()
+    bucket = TokenBucket(1000, stopped)
+    started = time.monotonic()
+    bucket.take(1000)  # The first second's worth is free
+    bucket.take(200)
+    assert 0.15 < time.monotonic() - started < 0.5
+    stopped.set()
+    started = time.monotonic()
+    bucket.take(10_000)
+    assert time.monotonic() - started < 0.1
+
+
+def test_charged_bytes_are_not_taken_twice(monkeypatch):
+    limiter = Throttle("1M", files_per_s=1000)
+    taken = []
+    monkeypatch.setattr(limiter.bytes, "take", taken.append)
+    limiter.charge(300)
+    limiter.charge(200)
+    limiter.take(1, 800)
+    limiter.take(1, 100)
+    assert taken == [300, 200, 300, 100]
+
+
+def test_adaptive_backs_off_under_load_and_recovers(monkeypatch):
+    monkeypatch.setattr(throttle, "ADAPT_INTERVAL", 0)
+    monkeypatch.setattr(throttle, "disk_queue", lambda: 0)
+    load = [100.0]
+    monkeypatch.setattr(throttle.os, "getloadavg", lambda: (load[0], 0, 0))
+    limiter = Throttle("8M", adaptive=True)
+    for _ in range(2):
+        limiter.adapt(0)
+    assert limiter.scale == 0.25 and limiter.bytes.rate == 2 * 1024 ** 2
+    load[0] = 0.0
+    for _ in range(10):
+        limiter.adapt(0)
+    assert limiter.scale == 1.0 and limiter.bytes.rate == 8 * 1024 ** 2
+
+
+def test_from_dict_and_bad_priority():
+    assert Throttle.from_dict({}) is None
+    assert Throttle.from_dict({"bytes_per_s": "20M"}).rsync_args(share=2) == " --bwlimit=10240"
+    with pytest.raises(ValueError):
+        Throttle(priority="urgent")
@@ -0,0 +1,59 @@
+import os
+import shutil
+
+import verify
+from pack_store import SMALL_FILE, PackStore
+from verify import HashCache, Verifier, VerifyReport
+
+
+def problems(report):
+    return sorted((mismatch["path"], mismatch["problem"]) for mismatch in report.mismatches)
+
+
+def test_tree_mismatches_and_cached_hashes(tmp_path):
+    source, target = tmp_path / "src", tmp_path / "dst"
+    source.mkdir()
+    for name in ("same", "content", "size", "missing"):
+        (source / name).write_bytes(b"original")
+    shutil.copytree(source, target)
+    (target / "content").write_bytes(b"ORIGINAL")
+    (target / "size").write_bytes(b"longer than before")
+    (target / "missing").unlink()
+    caches = HashCache(str(tmp_path / "src.db")), HashCache(str(tmp_path / "dst.db"), use_device=False)
+
+    report = Verifier(*caches).verify_tree(str(source), str(target), VerifyReport())
+    assert report.files == 4
+    assert problems(report) == [("content", "content"), ("missing", "missing"), ("size", "size")]
+    for cache in caches:
+        cache.flush()
+    again = Verifier(*caches).verify_tree(str(source), str(target), VerifyReport())
+    assert (again.cached, again.bytes_read) == (4, 0)
+    assert Verifier(*caches, full=True).verify_tree(str(source), str(target), VerifyReport()).cached == 0
+
+
+def test_packs_report_source_files_missing_from_the_index(tmp_path):
+    source = tmp_path / "src"
+    source.mkdir()
+    (source / "small").write_bytes(b"small")
+    (source / "big").write_bytes(os.urandom(SMALL_FILE * 2))
+    store = PackStore(str(tmp_path / "dst"))
+    assert not store.backup([str(source)]).errors
+    (source / "added").write_bytes(b"after the backup")
+    (source / "big").write_bytes(os.urandom(SMALL_FILE * 2))
+
+    report = Verifier().verify_packs(store, [str(source)], VerifyReport())
+    store.close()
+    assert report.files == 3
+    assert problems(report) == [("src/added", "missing"), ("src/big", "content")]
+
+
+def test_cache_flushes_in_bounded_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(verify, "FLUSH_ROWS", 3)
+    cache = HashCache(str(tmp_path / "hashes.db"))
+    for index in range(7):
+        path = tmp_path / f"f{index}"
+        path.write_bytes(b"x")
+        cache.put(os.stat(path), "digest")
+    assert len(cache.pending) == 1
+    assert cache.get(os.stat(tmp_path / "f0")) == "digest"
+    cache.close()
@@ -0,0 +1,113 @@
+import os
+import sqlite3
+import threading
+import time
+
+from copy_engine import TEMP_SUFFIX
+from watcher import Watcher
+
+
+class ListLog:
+    def __init__(self):
+        self.lines = []
+
+    def push(self, message):
+        self.lines.append(message)
+
+
+def wait_for(check, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def start(watcher):
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    assert wait_for(lambda: watcher.watches)
+    return thread
+
+
+def test_copies_changes_through_a_temp_file(tmp_path, monkeypatch):
+    source, mirror = tmp_path / "src", tmp_path / "mirror"
+    source.mkdir()
+    mirror.mkdir()
+    (source / "old").write_bytes(b"old")
+    renames = []
+    real_replace = os.replace
+    monkeypatch.setattr(os, "replace", lambda a, b: (renames.append((a, b)), real_replace(a, b)))
+    watcher = Watcher([(str(source), "native")], str(mirror), ListLog(), debounce=0.05)
+    thread = start(watcher)
+    try:
+        assert (mirror / "src" / "old").read_bytes() == b"old"
+        (source / "sub").mkdir()
+        (source / "sub" / "new").write_bytes(b"new")
+        (source / "old").write_bytes(b"changed")
+        assert wait_for(lambda: (mirror / "src" / "sub" / "new").exists()
+                        and (mirror / "src" / "old").read_bytes() == b"changed")
+    finally:
+        watcher.stop()
+        thread.join()
+    assert all(a.endswith(TEMP_SUFFIX) for a, _ in renames)
+    assert not [name for _, _, names in os.walk(mirror) for name in names if name.endswith(TEMP_SUFFIX)]
+
+
+def test_failed_copy_leaves_the_mirror_file_alone(tmp_path, monkeypatch):
+    import watcher as watcher_module
+
+    source, mirror = tmp_path / "src", tmp_path / "mirror"
+    source.mkdir()
+    (mirror / "src").mkdir(parents=True)
+    (source / "f").write_bytes(b"new content")
+    (mirror / "src" / "f").write_bytes(b"previous")
+
+    def failing_copy(src, dst, st):
+        with open(dst, "wb") as f:
+            f.write(b"half")
+        raise OSError(5, "Input/output error")
+
+    monkeypatch.setattr(watcher_module, "copy_file", failing_copy)
+    watcher = Watcher([(str(source), "native")], str(mirror), ListLog())
+    result = watcher_module.WatchResult()
+    watcher.copy_path(str(source / "f"), "src/f", result)
+    watcher.inotify.close()
+    assert result.errors
+    assert (mirror / "src" / "f").read_bytes() == b"previous"
+    assert os.listdir(mirror / "src") == ["f"]
+
+
+def test_profile_databases_are_backed_up_not_copied(tmp_path):
+    source, mirror = tmp_path / "src", tmp_path / "mirror"
+    profile = source / "abcd.default"
+    (profile / "cache2").mkdir(parents=True)
+    mirror.mkdir()
+    (profile / "prefs.js").write_text("// prefs")
+    (profile / "cache2" / "entry").write_bytes(b"cached")
+    db = sqlite3.connect(profile / "places.sqlite")
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("CREATE TABLE t (x)")
+    db.execute("INSERT INTO t VALUES (1)")
+    db.commit()
+    log = ListLog()
+    watcher = Watcher([(str(source), "native")], str(mirror), log, debounce=0.05)
+    copy = mirror / "src" / "abcd.default" / "places.sqlite"
+    thread = start(watcher)
+    try:
+        assert wait_for(copy.exists)
+        db.execute("INSERT INTO t VALUES (2)")
+        db.commit()
+
+        def rows():
+            with sqlite3.connect(f"file:{copy}?immutable=1", uri=True) as backup:
+                return backup.execute("SELECT count(*) FROM t").fetchone()[0]
+        assert wait_for(lambda: rows() == 2)
+    finally:
+        watcher.stop()
+        thread.join()
+        db.close()
+    assert (mirror / "src" / "abcd.default" / "prefs.js").exists()
+    assert not (mirror / "src" / "abcd.default" / "cache2").exists()
+    assert not (mirror / "src" / "abcd.default" / "places.sqlite-wal").exists()
@@ -0,0 +1,198 @@
+import ctypes
+import os
+import platform
+import re
+import shutil
+import threading
+import time
+
+PRIORITIES = ("normal", "best-effort", "idle")
+# ioprio_set(2): classes and the syscall number, which differs per architecture
+IOPRIO_CLASS_BE = 2
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_SET = {"x86_64": 251, "aarch64": 30, "i686": 289, "armv7l": 314}
+# Niceness of backup threads and commands at the lower priorities
+NICENESS = {"best-effort": 10, "idle": 19}
+# Adaptive mode: how often pressure is sampled, when it counts as high, and how far rates may drop
+ADAPT_INTERVAL = 1.0
+LOAD_HIGH = 1.0  # Load average per CPU
+QUEUE_HIGH = 8  # I/Os in flight on the busiest disk
+MIN_SCALE = 1 / 16
+
+
+def parse_rate(text):
+    """Parse a byte rate like 500K, 20M or 1G per second (powers of 1024) into bytes per second."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGkmg]?)(?:i?B)?(?:/s)?\s*", str(text))
+    if match is None:
+        raise ValueError(f"Invalid rate {text!r}, expected e.g. 500K or 20M")
+    return int(float(match.group(1)) * 1024 ** " KMG".index(match.group(2).upper() or " "))
+
+
+def set_thread_priority(priority):
+    """Lower the CPU and I/O priority of the calling thread; Linux applies both per thread."""
+    if priority not in NICENESS:
+        return
+    tid = threading.get_native_id()
+    try:
+        os.setpriority(os.PRIO_PROCESS, tid, NICENESS[priority])
+    except OSError:
+        pass
+    number = IOPRIO_SET.get(platform.machine())
+    if number is not None:
+        io_class = IOPRIO_CLASS_IDLE if priority == "idle" else IOPRIO_CLASS_BE
+        # Best effort at its lowest level (7), idle has no levels
+        value = io_class << IOPRIO_CLASS_SHIFT | (7 if io_class == IOPRIO_CLASS_BE else 0)
+        ctypes.CDLL(None, use_errno=True).syscall(number, IOPRIO_WHO_PROCESS, tid, value)
+
+
+def command_prefix(priority):
+    """Wrap an external command so it runs at the given priority, as far as nice and ionice exist."""
+    if priority not in NICENESS:
+        return ""
+    prefix = f"nice -n {NICENESS[priority]} " if shutil.which("nice") else ""
+    if shutil.which("ionice"):
+        prefix += "ionice -c 3 " if priority == "idle" else "ionice -c 2 -n 7 "
+    return prefix
+
+
+def disk_queue():
+    """I/Os currently in flight on the busiest block device, from /proc/diskstats."""
+    try:
+        with open("/proc/diskstats") as f:
+            return max((int(line.split()[11]) for line in f if len(line.split()) > 11), default=0)
+    except (OSError, ValueError):
+        return 0
+
+
+class TokenBucket:
+    """Rate limiter that lets callers take more than is available and sleep off the debt.
+
+    Engines report work after doing it, so a large file is paid for afterwards; on
+    average the rate holds. The bucket holds at most one second of tokens.
+    """
+
+    def __init__(self, rate, stopped):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.stopped = stopped  # Event that cuts every sleep short
+
+    def take(self, amount):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate) - amount
+            self.updated = now
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            self.stopped.wait(wait)
+
+
+class Throttle:
+    """Per-run limits on bytes and files per second, thread priority and adaptive backing off.
+
+    take(files, size) is called by the progress tracker for the work engines report,
+    on the thread that did it. Engines that copy in chunks call charge(size) as they
+    go, so a large file is limited while it is copied; take() then only asks for the
+    bytes of a file that were not charged yet. In adaptive mode the rates are halved
+    whenever the load average or the disk queue is high and recover by a quarter per
+    quiet second; without a byte limit, the rate seen when pressure first appeared
+    is the one that gets scaled.
+    """
+
+    def __init__(self, bytes_per_s=None, files_per_s=None, priority="normal", adaptive=False):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority!r}, expected one of {', '.join(PRIORITIES)}")
+        self.bytes_per_s = parse_rate(bytes_per_s) if isinstance(bytes_per_s, str) else bytes_per_s
+        self.files_per_s = files_per_s
+        self.priority = priority
+        self.adaptive = adaptive
+        self.stopped = threading.Event()
+        self.bytes = TokenBucket(self.bytes_per_s, self.stopped) if self.bytes_per_s else None
+        self.files = TokenBucket(files_per_s, self.stopped) if files_per_s else None
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.scale = 1.0
+        self.base_rate = self.bytes_per_s
+        self.sampled = time.monotonic()
+        self.sampled_bytes = 0
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a throttle from a job's "throttle" settings, or None when there are none."""
+        if not data:
+            return None
+        return cls(data.get("bytes_per_s"), data.get("files_per_s"), data.get("priority", "normal"),
+                   data.get("adaptive", False))
+
+    def rsync_args(self, share=1):
+        """--bwlimit for one of share rsync processes running side by side (rsync counts in KiB/s)."""
+        if not self.bytes_per_s:
+            return ""
+        return f" --bwlimit={max(1, self.bytes_per_s // 1024 // share)}"
+
+    def command_prefix(self):
+        return command_prefix(self.priority)
+
+    @property
+    def limits_rate(self):
+        """Whether bytes or files per second are limited, now or once adaptive mode kicks in."""
+        return bool(self.bytes_per_s or self.files_per_s or self.adaptive)
+
+    def stop(self):
+        self.stopped.set()
+
+    def prioritize(self):
+        if not getattr(self.local, "prioritized", False):
+            self.local.prioritized = True
+            set_thread_priority(self.priority)
+
+    def charge(self, size):
+        """Take bytes copied so far within a file, on the thread copying it."""
+        self.prioritize()
+        self.local.charged = getattr(self.local, "charged", 0) + size
+        if self.adaptive:
+            self.adapt(size)
+        if self.bytes is not None:
+            self.bytes.take(size)
+
+    def take(self, files, size):
+        self.prioritize()
+        charged = getattr(self.local, "charged", 0)
+        if charged:
+            self.local.charged = 0
+            size = max(0, size - charged)
+        if self.adaptive:
+            self.adapt(size)
+        if self.files is not None and files:
+            self.files.take(files)
+        if self.bytes is not None and size:
+            self.bytes.take(size)
+
+    def adapt(self, size):
+        with self.lock:
+            self.sampled_bytes += size
+            now = time.monotonic()
+            elapsed = now - self.sampled
+            if elapsed < ADAPT_INTERVAL:
+                return
+            observed = self.sampled_bytes / elapsed
+            self.sampled, self.sampled_bytes = now, 0
+        busy = (os.getloadavg()[0] / (os.cpu_count() or 1) > LOAD_HIGH or disk_queue() > QUEUE_HIGH)
+        with self.lock:
+            if busy:
+                if self.base_rate is None:
+                    self.base_rate = max(observed, 1024 * 1024)
+                self.scale = max(MIN_SCALE, self.scale / 2)
+            elif self.scale < 1.0:
+                self.scale = min(1.0, self.scale * 1.25)
+            if self.scale == 1.0 and not self.bytes_per_s:
+                self.base_rate = None
+                self.bytes = None
+            elif self.base_rate:
+                rate = self.base_rate * self.scale
+                if self.bytes is None:
+                    self.bytes = TokenBucket(rate, self.stopped)
+                self.bytes.rate = rate
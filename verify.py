@@ -0,0 +1,333 @@
+import hashlib
+import json
+import os
+import sqlite3
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from manifest import state_dir
+
+READ_SIZE = 1024 * 1024
+HASH_CACHE_NAME = "hashes.db"
+# New hashes are written to the cache in transactions of this many rows
+FLUSH_ROWS = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    device INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    ctime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (device, inode)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS pack_hashes (
+    pack TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (pack, offset)
+) WITHOUT ROWID;
+"""
+
+
+def default_cache_path():
+    """Hash cache of source files, which live on the user's own disks."""
+    cache = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    os.makedirs(os.path.join(cache, "confback"), exist_ok=True)
+    return os.path.join(cache, "confback", HASH_CACHE_NAME)
+
+
+def hash_file(path, offset=0, length=None):
+    """BLAKE2b of a file, or of length bytes at offset, read in large blocks into one reused buffer.
+
+    Hashing releases the GIL.
+    """
+    digest = hashlib.blake2b(digest_size=32)
+    buffer = bytearray(READ_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        f.seek(offset)
+        remaining = length
+        while remaining is None or remaining > 0:
+            count = f.readinto(buffer if remaining is None or remaining >= READ_SIZE else view[:remaining])
+            if not count:
+                break
+            digest.update(view[:count])
+            if remaining is not None:
+                remaining -= count
+    return digest.hexdigest()
+
+
+class HashCache:
+    """Content hashes keyed by inode, trusted while size, mtime and ctime are unchanged.
+
+    A rewrite that restores the old mtime still moves the ctime, so it is not missed.
+    With use_device=False inodes are only unique per cache, which suits a cache kept
+    inside a removable destination whose device number changes between mounts.
+    """
+
+    def __init__(self, path, use_device=True):
+        self.use_device = use_device
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.pending = []
+        self.pending_packed = []
+
+    def key(self, st):
+        return (st.st_dev if self.use_device else 0), st.st_ino
+
+    def get(self, st):
+        with self.lock:
+            row = self.conn.execute("SELECT size, mtime_ns, ctime_ns, hash FROM hashes WHERE device = ? AND inode = ?",
+                                    self.key(st)).fetchone()
+        if row is not None and row[:3] == (st.st_size, st.st_mtime_ns, st.st_ctime_ns):
+            return row[3]
+        return None
+
+    def put(self, st, digest):
+        with self.lock:
+            self.pending.append(self.key(st) + (st.st_size, st.st_mtime_ns, st.st_ctime_ns, digest))
+            full = len(self.pending) >= FLUSH_ROWS
+        if full:
+            self.flush()
+
+    def get_packed(self, pack, offset, length, mtime_ns):
+        """Hash of an entry of a pack file, trusted while the pack's mtime is unchanged."""
+        with self.lock:
+            row = self.conn.execute("SELECT length, mtime_ns, hash FROM pack_hashes WHERE pack = ? AND offset = ?",
+                                    (pack, offset)).fetchone()
+        if row is not None and row[:2] == (length, mtime_ns):
+            return row[2]
+        return None
+
+    def put_packed(self, pack, offset, length, mtime_ns, digest):
+        with self.lock:
+            self.pending_packed.append((pack, offset, length, mtime_ns, digest))
+            full = len(self.pending_packed) >= FLUSH_ROWS
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)", self.pending)
+            self.conn.executemany("INSERT OR REPLACE INTO pack_hashes VALUES (?, ?, ?, ?, ?)", self.pending_packed)
+            self.pending = []
+            self.pending_packed = []
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.conn.close()
+
+
+class VerifyReport:
+    """Outcome of a verification; mismatches are dicts ready to be written as JSON."""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes_read = 0
+        self.cached = 0  # Hashes taken from a cache instead of reading the file
+        self.mismatches = []
+        self.lock = threading.Lock()
+
+    def add_mismatch(self, path, problem, source=None, destination=None):
+        with self.lock:
+            self.mismatches.append({"path": path, "problem": problem, "source": source, "destination": destination})
+
+    def add_error(self, path, error):
+        """A path that could not be read, for walkers that report errors this way."""
+        self.add_mismatch(path, "unreadable", str(error))
+
+    def add_read(self, size):
+        with self.lock:
+            self.bytes_read += size
+
+    def add_cached(self):
+        with self.lock:
+            self.cached += 1
+
+    @property
+    def ok(self):
+        return not self.mismatches
+
+    def to_dict(self):
+        return {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "files": self.files, "bytes_read": self.bytes_read,
+                "cached": self.cached, "ok": self.ok,
+                "mismatches": sorted(self.mismatches, key=lambda mismatch: mismatch["path"])}
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+class Verifier:
+    """Compares source trees with their copies by content, hashing both sides in parallel."""
+
+    def __init__(self, source_cache=None, destination_cache=None, workers=None, full=False):
+        self.source_cache = source_cache
+        self.destination_cache = destination_cache
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        self.full = full  # Ignore cached hashes and read everything, to catch silent corruption
+        self.running = True
+        self.progress = None  # Optional callable(files, bytes) invoked per verified file
+
+    def stop(self):
+        self.running = False
+
+    def digest(self, path, st, cache, report):
+        if cache is not None and not self.full:
+            digest = cache.get(st)
+            if digest is not None:
+                report.add_cached()
+                return digest
+        digest = hash_file(path)
+        report.add_read(st.st_size)
+        if cache is not None:
+            cache.put(st, digest)
+        return digest
+
+    def compare_file(self, src, dst, rel_path, st, report):
+        try:
+            try:
+                dst_st = os.lstat(dst)
+            except FileNotFoundError:
+                report.add_mismatch(rel_path, "missing")
+                return
+            if stat.S_ISLNK(st.st_mode):
+                if not stat.S_ISLNK(dst_st.st_mode) or os.readlink(src) != os.readlink(dst):
+                    report.add_mismatch(rel_path, "symlink", os.readlink(src),
+                                        os.readlink(dst) if stat.S_ISLNK(dst_st.st_mode) else None)
+                return
+            if not stat.S_ISREG(dst_st.st_mode):
+                report.add_mismatch(rel_path, "type")
+            elif dst_st.st_size != st.st_size:
+                report.add_mismatch(rel_path, "size", st.st_size, dst_st.st_size)
+            else:
+                source_hash = self.digest(src, st, self.source_cache, report)
+                destination_hash = self.digest(dst, dst_st, self.destination_cache, report)
+                if source_hash != destination_hash:
+                    report.add_mismatch(rel_path, "content", source_hash, destination_hash)
+        except OSError as e:
+            report.add_mismatch(rel_path, "unreadable", str(e))
+        finally:
+            if self.progress is not None:
+                self.progress(1, st.st_size)
+
+    def verify_tree(self, source, target, report, prefix="", rules=None):
+        """Check every file and symlink below source not excluded by rules against the same path below target."""
+        pending = threading.BoundedSemaphore(self.workers * 4)
+
+        def task(*args):
+            try:
+                self.compare_file(*args)
+            finally:
+                pending.release()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            stack = [""]
+            while stack and self.running:
+                rel_dir = stack.pop()
+                path = os.path.join(source, rel_dir) if rel_dir else source
+                try:
+                    with os.scandir(path) as entries:
+                        for entry in entries:
+                            rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                            if rules is not None and rules.excludes(rel_path, entry.is_dir(follow_symlinks=False)):
+                                continue
+                            st = entry.stat(follow_symlinks=False)
+                            if stat.S_ISDIR(st.st_mode):
+                                stack.append(rel_path)
+                            elif stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode):
+                                report.files += 1
+                                pending.acquire()
+                                executor.submit(task, entry.path, os.path.join(target, rel_path),
+                                                prefix + rel_path, st, report)
+                except OSError as e:
+                    report.add_mismatch(prefix + rel_dir, "unreadable", str(e))
+        return report
+
+    def compare_packed(self, store, rel_path, source, report):
+        try:
+            st = os.lstat(source)
+        except FileNotFoundError:
+            return  # Removed from the source since the backup
+        with report.lock:
+            report.files += 1
+        try:
+            path, offset, length, pack = store.locate(rel_path)
+            if stat.S_ISLNK(st.st_mode):
+                data = store.read(rel_path)
+                if os.fsencode(os.readlink(source)) != data:
+                    report.add_mismatch(rel_path, "symlink", os.readlink(source), os.fsdecode(data))
+            elif length != st.st_size:
+                report.add_mismatch(rel_path, "size", st.st_size, length)
+            else:
+                source_hash = self.digest(source, st, self.source_cache, report)
+                if pack is None:
+                    # Large files are kept loose and streamed like any other copy
+                    stored_hash = self.digest(path, os.stat(path), self.destination_cache, report)
+                else:
+                    stored_hash = self.digest_packed(path, pack, offset, length, report)
+                if source_hash != stored_hash:
+                    report.add_mismatch(rel_path, "content", source_hash)
+        except OSError as e:
+            report.add_mismatch(rel_path, "unreadable", str(e))
+        if self.progress is not None:
+            self.progress(1, st.st_size)
+
+    def digest_packed(self, path, pack, offset, length, report):
+        cache = self.destination_cache
+        mtime_ns = os.stat(path).st_mtime_ns
+        if cache is not None and not self.full:
+            digest = cache.get_packed(pack, offset, length, mtime_ns)
+            if digest is not None:
+                report.add_cached()
+                return digest
+        digest = hash_file(path, offset, length)
+        report.add_read(length)
+        if cache is not None:
+            cache.put_packed(pack, offset, length, mtime_ns, digest)
+        return digest
+
+    def verify_packs(self, store, sources, report):
+        """Check the files below sources against a pack store, reading them through the pack index.
+
+        Sources are walked the way the store walks them, with its rules; files the
+        index does not have are reported missing.
+        """
+        stored = {row[0] for row in store.entries()}
+        pending = threading.BoundedSemaphore(self.workers * 4)
+
+        def task(*args):
+            try:
+                self.compare_packed(*args)
+            finally:
+                pending.release()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for source in sources:
+                for path, rel_path, st in store.walk(source.rstrip(os.sep) or os.sep, report):
+                    if not self.running:
+                        break
+                    if rel_path not in stored:
+                        with report.lock:
+                            report.files += 1
+                        report.add_mismatch(rel_path, "missing")
+                        if self.progress is not None:
+                            self.progress(1, st.st_size)
+                        continue
+                    pending.acquire()
+                    executor.submit(task, store, rel_path, path, report)
+        return report
+
+
+def open_caches(destination):
+    """The source hash cache in the user's cache folder and the destination's own one."""
+    return (HashCache(default_cache_path()),
+            HashCache(os.path.join(state_dir(destination), HASH_CACHE_NAME), use_device=False))
@@ -0,0 +1,392 @@
+import ctypes
+import errno
+import os
+import select
+import stat
+import struct
+import threading
+import time
+from copy_engine import TEMP_SUFFIX, copy_file, copy_symlink, needs_copy
+from profiles import DATABASE_SUFFIX, JOURNAL_SUFFIXES, DatabaseCopier, DatabaseResult, find_profiles, profile_rules
+from rules import compile_rules
+
+# Quiet period that closes a batch, and the longest a busy batch may be held back
+DEBOUNCE = 2.0
+MAX_DELAY = 30.0
+# How often subtrees that could not be watched are rescanned instead
+RESCAN_INTERVAL = 60.0
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+EVENT = struct.Struct("iIII")
+READ_SIZE = 64 * 1024
+
+
+class Inotify:
+    """Minimal ctypes binding to the Linux inotify API."""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available on this system")
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise self.error()
+
+    def error(self, path=None):
+        code = ctypes.get_errno()
+        return OSError(code, os.strerror(code), path)
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise self.error(path)
+        return wd
+
+    def rm_watch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self):
+        """Return every queued (wd, mask, name) event without blocking."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class WatchResult:
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.errors = []  # List of (path, message) tuples
+
+    def add_error(self, path, error):
+        self.errors.append((path, str(error)))
+
+
+class Watcher:
+    """Keeps a mirror seconds-fresh by copying only the paths inotify reports as touched.
+
+    Events are collected until the sources have been quiet for debounce seconds (or
+    max_delay has passed), then the batch is copied. Queue overflows and new folders
+    are handled by rescanning the affected folders, which only stats files; subtrees
+    beyond the inotify watch limit are rescanned every rescan_interval seconds.
+    Paths excluded by a source's rules (gitignore-style patterns per source) are
+    neither watched nor copied. destination may be a list, every change is then
+    copied to each of them.
+
+    As in a mirror run, browser profiles get their caches excluded and their SQLite
+    databases backed up with the sqlite3 backup API whenever they change, never
+    copied as plain files while the browser writes them.
+    """
+
+    def __init__(self, jobs, destination, log, debounce=DEBOUNCE, max_delay=MAX_DELAY,
+                 rescan_interval=RESCAN_INTERVAL, rules=None):
+        self.jobs = [(source.rstrip(os.sep) or os.sep, mode) for source, mode in jobs]
+        self.profiles = {}  # Source: relative paths of the browser profiles in it
+        lines = {(source.rstrip(os.sep) or os.sep): list(patterns) for source, patterns in (rules or {}).items()}
+        for source, _ in self.jobs:
+            profiles = find_profiles(source)
+            if profiles:
+                self.profiles[source] = profiles
+                lines[source] = profile_rules(profiles) + lines.get(source, [])
+        self.rules = compile_rules(lines)  # Source: rules.Rules
+        self.destinations = destination if isinstance(destination, list) else [destination]
+        self.databases = [DatabaseCopier(destination) for destination in self.destinations] if self.profiles else []
+        self.log = log
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.rescan_interval = rescan_interval
+        self.running = True
+        self.inotify = Inotify()
+        self.wake_read, self.wake_write = os.pipe()
+        # Keeps stop() from writing to the pipe once run() closed it; reentrant for signal handlers
+        self.wake_lock = threading.RLock()
+        self.closed = False
+        # Paths "in the mirror" are relative to each destination
+        self.watches = {}  # wd: (folder, folder in the mirror)
+        self.unwatched = {}  # Folders beyond the watch limit: folder in the mirror
+        self.touched = {}  # Path: path in the mirror
+        self.rescans = {}  # Folder: folder in the mirror
+        self.database_sources = set()  # Sources with a changed database in a profile
+        self.first_event = None
+        self.last_event = None
+        self.next_poll = None
+
+    def target_root(self, source, mode):
+        """Where a source lands in the mirror, matching what a Sync run writes."""
+        if mode == "rsync":
+            return ""  # rsync copies the contents of source/ into the destination
+        return os.path.basename(source)
+
+    def excluded(self, path, is_dir):
+        """Whether the rules of the source containing path exclude it."""
+        for source in self.rules:
+            if path.startswith(source + os.sep):
+                if self.rules[source].excludes(path[len(source) + 1:], is_dir):
+                    return True
+        return False
+
+    def database_source(self, path):
+        """The source whose profile databases path belongs to, if it is a database or one of its journals."""
+        name = os.path.basename(path)
+        if not any(name.endswith(DATABASE_SUFFIX + suffix) for suffix in ("",) + JOURNAL_SUFFIXES):
+            return None
+        for source in self.profiles:
+            if path.startswith(source + os.sep):
+                return source
+        return None
+
+    def sources_below(self, folders):
+        """The sources with profiles that a rescan of folders covers, their databases need a look too."""
+        return {source for source in self.profiles for folder in folders
+                if folder == source or folder.startswith(source + os.sep)}
+
+    def stop(self):
+        self.running = False
+        for databases in self.databases:
+            databases.stop()
+        with self.wake_lock:
+            if not self.closed:
+                os.write(self.wake_write, b"x")
+
+    def watch_tree(self, root, target):
+        """Watch root and every folder below it, falling back to polling at the watch limit."""
+        stack = [(root, target)]
+        while stack:
+            path, dst = stack.pop()
+            try:
+                wd = self.inotify.add_watch(path)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    if not self.unwatched:
+                        self.log.push("inotify watch limit reached (fs.inotify.max_user_watches), "
+                                      f"rescanning the rest every {self.rescan_interval:.0f} s")
+                    self.unwatched[path] = dst
+                    self.next_poll = self.next_poll or time.monotonic() + self.rescan_interval
+                elif e.errno != errno.ENOENT:
+                    self.log.push(f"Cannot watch {path}: {e.strerror}")
+                continue
+            self.watches[wd] = (path, dst)
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False) and not self.excluded(entry.path, True):
+                            stack.append((entry.path, os.path.join(dst, entry.name)))
+            except OSError as e:
+                self.log.push(f"Cannot list {path}: {e.strerror}")
+
+    def unwatch_tree(self, root):
+        """Drop the watches of a folder that was moved away, its paths are stale now."""
+        prefix = root + os.sep
+        for wd, (path, _) in list(self.watches.items()):
+            if path == root or path.startswith(prefix):
+                self.inotify.rm_watch(wd)
+                del self.watches[wd]
+
+    def handle_events(self):
+        now = time.monotonic()
+        for wd, mask, name in self.inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so nothing short of a rescan of every source is trustworthy
+                self.log.push("inotify queue overflowed, rescanning all sources")
+                for source, mode in self.jobs:
+                    self.rescans[source] = self.target_root(source, mode)
+            elif mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+            elif wd in self.watches and name:
+                folder, dst_folder = self.watches[wd]
+                path, dst = os.path.join(folder, name), os.path.join(dst_folder, name)
+                if self.rules and self.excluded(path, bool(mask & IN_ISDIR)):
+                    source = self.database_source(path)
+                    if source is None:
+                        continue
+                    self.database_sources.add(source)
+                elif mask & IN_ISDIR:
+                    if mask & IN_MOVED_FROM:
+                        self.unwatch_tree(path)
+                    elif mask & (IN_CREATE | IN_MOVED_TO):
+                        # Files may have landed in it before its watch was added
+                        self.watch_tree(path, dst)
+                        self.rescans[path] = dst
+                    else:
+                        continue
+                else:
+                    self.touched[path] = dst
+            else:
+                continue
+            self.last_event = now
+            self.first_event = self.first_event or now
+
+    def copy_path(self, path, rel_path, result):
+        try:
+            st = os.lstat(path)
+        except FileNotFoundError:
+            return  # Deleted again, a mirror keeps files removed from the source
+        except OSError as e:
+            result.add_error(path, e)
+            return
+        if not (stat.S_ISLNK(st.st_mode) or stat.S_ISREG(st.st_mode)):
+            return
+        for destination in self.destinations:
+            dst = os.path.join(destination, rel_path)
+            try:
+                if not needs_copy(st, dst):
+                    continue
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                if stat.S_ISLNK(st.st_mode):
+                    copy_symlink(path, dst)
+                else:
+                    result.bytes += self.copy_file(path, dst, st)
+                result.files += 1
+            except OSError as e:
+                result.add_error(path, e)
+
+    def copy_file(self, path, dst, st):
+        """Copy next to dst and rename, so the mirror never holds a half-written file."""
+        tmp = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}{TEMP_SUFFIX}")
+        try:
+            size = copy_file(path, tmp, st)
+            os.replace(tmp, dst)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        return size
+
+    def backup_databases(self, sources):
+        """Back up the changed databases in the profiles of sources to every destination."""
+        modes = dict(self.jobs)
+        for source in sources:
+            for databases in self.databases:
+                target = os.path.join(databases.destination, self.target_root(source, modes[source]))
+                result = databases.copy(source, self.profiles[source], target, DatabaseResult(),
+                                        self.rules.get(source))
+                if result.files:
+                    self.log.push(f"Watch: backed up {result.files} browser databases ({result.bytes} bytes) "
+                                  f"of {source}")
+                for path, message in result.plain:
+                    self.log.push(f"Copied {path} as a plain file, it may be inconsistent: {message}")
+                for path, message in result.errors:
+                    self.log.push(f"Failed to back up {path}: {message}")
+                try:
+                    databases.save()
+                except OSError as e:
+                    self.log.push(f"Cannot record database fingerprints in {databases.destination}: {e.strerror}")
+
+    def rescan(self, root, target, result):
+        """Copy whatever below root differs from the mirror, comparing only metadata."""
+        stack = [(root, target)]
+        while stack and self.running:
+            path, dst = stack.pop()
+            try:
+                for destination in self.destinations:
+                    os.makedirs(os.path.join(destination, dst), exist_ok=True)
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        if self.rules and self.excluded(entry.path, is_dir):
+                            continue
+                        if is_dir:
+                            stack.append((entry.path, os.path.join(dst, entry.name)))
+                        else:
+                            self.copy_path(entry.path, os.path.join(dst, entry.name), result)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                result.add_error(path, e)
+
+    def flush(self):
+        """Copy the current batch of touched paths and folders to rescan."""
+        touched, rescans, database_sources = self.touched, self.rescans, self.database_sources
+        self.touched, self.rescans, self.database_sources = {}, {}, set()
+        self.first_event = self.last_event = None
+        result = WatchResult()
+        prefixes = tuple(folder + os.sep for folder in rescans)
+        for folder, dst in rescans.items():
+            self.rescan(folder, dst, result)
+        for path, dst in touched.items():
+            if not (prefixes and path.startswith(prefixes)):
+                self.copy_path(path, dst, result)
+        self.report(result, f"{len(touched)} changed paths" + (f", {len(rescans)} rescans" if rescans else ""))
+        self.backup_databases(database_sources | self.sources_below(rescans))
+
+    def report(self, result, what):
+        if result.files or result.errors:
+            self.log.push(f"Watch: {what}, copied {result.files} files ({result.bytes} bytes)")
+        for path, message in result.errors:
+            self.log.push(f"Failed to copy {path}: {message}")
+
+    def timeout(self):
+        """Seconds select may sleep; None blocks until the next event when nothing is pending."""
+        deadlines = []
+        if self.last_event is not None:
+            deadlines.append(min(self.last_event + self.debounce, self.first_event + self.max_delay))
+        if self.next_poll is not None:
+            deadlines.append(self.next_poll)
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - time.monotonic())
+
+    def run(self):
+        """Bring the mirror up to date, then copy changes as they happen until stop()."""
+        result = WatchResult()
+        for source, mode in self.jobs:
+            self.watch_tree(source, self.target_root(source, mode))
+            self.rescan(source, self.target_root(source, mode), result)
+        self.report(result, "initial rescan")
+        self.backup_databases(list(self.profiles))
+        self.log.push(f"Watching {len(self.watches)} folders for changes")
+
+        try:
+            while self.running:
+                ready, _, _ = select.select([self.inotify.fd, self.wake_read], [], [], self.timeout())
+                if self.inotify.fd in ready:
+                    self.handle_events()
+                now = time.monotonic()
+                if self.last_event is not None and (now >= self.last_event + self.debounce or
+                                                    now >= self.first_event + self.max_delay):
+                    self.flush()
+                if self.next_poll is not None and now >= self.next_poll:
+                    result = WatchResult()
+                    for folder, dst in self.unwatched.items():
+                        self.rescan(folder, dst, result)
+                    self.report(result, f"polled {len(self.unwatched)} unwatched folders")
+                    self.backup_databases(self.sources_below(self.unwatched))
+                    self.next_poll = now + self.rescan_interval
+            if self.touched or self.rescans or self.database_sources:
+                self.flush()  # Don't lose the last batch when watching is stopped
+        finally:
+            self.inotify.close()
+            with self.wake_lock:
+                self.closed = True
+                os.close(self.wake_read)
+                os.close(self.wake_write)